@@ -1,7 +1,13 @@
+import json
+
 from django.contrib import admin
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import User
-from .models import UserProfile
+from .models import UserProfile, QueryReport, ProfileReport
 
 
 class UserProfileInline(admin.StackedInline):
@@ -24,3 +30,59 @@ class CustomUserAdmin(UserAdmin):
 # Re-register UserAdmin
 admin.site.unregister(User)
 admin.site.register(User, CustomUserAdmin)
+
+
+@admin.register(QueryReport)
+class QueryReportAdmin(admin.ModelAdmin):
+    list_display = ('kind', 'view', 'location', 'occurrences', 'max_runs', 'max_duration_ms', 'last_seen')
+    list_filter = ('kind', 'view')
+    search_fields = ('view', 'shape', 'location')
+    readonly_fields = (
+        'kind', 'view', 'shape', 'location', 'occurrences', 'max_runs', 'max_duration_ms',
+        'plan', 'first_seen', 'last_seen'
+    )
+    
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(ProfileReport)
+class ProfileReportAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'method', 'path', 'view', 'user', 'mode', 'duration_ms', 'query_count', 'download_link')
+    list_filter = ('mode', 'view')
+    search_fields = ('path', 'view', 'user__username')
+    raw_id_fields = ('user', 'created_by')
+    readonly_fields = (
+        'user', 'created_by', 'mode', 'view', 'method', 'path', 'status_code', 'duration_ms',
+        'query_count', 'query_duration_ms', 'download_link', 'timeline', 'created_at'
+    )
+    exclude = ('sql_timeline',)
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def get_urls(self):
+        urls = [
+            path(
+                '<int:pk>/download/',
+                self.admin_site.admin_view(self.download_view),
+                name='accounts_profilereport_download'
+            ),
+        ]
+        return urls + super().get_urls()
+    
+    def download_view(self, request, pk):
+        """Download the profile, to open with pstats/snakeviz or speedscope."""
+        report = get_object_or_404(ProfileReport, pk=pk)
+        response = HttpResponse(bytes(report.data), content_type='application/octet-stream')
+        response['Content-Disposition'] = f'attachment; filename="{report.filename}"'
+        return response
+    
+    @admin.display(description='Profile')
+    def download_link(self, obj):
+        url = reverse('admin:accounts_profilereport_download', args=[obj.pk])
+        return format_html('<a href="{}">{}</a>', url, obj.filename)
+    
+    @admin.display(description='SQL timeline')
+    def timeline(self, obj):
+        return format_html('<pre>{}</pre>', json.dumps(obj.sql_timeline, indent=2))
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class AccountsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.accounts'
+
+    def ready(self):
+        from django.conf import settings
+        from .memory import start_tracing
+
+        frames = getattr(settings, 'MEMORY_TRACE_FRAMES', 0)
+        if frames:
+            start_tracing(frames)
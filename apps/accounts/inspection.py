@@ -0,0 +1,156 @@
+"""
+Request inspection for RequestValidationMiddleware.
+The keywords of all rules are compiled into one pattern, so each value of a
+request is scanned once, in time linear in its length, whatever the number
+of rules.
+"""
+import re
+import time
+
+
+class Rule:
+    """
+    A suspicious pattern: a keyword, optionally followed later on the same
+    line by a second keyword (like the regex 'SELECT.*FROM', without the
+    backtracking). Both keywords ignore case.
+
+    fields limits the rule to some request fields ('path' is the request path).
+    """
+
+    def __init__(self, name, keyword, then=None, fields=None):
+        self.name = name
+        self.keyword = keyword.lower()
+        self.then = then.lower() if then else None
+        self.fields = set(fields) if fields else None
+
+    def applies_to(self, field):
+        return self.fields is None or field in self.fields
+
+    def __repr__(self):
+        return f'<Rule {self.name}>'
+
+
+class Exemption:
+    """Fields whose values are not inspected on the paths matching path_pattern."""
+
+    def __init__(self, path_pattern, fields):
+        self.path_pattern = re.compile(path_pattern)
+        self.fields = set(fields)
+
+
+DEFAULT_RULES = [
+    Rule('xss-script-tag', '<script', then='>'),
+    Rule('sql-select', 'select', then='from'),
+    Rule('sql-delete', 'delete', then='from'),
+    Rule('sql-update', 'update', then='set'),
+    Rule('path-traversal', '../'),
+    Rule('system-file', 'etc/passwd'),
+]
+
+DEFAULT_EXEMPTIONS = [
+    # Note bodies are free text that may quote SQL or HTML, they are checked
+    # by the note validators and escaped when displayed
+    Exemption(r'^/(api/)?notes/', ['content', 'changes']),
+]
+
+# Characters of a request inspected at most, the rest is not scanned
+DEFAULT_MAX_LENGTH = 64 * 1024
+
+
+class InspectionResult:
+    """Outcome of the inspection of a request."""
+
+    def __init__(self, rule=None, field=None, inspected=0, elapsed=0.0):
+        self.rule = rule
+        self.field = field
+        self.inspected = inspected
+        self.elapsed = elapsed
+
+    @property
+    def blocked(self):
+        return self.rule is not None
+
+
+class RequestInspector:
+    """Check the path, GET and POST values of requests against a list of rules."""
+
+    def __init__(self, rules=None, exemptions=None, max_length=DEFAULT_MAX_LENGTH):
+        self.rules = list(DEFAULT_RULES if rules is None else rules)
+        self.exemptions = list(DEFAULT_EXEMPTIONS if exemptions is None else exemptions)
+        self.max_length = max_length
+
+        keywords = {rule.keyword for rule in self.rules} | {rule.then for rule in self.rules if rule.then}
+        # Longest first, so a keyword is not cut short by one of its prefixes
+        alternatives = [re.escape(keyword) for keyword in sorted(keywords, key=len, reverse=True)]
+        # A newline ends the line a second keyword must be found on
+        self.pattern = re.compile('|'.join(alternatives + ['\n']), re.IGNORECASE)
+
+        # Rules for each field, found once per field name
+        self._field_rules = {}
+
+    def rules_for(self, field):
+        rules = self._field_rules.get(field)
+        if rules is None:
+            rules = self._field_rules[field] = [rule for rule in self.rules if rule.applies_to(field)]
+        return rules
+
+    def scan(self, value, rules):
+        """Get the first of rules matching value, or None."""
+        if not rules:
+            return None
+
+        pending = set()  # Rules whose first keyword was seen on the current line
+        for match in self.pattern.finditer(value):
+            keyword = match.group().lower()
+            if keyword == '\n':
+                pending.clear()
+                continue
+            for rule in rules:
+                if rule.then == keyword and rule in pending:
+                    return rule
+                if rule.keyword == keyword:
+                    if rule.then is None:
+                        return rule
+                    pending.add(rule)
+        return None
+
+    def request_values(self, request):
+        """Yield the (field, value) pairs of a request that are inspected."""
+        yield 'path', request.path
+
+        exempt = set()
+        for exemption in self.exemptions:
+            if exemption.path_pattern.search(request.path):
+                exempt |= exemption.fields
+
+        for key, value in request.GET.items():
+            if key not in exempt:
+                yield key, f'{key}={value}'
+
+        # File uploads are not inspected
+        if not request.META.get('CONTENT_TYPE', '').startswith('multipart/form-data'):
+            for key, value in request.POST.items():
+                if key not in exempt:
+                    yield key, f'{key}={value}'
+
+    def inspect(self, request):
+        """Inspect a request, stopping at the first rule that matches."""
+        started = time.perf_counter()
+        result = InspectionResult()
+
+        remaining = self.max_length
+        for field, value in self.request_values(request):
+            if remaining <= 0:
+                break
+            value = value[:remaining]
+            remaining -= len(value)
+            result.inspected += len(value)
+
+            rule = self.scan(value, self.rules_for(field))
+            if rule is not None:
+                result.rule = rule
+                result.field = field
+                break
+
+        result.elapsed = time.perf_counter() - started
+        return result
@@ -0,0 +1,41 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.accounts.profiling import PROFILE_MODES, PROFILE_PARAM, make_profile_token
+
+
+class Command(BaseCommand):
+    """Sign a token that profiles the requests carrying it."""
+    help = (
+        f"Make a token to add to a URL as ?{PROFILE_PARAM}=<token> (or send as an X-Profile header) "
+        "to profile that request. Profiles are listed in the admin under Profile reports."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--admin',
+            required=True,
+            help='Username of the admin asking for the profiles'
+        )
+        parser.add_argument(
+            '--user',
+            help='Only profile the requests of this username (default: any user)'
+        )
+        parser.add_argument(
+            '--mode',
+            choices=PROFILE_MODES,
+            default='cprofile',
+            help="'cprofile' for a deterministic pstats profile, 'sample' for a speedscope flamegraph (default: cprofile)"
+        )
+
+    def handle(self, *args, **options):
+        try:
+            created_by = User.objects.get(username=options['admin'])
+            user = User.objects.get(username=options['user']) if options['user'] else None
+        except User.DoesNotExist as e:
+            raise CommandError(str(e))
+        if not (created_by.is_superuser or created_by.is_staff or created_by.profile.is_admin):
+            raise CommandError(f"{created_by.username} is not an admin.")
+
+        token = make_profile_token(created_by, user=user, mode=options['mode'])
+        self.stdout.write(f'?{PROFILE_PARAM}={token}')
@@ -0,0 +1,126 @@
+"""
+Worker memory diagnostics for Notes Manager application.
+MemoryMiddleware records the memory of the worker after each request and
+which views raise its peak, and recycles the worker once it goes over
+MEMORY_MAX_RSS_MB. tracemalloc snapshots of a worker are taken on demand
+from /metrics/memory and compared to find the code holding on to memory.
+Tracing slows every allocation down, so tracing started for a snapshot stops
+after MEMORY_TRACE_SECONDS.
+"""
+import logging
+import os
+import resource
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+
+
+logger = logging.getLogger(__name__)
+
+# Snapshots kept per worker, the newest is compared to the one before
+_snapshots = []
+_lock = threading.Lock()
+_recycling = False
+
+# Timer stopping the tracing started for snapshots, and when it fires
+_stop_timer = None
+_tracing_until = None
+
+
+def current_rss():
+    """Get the resident memory of this process in bytes, or None if unknown."""
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_rss():
+    """Get the highest resident memory of this process so far, in bytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def start_tracing(frames=10, duration=None):
+    """
+    Start tracing allocations in this worker, keeping frames frames per
+    allocation, for duration seconds or until stop_tracing().
+    """
+    global _stop_timer, _tracing_until
+    with _lock:
+        if tracemalloc.is_tracing():
+            return
+        tracemalloc.start(frames)
+        if duration:
+            _stop_timer = threading.Timer(duration, stop_tracing)
+            _stop_timer.daemon = True
+            _stop_timer.start()
+            _tracing_until = time.monotonic() + duration
+
+
+def stop_tracing():
+    """Stop tracing allocations in this worker, the snapshots taken so far are kept."""
+    global _stop_timer, _tracing_until
+    with _lock:
+        if _stop_timer is not None:
+            _stop_timer.cancel()
+        _stop_timer = _tracing_until = None
+        tracemalloc.stop()
+
+
+def tracing_status():
+    """Describe whether allocations are traced in this worker and until when."""
+    if not tracemalloc.is_tracing():
+        return 'no'
+    if _tracing_until is None:
+        return 'yes, until stopped'
+    return f'yes, stops in {max(0, round(_tracing_until - time.monotonic()))} s'
+
+
+def take_snapshot():
+    """Snapshot the traced allocations of this worker, keeping the previous snapshot."""
+    snapshot = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    ])
+    with _lock:
+        _snapshots[:] = _snapshots[-1:] + [snapshot]
+    return snapshot
+
+
+def top_allocations(limit=20):
+    """Describe the allocation sites holding the most memory in the latest snapshot."""
+    with _lock:
+        if not _snapshots:
+            return []
+        latest = _snapshots[-1]
+    return [str(stat) for stat in latest.statistics('lineno')[:limit]]
+
+
+def allocation_growth(limit=20):
+    """Describe the allocation sites that grew most between the last two snapshots."""
+    with _lock:
+        if len(_snapshots) < 2:
+            return []
+        previous, latest = _snapshots
+    return [str(stat) for stat in latest.compare_to(previous, 'lineno')[:limit]]
+
+
+def recycle_worker(rss):
+    """Ask the gunicorn worker to exit once it has answered the current request."""
+    global _recycling
+    if _recycling:
+        return
+    if 'gunicorn' not in sys.modules:
+        logger.warning(f"Memory {rss // (1024 * 1024)} MB is over the limit, not recycling outside gunicorn")
+        _recycling = True
+        return
+
+    _recycling = True
+    logger.warning(f"Memory {rss // (1024 * 1024)} MB is over the limit, recycling worker {os.getpid()}")
+    # Gunicorn workers exit gracefully on SIGTERM and the arbiter starts a new one
+    os.kill(os.getpid(), signal.SIGTERM)
@@ -0,0 +1,264 @@
+"""
+Request metrics for Notes Manager application.
+Each worker records its metrics in memory and writes a snapshot of them to
+METRICS_DIR every few seconds and when it exits. The /metrics endpoint adds up
+the snapshots of all workers and renders them in the Prometheus text format.
+Snapshots of workers that exited are folded into one file of exited workers,
+so recycled workers neither disappear from the counters nor stay around.
+"""
+import atexit
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+
+from django.conf import settings
+
+
+# Seconds between two snapshots written by a worker
+FLUSH_INTERVAL = 5
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+RSS_BUCKETS = tuple(megabytes * 1024 * 1024 for megabytes in (64, 128, 192, 256, 384, 512, 768, 1024, 2048))
+
+# Methods recorded as they are, any other method is recorded as 'other'
+HTTP_METHODS = frozenset(('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'))
+
+# Files in METRICS_DIR besides the metrics-<pid>.json snapshots of the workers
+EXITED_FILE = 'exited-workers.json'
+LOCK_FILE = 'metrics.lock'
+
+# Name: (type, help, label names, buckets)
+METRICS = {
+    'notes_http_requests_total': (
+        'counter', 'Requests by view, method and status.', ('view', 'method', 'status'), None
+    ),
+    'notes_http_request_duration_seconds': (
+        'histogram', 'Time to respond to a request.', ('view',), LATENCY_BUCKETS
+    ),
+    'notes_db_queries_per_request': (
+        'histogram', 'Database queries run by a request.', ('view',), QUERY_COUNT_BUCKETS
+    ),
+    'notes_db_query_duration_seconds': (
+        'histogram', 'Time spent in database queries by a request.', ('view',), LATENCY_BUCKETS
+    ),
+    'notes_http_response_size_bytes': (
+        'histogram', 'Size of the response bodies.', ('view',), SIZE_BUCKETS
+    ),
+    'notes_request_rejections_total': (
+        'counter', 'Requests refused by rate limiting or request validation.', ('reason', 'rule'), None
+    ),
+    'notes_worker_rss_bytes': (
+        'histogram', 'Resident memory of the worker after a request.', ('view',), RSS_BUCKETS
+    ),
+    'notes_worker_peak_rss_growth_bytes_total': (
+        'counter', 'Growth of the peak resident memory of the workers during requests.', ('view',), None
+    ),
+}
+
+
+class MetricsRegistry:
+    """Metrics of this process, as plain values that can be written as JSON."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (name, labels) -> value for counters, or [bucket counts..., sum, count] for histograms
+        self.values = {}
+        self.flushed_at = time.monotonic()
+        # Process that last wrote a snapshot, to notice the first write of a forked worker
+        self.flushed_pid = None
+
+    def inc(self, name, labels, amount=1):
+        key = (name, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][3]
+        key = (name, labels)
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [0] * (len(buckets) + 2)
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    # Counts are per bucket here, made cumulative when rendered
+                    series[index] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return [[name, list(labels), list(value) if isinstance(value, list) else value]
+                    for (name, labels), value in self.values.items()]
+
+    def flush(self, force=False):
+        """Write the snapshot of this process to METRICS_DIR, at most every FLUSH_INTERVAL seconds."""
+        directory = getattr(settings, 'METRICS_DIR', None)
+        now = time.monotonic()
+        if not directory or (not force and now - self.flushed_at < FLUSH_INTERVAL):
+            return
+        self.flushed_at = now
+
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'metrics-{os.getpid()}.json')
+        if self.flushed_pid != os.getpid():
+            # A snapshot under this pid was left by an exited process that had it before
+            self.flushed_pid = os.getpid()
+            _retire(directory, path)
+        _write_snapshot(path, self.snapshot())
+
+
+registry = MetricsRegistry()
+
+# Counts since the last periodic snapshot are written when a worker exits,
+# including gunicorn workers stopped with SIGTERM
+atexit.register(registry.flush, force=True)
+
+
+def _write_snapshot(path, snapshot):
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w') as file:
+        json.dump(snapshot, file)
+    # Readers never see a partly written file
+    os.replace(temporary, path)
+
+
+def _process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Running as another user
+        return True
+    return True
+
+
+def _retire(directory, path):
+    """Add the snapshot of an exited worker to the totals of exited workers and remove it."""
+    with open(os.path.join(directory, LOCK_FILE), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            with open(path) as file:
+                snapshot = json.load(file)
+        except FileNotFoundError:
+            # Retired by another process
+            return
+        except (OSError, ValueError):
+            snapshot = []
+
+        totals = {}
+        exited = os.path.join(directory, EXITED_FILE)
+        try:
+            with open(exited) as file:
+                _merge(totals, json.load(file))
+        except (OSError, ValueError):
+            pass
+        _merge(totals, snapshot)
+        _write_snapshot(exited, [[name, list(labels), value] for (name, labels), value in totals.items()])
+        os.remove(path)
+
+
+def method_label(method):
+    """Get the method label of a request, keeping the label values bounded."""
+    return method if method in HTTP_METHODS else 'other'
+
+
+def _merge(totals, snapshot):
+    for name, labels, value in snapshot:
+        if name not in METRICS:
+            continue
+        key = (name, tuple(labels))
+        if isinstance(value, list):
+            current = totals.get(key)
+            totals[key] = value if current is None else [a + b for a, b in zip(current, value)]
+        else:
+            totals[key] = totals.get(key, 0) + value
+
+
+def collect():
+    """Add up the metrics of this process and of the snapshots of the other workers."""
+    totals = {}
+    _merge(totals, registry.snapshot())
+
+    directory = getattr(settings, 'METRICS_DIR', None)
+    if directory:
+        own = os.path.join(directory, f'metrics-{os.getpid()}.json')
+        paths = []
+        for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+            if path == own:
+                continue
+            pid = os.path.basename(path)[len('metrics-'):-len('.json')]
+            if pid.isdigit() and not _process_exists(int(pid)):
+                _retire(directory, path)
+            else:
+                paths.append(path)
+
+        for path in [os.path.join(directory, EXITED_FILE)] + paths:
+            try:
+                with open(path) as file:
+                    _merge(totals, json.load(file))
+            except (OSError, ValueError):
+                # Removed or replaced while reading
+                continue
+    return totals
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{value}"' for name, value in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render():
+    """Render the metrics of all workers in the Prometheus text format."""
+    totals = collect()
+    lines = []
+    for name, (kind, help_text, label_names, buckets) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        series = sorted((labels, value) for (metric, labels), value in totals.items() if metric == name)
+        for labels, value in series:
+            if kind == 'counter':
+                lines.append(f'{name}{_format_labels(label_names, labels)} {_format_number(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets, value):
+                cumulative += count
+                extra = (('le', _format_number(bound)),)
+                lines.append(f'{name}_bucket{_format_labels(label_names, labels, extra)} {cumulative}')
+            extra = (('le', '+Inf'),)
+            lines.append(f'{name}_bucket{_format_labels(label_names, labels, extra)} {value[-1]}')
+            lines.append(f'{name}_sum{_format_labels(label_names, labels)} {_format_number(value[-2])}')
+            lines.append(f'{name}_count{_format_labels(label_names, labels)} {value[-1]}')
+    return '\n'.join(lines) + '\n'
+
+
+class QueryTimer:
+    """Database execute wrapper counting the queries of a request and their time."""
+
+    def __init__(self):
+        self.count = 0
+        self.elapsed = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.elapsed += time.perf_counter() - started
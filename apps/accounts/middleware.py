@@ -1,15 +1,88 @@
 from django.shortcuts import redirect
 from django.contrib import messages
-from django.urls import reverse
+from django.urls import reverse, resolve, Resolver404
 from django.http import HttpResponseForbidden, JsonResponse
-from django.core.cache import cache
-import re
-import time
+from django.db import connection
+from django.conf import settings
 import logging
+import time
+
+from . import memory, metrics
+from .queries import QueryInspector
+from .profiling import (
+    PROFILE_PARAM, PROFILE_HEADER, PROFILE_MODES, PROFILERS, SQLTimeline, read_profile_token
+)
+from .inspection import RequestInspector, DEFAULT_MAX_LENGTH
+from .ratelimit import get_rate_limiter
+from .roles import attach_roles, get_user_roles
+from .models import ProfileReport
 
 # Configure logger
 logger = logging.getLogger(__name__)
 
+# Route class of the paths starting with each prefix, first match wins,
+# other paths are 'html'
+ROUTE_PREFIXES = (
+    ('/static/', 'static'),
+    ('/media/', 'static'),
+    ('/health/', 'health'),
+    ('/api/', 'api'),
+    ('/api-auth/', 'auth'),
+    ('/auth/', 'auth'),
+    ('/accounts/login/', 'auth'),
+    ('/accounts/register/', 'auth'),
+    ('/admin/login/', 'auth'),
+)
+
+# Content Security Policy of all responses
+CSP_DIRECTIVES = [
+    "default-src 'self'",
+    "script-src 'self' 'unsafe-inline' https://cdn.jsdelivr.net",
+    "style-src 'self' 'unsafe-inline' https://cdn.jsdelivr.net",
+    "img-src 'self' data: https:",
+    "font-src 'self' https://cdn.jsdelivr.net",
+    "connect-src 'self'",
+    "frame-ancestors 'none'",
+    "form-action 'self'",
+]
+
+SECURITY_HEADERS = {
+    'Content-Security-Policy': '; '.join(CSP_DIRECTIVES),
+    'X-Content-Type-Options': 'nosniff',
+    'X-Frame-Options': 'DENY',
+    'X-XSS-Protection': '1; mode=block',
+    'Referrer-Policy': 'strict-origin-when-cross-origin',
+}
+
+
+def classify_request(path):
+    """Get the route class of a path: 'static', 'health', 'api', 'auth' or 'html'."""
+    for prefix, route_class in ROUTE_PREFIXES:
+        if path.startswith(prefix):
+            return route_class
+    return 'html'
+
+
+def get_route_class(request):
+    """Get the route class of a request, classified once per request."""
+    route_class = getattr(request, 'route_class', None)
+    if route_class is None:
+        route_class = request.route_class = classify_request(request.path)
+    return route_class
+
+
+
+def get_view_name(request):
+    """Get the URL name of the view of a request, once it has been handled."""
+    match = request.resolver_match
+    if match is None:
+        # Refused before the view was resolved
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return 'unresolved'
+    return match.view_name
+
 
 class RoleMiddleware:
     """Middleware to check user roles and restrict access accordingly."""
@@ -25,6 +98,9 @@ class RoleMiddleware:
         ]
     
     def __call__(self, request):
+        # Role flags of the user, resolved once per request for all checks
+        attach_roles(request)
+        
         # Skip middleware for anonymous users
         if not request.user.is_authenticated:
             return self.get_response(request)
@@ -33,17 +109,10 @@ class RoleMiddleware:
         
         # Check if the path is admin-only and user is not admin
         if any(path.startswith(admin_path) for admin_path in self.admin_only_paths):
-            # Allow superusers and staff
-            if request.user.is_superuser or request.user.is_staff:
+            # Allow superusers, staff and users with admin profile
+            if request.roles.can_manage:
                 return self.get_response(request)
             
-            # Allow users with admin profile
-            try:
-                if request.user.profile.is_admin:
-                    return self.get_response(request)
-            except:
-                pass
-            
             # Redirect non-admin users
             messages.error(request, "You don't have permission to access this area.")
             return redirect('notes:list')
@@ -58,24 +127,31 @@ class RequestValidationMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
         
-        # Patterns that could indicate malicious requests
-        self.suspicious_patterns = [
-            r'<script.*?>',  # Potential XSS
-            r'SELECT.*FROM',  # Potential SQL injection
-            r'DELETE.*FROM',  # Potential SQL injection
-            r'UPDATE.*SET',   # Potential SQL injection
-            r'\.\./',         # Path traversal
-            r'etc/passwd',    # Path traversal targeting system files
-        ]
+        # Patterns that could indicate malicious requests, see apps.accounts.inspection
+        self.inspector = RequestInspector(
+            rules=getattr(settings, 'REQUEST_INSPECTION_RULES', None),
+            exemptions=getattr(settings, 'REQUEST_INSPECTION_EXEMPTIONS', None),
+            max_length=getattr(settings, 'REQUEST_INSPECTION_MAX_LENGTH', DEFAULT_MAX_LENGTH),
+        )
     
     def __call__(self, request):
         # Skip validation for static files and media
-        if any(path in request.path for path in ['/static/', '/media/']):
+        if get_route_class(request) == 'static':
             return self.get_response(request)
         
         # Check if request contains suspicious patterns
-        if self._is_suspicious_request(request):
-            logger.warning(f"Suspicious request blocked: {request.path} from {request.META.get('REMOTE_ADDR')}")
+        inspection = self.inspector.inspect(request)
+        request.inspection = inspection
+        logger.debug(
+            "Request inspection of %s: %d characters in %.2f ms",
+            request.path, inspection.inspected, inspection.elapsed * 1000
+        )
+        if inspection.blocked:
+            request.rejection = ('validation', inspection.rule.name)
+            logger.warning(
+                f"Suspicious request blocked: {request.path} from {request.META.get('REMOTE_ADDR')} "
+                f"(rule {inspection.rule.name} on {inspection.field})"
+            )
             return HttpResponseForbidden("Request blocked for security reasons")
         
         # Proceed with valid request
@@ -83,32 +159,7 @@ class RequestValidationMiddleware:
     
     def _is_suspicious_request(self, request):
         """Check if request contains suspicious patterns."""
-        # Combine all request parameters for checking
-        request_data = []
-        
-        # Check GET parameters
-        for key, value in request.GET.items():
-            request_data.append(f"{key}={value}")
-        
-        # Check POST parameters if it's not a file upload
-        if not request.META.get('CONTENT_TYPE', '').startswith('multipart/form-data'):
-            for key, value in request.POST.items():
-                request_data.append(f"{key}={value}")
-        
-        # Check query string
-        if request.META.get('QUERY_STRING'):
-            request_data.append(request.META.get('QUERY_STRING'))
-        
-        # Check path
-        request_data.append(request.path)
-        
-        # Check if any suspicious pattern is found
-        for pattern in self.suspicious_patterns:
-            for data in request_data:
-                if re.search(pattern, data, re.IGNORECASE):
-                    return True
-        
-        return False
+        return self.inspector.inspect(request).blocked
 
 
 class RateLimitMiddleware:
@@ -123,43 +174,54 @@ class RateLimitMiddleware:
             'search': 30,  # 30 search requests per minute
             'auth': 10,  # 10 authentication requests per minute
         }
+        
+        # Counters shared by the workers, see apps.accounts.ratelimit
+        self.limiter = get_rate_limiter()
     
     def __call__(self, request):
         # Skip rate limiting for admin users
-        if request.user.is_authenticated and (request.user.is_superuser or 
-            (hasattr(request.user, 'profile') and request.user.profile.is_admin)):
+        roles = getattr(request, 'roles', None) or get_user_roles(request.user)
+        if roles.is_superuser or roles.is_admin:
             return self.get_response(request)
         
         path = request.path
         
         # Determine which endpoint group this request belongs to
         limit_group = None
-        if path.startswith('/api/'):
-            limit_group = 'api'
+        route_class = get_route_class(request)
+        if route_class in ('api', 'auth'):
+            limit_group = route_class
         elif '/search' in path or 'query' in request.GET:
             limit_group = 'search'
-        elif '/login' in path or '/register' in path or '/auth' in path:
-            limit_group = 'auth'
+        
+        if not limit_group:
+            return self.get_response(request)
         
         # Apply rate limiting if path belongs to a limited group
-        if limit_group and not self._check_rate_limit(request, limit_group):
+        result = self._check_rate_limit(request, limit_group)
+        if not result.allowed:
+            request.rejection = ('rate_limit', limit_group)
             logger.warning(f"Rate limit exceeded: {path} from {request.META.get('REMOTE_ADDR')}")
             
             # Return JSON response for API requests
             if path.startswith('/api/'):
-                return JsonResponse({'error': 'Rate limit exceeded'}, status=429)
-            
-            # Return error message for normal requests
-            messages.error(request, "Too many requests. Please try again later.")
-            return redirect('notes:dashboard')
+                response = JsonResponse({'error': 'Rate limit exceeded'}, status=429)
+            else:
+                # Return error message for normal requests
+                messages.error(request, "Too many requests. Please try again later.")
+                response = redirect('notes:dashboard')
+        else:
+            # Proceed with the request
+            response = self.get_response(request)
         
-        # Proceed with the request
-        return self.get_response(request)
+        for header, value in result.headers.items():
+            response[header] = value
+        return response
     
     def _check_rate_limit(self, request, limit_group):
         """
-        Check if request exceeds rate limit for the specified group.
-        Returns True if request is allowed, False if rate limit is exceeded.
+        Count the request against the rate limit of the specified group.
+        Returns a RateLimitResult, allowed is False if the rate limit is exceeded.
         """
         # Get rate limit for the group
         requests_per_minute = self.rate_limits.get(limit_group, 60)
@@ -171,51 +233,203 @@ class RateLimitMiddleware:
         else:
             client_id = f"ip_{client_ip}_{limit_group}"
         
-        # Get the current minute timestamp (rounded down)
-        current_minute = int(time.time() / 60)
-        cache_key = f"rate_limit:{client_id}:{current_minute}"
+        return self.limiter.hit(client_id, requests_per_minute)
+
+
+class ContentSecurityPolicyMiddleware:
+    """Middleware to add Content-Security-Policy headers to responses."""
+    
+    def __init__(self, get_response):
+        self.get_response = get_response
+        
+        # Headers are built once, see SECURITY_HEADERS
+        self.headers = list(SECURITY_HEADERS.items())
+    
+    def __call__(self, request):
+        response = self.get_response(request)
+        
+        # Add CSP and other security headers to the response
+        for header, value in self.headers:
+            response[header] = value
+        
+        return response
+
+
+class RequestPipelineMiddleware:
+    """
+    Middleware running the middleware of this module as one pipeline.
+    Each request is classified once by path prefix and only goes through the
+    middleware of its route class.
+    """
+    
+    # Middleware run for each route class, outermost first
+    ROUTE_MIDDLEWARE = {
+        'static': [ContentSecurityPolicyMiddleware],
+        'health': [],
+        'api': [RoleMiddleware, RequestValidationMiddleware, RateLimitMiddleware, ContentSecurityPolicyMiddleware],
+        'auth': [RoleMiddleware, RequestValidationMiddleware, RateLimitMiddleware, ContentSecurityPolicyMiddleware],
+        'html': [RoleMiddleware, RequestValidationMiddleware, RateLimitMiddleware, ContentSecurityPolicyMiddleware],
+    }
+    
+    def __init__(self, get_response):
+        self.get_response = get_response
         
-        # Get current request count from cache
-        request_count = cache.get(cache_key, 0)
+        # One chain of middleware per route class, built at startup
+        self.handlers = {}
+        for route_class, middleware_classes in self.ROUTE_MIDDLEWARE.items():
+            handler = get_response
+            for middleware_class in reversed(middleware_classes):
+                handler = middleware_class(handler)
+            self.handlers[route_class] = handler
+    
+    def __call__(self, request):
+        return self.handlers[get_route_class(request)](request)
+
+
+class MetricsMiddleware:
+    """
+    Middleware to record the latency, database queries and response size of
+    each view, and the requests refused by the other middleware, see
+    apps.accounts.metrics.
+    """
+    
+    def __init__(self, get_response):
+        self.get_response = get_response
+    
+    def __call__(self, request):
+        timer = metrics.QueryTimer()
+        started = time.perf_counter()
+        with connection.execute_wrapper(timer):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
         
-        # Check if request count exceeds the limit
-        if request_count >= requests_per_minute:
-            return False
+        view = (get_view_name(request),)
+        registry = metrics.registry
+        registry.inc(
+            'notes_http_requests_total', (view[0], metrics.method_label(request.method), str(response.status_code))
+        )
+        registry.observe('notes_http_request_duration_seconds', view, elapsed)
+        registry.observe('notes_db_queries_per_request', view, timer.count)
+        registry.observe('notes_db_query_duration_seconds', view, timer.elapsed)
+        if not response.streaming:
+            registry.observe('notes_http_response_size_bytes', view, len(response.content))
         
-        # Increment the request count (expire after 1 minute)
-        cache.set(cache_key, request_count + 1, timeout=60)
+        rejection = getattr(request, 'rejection', None)
+        if rejection:
+            registry.inc('notes_request_rejections_total', rejection)
         
-        return True
+        registry.flush()
+        return response
 
 
-class ContentSecurityPolicyMiddleware:
-    """Middleware to add Content-Security-Policy headers to responses."""
+class QueryLogMiddleware:
+    """
+    Middleware to report slow queries and queries repeated within a request
+    (N+1 patterns), for development and staging, see apps.accounts.queries.
+    """
     
     def __init__(self, get_response):
         self.get_response = get_response
+        self.slow_ms = getattr(settings, 'QUERY_LOG_SLOW_MS', 100)
+        self.repeat_threshold = getattr(settings, 'QUERY_LOG_REPEAT_THRESHOLD', 5)
     
     def __call__(self, request):
-        response = self.get_response(request)
+        inspector = QueryInspector(self.slow_ms, self.repeat_threshold)
+        with connection.execute_wrapper(inspector):
+            response = self.get_response(request)
         
-        # Define Content Security Policy
-        csp_directives = [
-            "default-src 'self'",
-            "script-src 'self' 'unsafe-inline' https://cdn.jsdelivr.net",
-            "style-src 'self' 'unsafe-inline' https://cdn.jsdelivr.net",
-            "img-src 'self' data: https:",
-            "font-src 'self' https://cdn.jsdelivr.net",
-            "connect-src 'self'",
-            "frame-ancestors 'none'",
-            "form-action 'self'",
-        ]
+        if inspector.findings:
+            inspector.report(get_view_name(request))
+        return response
+
+
+class ProfilerMiddleware:
+    """
+    Middleware to profile the requests asking for it and store the profile
+    as a ProfileReport, see apps.accounts.profiling.
+    """
+    
+    def __init__(self, get_response):
+        self.get_response = get_response
+    
+    def __call__(self, request):
+        # Unprofiled requests stop here
+        if f'{PROFILE_PARAM}=' not in request.META.get('QUERY_STRING', '') and PROFILE_HEADER not in request.META:
+            return self.get_response(request)
         
-        # Add CSP header to the response
-        response['Content-Security-Policy'] = '; '.join(csp_directives)
+        mode, created_by_id = self._profile_mode(request)
+        if mode is None:
+            return self.get_response(request)
+        
+        profiler = PROFILERS[mode]()
+        timeline = SQLTimeline()
+        started = time.perf_counter()
+        with connection.execute_wrapper(timeline):
+            profiler.start()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.stop()
+        elapsed = time.perf_counter() - started
+        
+        report = ProfileReport.objects.create(
+            user=request.user if request.user.is_authenticated else None,
+            created_by_id=created_by_id,
+            mode=mode,
+            view=get_view_name(request),
+            method=request.method,
+            path=request.path[:500],
+            status_code=response.status_code,
+            duration_ms=elapsed * 1000,
+            query_count=len(timeline.queries),
+            query_duration_ms=sum(query['duration_ms'] for query in timeline.queries),
+            data=profiler.dump(),
+            sql_timeline=timeline.queries,
+        )
+        logger.info(f"Profiled {request.method} {request.path} as report {report.pk}")
+        response['X-Profile-Report'] = str(report.pk)
+        return response
+    
+    def _profile_mode(self, request):
+        """Get the profiler mode of a request and who asked for it, or (None, None)."""
+        value = request.GET.get(PROFILE_PARAM) or request.META.get(PROFILE_HEADER, '')
+        user = request.user
+        
+        # Admins may profile their own requests without a token
+        if value in PROFILE_MODES:
+            if user.is_authenticated and get_user_roles(user).can_manage:
+                return value, user.pk
+            return None, None
+        
+        payload = read_profile_token(value)
+        if payload is None or payload['user'] not in (None, user.pk):
+            return None, None
+        return payload['mode'], payload['by']
+
+
+class MemoryMiddleware:
+    """
+    Middleware to record the memory of the worker per view, and recycle the
+    worker once it goes over MEMORY_MAX_RSS_MB, see apps.accounts.memory.
+    """
+    
+    def __init__(self, get_response):
+        self.get_response = get_response
+    
+    def __call__(self, request):
+        peak = memory.peak_rss()
+        response = self.get_response(request)
         
-        # Add other security headers
-        response['X-Content-Type-Options'] = 'nosniff'
-        response['X-Frame-Options'] = 'DENY'
-        response['X-XSS-Protection'] = '1; mode=block'
-        response['Referrer-Policy'] = 'strict-origin-when-cross-origin'
+        view = (get_view_name(request),)
+        growth = memory.peak_rss() - peak
+        if growth > 0:
+            # This request raised the high-water mark of the worker
+            metrics.registry.inc('notes_worker_peak_rss_growth_bytes_total', view, growth)
         
-        return response 
\ No newline at end of file
+        rss = memory.current_rss()
+        if rss is not None:
+            metrics.registry.observe('notes_worker_rss_bytes', view, rss)
+            max_rss_mb = getattr(settings, 'MEMORY_MAX_RSS_MB', 0)
+            if max_rss_mb and rss > max_rss_mb * 1024 * 1024:
+                memory.recycle_worker(rss)
+        return response
@@ -0,0 +1,34 @@
+# Generated by Django 5.2 on 2026-10-19 01:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_auto_20250501_1739'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueryReport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('slow', 'Slow query'), ('repeated', 'Repeated query (N+1)')], max_length=10)),
+                ('view', models.CharField(max_length=200)),
+                ('shape_hash', models.CharField(editable=False, max_length=40)),
+                ('shape', models.TextField()),
+                ('location', models.CharField(blank=True, max_length=500)),
+                ('occurrences', models.PositiveIntegerField(default=1, help_text='Requests the query was found in')),
+                ('max_runs', models.PositiveIntegerField(default=1, help_text='Most runs in one request')),
+                ('max_duration_ms', models.FloatField(default=0)),
+                ('plan', models.TextField(blank=True)),
+                ('first_seen', models.DateTimeField(auto_now_add=True)),
+                ('last_seen', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['-last_seen'],
+                'unique_together': {('kind', 'view', 'shape_hash')},
+            },
+        ),
+    ]
@@ -1,8 +1,13 @@
+import hashlib
+
 from django.db import models
+from django.db.models import F
 from django.contrib.auth.models import User
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 
+from .roles import roles_changed
+
 
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
@@ -13,6 +18,89 @@ class UserProfile(models.Model):
         return f"{self.user.username}'s profile"
 
 
+class QueryReport(models.Model):
+    """A slow or repeated SQL query found by QueryLogMiddleware, one row per view and query shape."""
+    KIND_CHOICES = [
+        ('slow', 'Slow query'),
+        ('repeated', 'Repeated query (N+1)'),
+    ]
+    
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    view = models.CharField(max_length=200)
+    shape_hash = models.CharField(max_length=40, editable=False)
+    shape = models.TextField()
+    location = models.CharField(max_length=500, blank=True)
+    occurrences = models.PositiveIntegerField(default=1, help_text="Requests the query was found in")
+    max_runs = models.PositiveIntegerField(default=1, help_text="Most runs in one request")
+    max_duration_ms = models.FloatField(default=0)
+    plan = models.TextField(blank=True)
+    first_seen = models.DateTimeField(auto_now_add=True)
+    last_seen = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-last_seen']
+        unique_together = ['kind', 'view', 'shape_hash']
+    
+    def __str__(self):
+        return f"{self.get_kind_display()} in {self.view}"
+    
+    @classmethod
+    def record(cls, kind, view, shape, location, runs, duration, plan):
+        """Create the report of a query, or count one more occurrence of it."""
+        digest = hashlib.sha1(shape.encode('utf-8')).hexdigest()
+        report, created = cls.objects.get_or_create(
+            kind=kind, view=view, shape_hash=digest,
+            defaults={
+                'shape': shape,
+                'location': location[:500],
+                'max_runs': runs,
+                'max_duration_ms': duration * 1000,
+                'plan': plan,
+            }
+        )
+        if not created:
+            report.occurrences = F('occurrences') + 1
+            report.max_runs = max(report.max_runs, runs)
+            report.max_duration_ms = max(report.max_duration_ms, duration * 1000)
+            report.location = location[:500]
+            report.plan = plan
+            report.save()
+        return report
+
+
+class ProfileReport(models.Model):
+    """Profile of one request, made by ProfilerMiddleware, with the SQL timeline of the request."""
+    MODE_CHOICES = [
+        ('cprofile', 'Deterministic (pstats)'),
+        ('sample', 'Sampling (speedscope)'),
+    ]
+    
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    mode = models.CharField(max_length=10, choices=MODE_CHOICES)
+    view = models.CharField(max_length=200)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=500)
+    status_code = models.PositiveSmallIntegerField()
+    duration_ms = models.FloatField()
+    query_count = models.PositiveIntegerField(default=0)
+    query_duration_ms = models.FloatField(default=0)
+    data = models.BinaryField(editable=False)
+    sql_timeline = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.created_at:%Y-%m-%d %H:%M})"
+    
+    @property
+    def filename(self):
+        extension = 'pstats' if self.mode == 'cprofile' else 'speedscope.json'
+        return f"profile-{self.pk}-{self.view.replace(':', '-')}.{extension}"
+
+
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
     """Create a user profile when a new user is created."""
@@ -24,3 +112,15 @@ def create_user_profile(sender, instance, created, **kwargs):
 def save_user_profile(sender, instance, **kwargs):
     """Save the user profile when the user is saved."""
     instance.profile.save()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=UserProfile)
+def reset_user_roles(sender, instance, **kwargs):
+    """Make the cached role flags of the user stale."""
+    user = instance if sender is User else None
+    if sender is UserProfile and UserProfile.user.is_cached(instance):
+        user = instance.user
+    if user is not None:
+        user.__dict__.pop('_roles', None)
+    roles_changed(instance.pk if sender is User else instance.user_id)
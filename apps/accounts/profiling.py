@@ -0,0 +1,155 @@
+"""
+On-demand request profiling for Notes Manager application.
+ProfilerMiddleware profiles the requests carrying a '_profile' query parameter
+or an 'X-Profile' header. Admins may pass a mode ('cprofile' or 'sample'),
+anyone else needs a token signed with make_profile_token, for example to
+profile a slow page of one user. Other requests only pay for the check of the
+query string and the header.
+"""
+import cProfile
+import json
+import marshal
+import pstats
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.core import signing
+
+
+PROFILE_PARAM = '_profile'
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_MODES = ('cprofile', 'sample')
+
+_TOKEN_SALT = 'apps.accounts.profiling'
+
+# Longest SQL statement kept in the timeline of a profile
+SQL_TIMELINE_MAX_LENGTH = 2000
+
+
+def make_profile_token(created_by, user=None, mode='cprofile'):
+    """Sign a profiling token, for the requests of user if given."""
+    return signing.dumps(
+        {'by': created_by.pk, 'user': user.pk if user else None, 'mode': mode},
+        salt=_TOKEN_SALT, compress=True
+    )
+
+
+def read_profile_token(token):
+    """Get the payload of a profiling token, or None if it is invalid or expired."""
+    max_age = getattr(settings, 'PROFILE_TOKEN_MAX_AGE', 24 * 60 * 60)
+    try:
+        payload = signing.loads(token, salt=_TOKEN_SALT, max_age=max_age)
+    except signing.BadSignature:
+        return None
+    return payload if payload.get('mode') in PROFILE_MODES else None
+
+
+class DeterministicProfiler:
+    """Profile every call with cProfile, saved in the pstats format."""
+
+    extension = 'pstats'
+
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+
+    def start(self):
+        self.profiler.enable()
+
+    def stop(self):
+        self.profiler.disable()
+
+    def dump(self):
+        # The content of the file written by pstats.Stats.dump_stats
+        return marshal.dumps(pstats.Stats(self.profiler).stats)
+
+
+class SamplingProfiler:
+    """
+    Sample the stack of the profiled thread from another thread, saved as a
+    speedscope flamegraph (https://www.speedscope.app).
+    """
+
+    extension = 'speedscope.json'
+
+    def __init__(self, interval=None):
+        self.interval = interval or getattr(settings, 'PROFILE_SAMPLE_INTERVAL', 0.001)
+        self.frames = []
+        self.frame_index = {}
+        self.samples = []
+        self.weights = []
+        self.stopped = threading.Event()
+
+    def start(self):
+        self.thread_id = threading.get_ident()
+        self.started = self.last_sample = time.perf_counter()
+        self.sampler = threading.Thread(target=self.run, daemon=True)
+        self.sampler.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.sampler.join()
+        self.ended = time.perf_counter()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                key = (code.co_name, code.co_filename, code.co_firstlineno)
+                index = self.frame_index.get(key)
+                if index is None:
+                    index = self.frame_index[key] = len(self.frames)
+                    self.frames.append({'name': key[0], 'file': key[1], 'line': key[2]})
+                stack.append(index)
+                frame = frame.f_back
+            # Root first
+            self.samples.append(stack[::-1])
+            self.weights.append((now - self.last_sample) * 1000)
+            self.last_sample = now
+
+    def dump(self):
+        return json.dumps({
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'shared': {'frames': self.frames},
+            'profiles': [{
+                'type': 'sampled',
+                'name': 'request',
+                'unit': 'milliseconds',
+                'startValue': 0,
+                'endValue': (self.ended - self.started) * 1000,
+                'samples': self.samples,
+                'weights': self.weights,
+            }],
+        }).encode('utf-8')
+
+
+PROFILERS = {
+    'cprofile': DeterministicProfiler,
+    'sample': SamplingProfiler,
+}
+
+
+class SQLTimeline:
+    """Database execute wrapper recording when each query of a request ran and for how long."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'start_ms': round((started - self.started) * 1000, 3),
+                'duration_ms': round((time.perf_counter() - started) * 1000, 3),
+                'sql': sql[:SQL_TIMELINE_MAX_LENGTH],
+                'many': many,
+            })
@@ -0,0 +1,123 @@
+"""
+Slow query and N+1 detection for development and staging.
+QueryLogMiddleware watches the SQL of each request through an execute wrapper.
+Queries slower than QUERY_LOG_SLOW_MS, and query shapes run more than
+QUERY_LOG_REPEAT_THRESHOLD times in one request, are written to the
+'apps.accounts.queries' log and to QueryReport rows shown in the admin, with
+the code that ran them and their EXPLAIN plan.
+"""
+import logging
+import re
+import time
+import traceback
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+
+from . import metrics
+from .models import QueryReport
+
+
+logger = logging.getLogger(__name__)
+
+# Literals and placeholder lists that vary between runs of the same query
+_SHAPE_PATTERNS = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'%s'), '?'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(...)'),
+    (re.compile(r'\s+'), ' '),
+]
+
+# Frames of these files are skipped when looking for the code that ran a
+# query, including the execute wrappers
+_SKIPPED_FRAMES = ('/django/', '/rest_framework/', '/site-packages/', __file__, metrics.__file__)
+
+
+def query_shape(sql):
+    """Get the SQL of a query without its parameters, the same for all runs of one query."""
+    for pattern, replacement in _SHAPE_PATTERNS:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+def code_location():
+    """Get 'file:line in function' of the innermost project frame of the current stack."""
+    for frame in reversed(traceback.extract_stack()):
+        if not any(part in frame.filename for part in _SKIPPED_FRAMES):
+            filename = frame.filename
+            base_dir = str(settings.BASE_DIR)
+            if filename.startswith(base_dir):
+                filename = filename[len(base_dir):].lstrip('/')
+            return f'{filename}:{frame.lineno} in {frame.name}'
+    return ''
+
+
+def explain(sql, params):
+    """Get the query plan of a SELECT query, or '' if it cannot be explained."""
+    if not sql.lstrip().upper().startswith('SELECT'):
+        return ''
+    prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + sql, params)
+            return '\n'.join(' '.join(str(value) for value in row) for row in cursor.fetchall())
+    except DatabaseError as e:
+        return f'EXPLAIN failed: {e}'
+
+
+class QueryInspector:
+    """Execute wrapper collecting the slow and repeated queries of one request."""
+
+    def __init__(self, slow_ms, repeat_threshold):
+        self.slow = slow_ms / 1000
+        self.repeat_threshold = repeat_threshold
+        # Shape -> [runs, total seconds]
+        self.stats = {}
+        # (shape, kind) -> the first slow run, or the run going over the threshold
+        self.findings = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            shape = query_shape(sql)
+            stats = self.stats.setdefault(shape, [0, 0.0])
+            stats[0] += 1
+            stats[1] += elapsed
+
+            if elapsed >= self.slow and (shape, 'slow') not in self.findings:
+                self.add_finding(shape, 'slow', sql, params, many, elapsed)
+            if stats[0] == self.repeat_threshold + 1:
+                self.add_finding(shape, 'repeated', sql, params, many, elapsed)
+
+    def add_finding(self, shape, kind, sql, params, many, elapsed):
+        self.findings[(shape, kind)] = {
+            'sql': sql,
+            'params': None if many else params,
+            'duration': elapsed,
+            'location': code_location(),
+        }
+
+    def report(self, view):
+        """Log the findings of the request and record them as QueryReport rows."""
+        for (shape, kind), finding in self.findings.items():
+            runs, total = self.stats[shape]
+            # A repeated query costs the time of all its runs
+            duration = total if kind == 'repeated' else finding['duration']
+            plan = explain(finding['sql'], finding['params'])
+            logger.warning(
+                "%s query in %s (%d runs, %.1f ms) at %s: %s\n%s",
+                kind.capitalize(), view, runs, duration * 1000, finding['location'], shape, plan
+            )
+            QueryReport.record(
+                kind=kind,
+                view=view,
+                shape=shape,
+                location=finding['location'],
+                runs=runs,
+                duration=duration,
+                plan=plan,
+            )
@@ -0,0 +1,167 @@
+"""
+Rate limiting for RateLimitMiddleware.
+Requests are counted with a sliding window: the count of the current window
+plus the count of the previous one, weighted by how much of it still overlaps
+the last period. Counters live in a backend shared by all workers.
+"""
+import logging
+import math
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.db import DatabaseCache
+from django.core.cache.backends.locmem import LocMemCache
+
+
+logger = logging.getLogger(__name__)
+
+
+class CacheBackend:
+    """
+    Counters in a Django cache.
+
+    Counting is atomic with 'add' followed by 'incr' on Redis or Memcached,
+    which share the counters across hosts. The local memory cache only counts
+    the requests of one process and the database cache increments with a read
+    and a write, so get_rate_limiter() does not use them.
+    """
+
+    # Caches whose counters are not shared by all workers or not atomic
+    UNSUITABLE_CACHES = (LocMemCache, DatabaseCache)
+
+    def __init__(self, location='default'):
+        self.cache = caches[location]
+
+    def incr(self, key, timeout):
+        if self.cache.add(key, 1, timeout):
+            return 1
+        try:
+            return self.cache.incr(key)
+        except ValueError:
+            # Expired between add and incr
+            self.cache.add(key, 1, timeout)
+            return 1
+
+    def get(self, key):
+        return self.cache.get(key, 0)
+
+
+class SQLiteBackend:
+    """
+    Counters in an SQLite file, shared by the workers of one host.
+
+    Each count is a single upsert, atomic under the SQLite write lock. The
+    file uses WAL mode without syncing to disk, losing counters on a crash
+    matters less than the latency of each request.
+    """
+
+    # Roughly one increment in this many also deletes expired counters
+    PURGE_EVERY = 1000
+
+    def __init__(self, location):
+        self.location = str(location)
+        self.local = threading.local()
+
+    def connection(self):
+        connection = getattr(self.local, 'connection', None)
+        # A connection must not be shared with a forked worker
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(self.location, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS rate_limit '
+                '(key TEXT PRIMARY KEY, count INTEGER NOT NULL, expires REAL NOT NULL)'
+            )
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
+
+    def incr(self, key, timeout):
+        connection = self.connection()
+        now = time.time()
+        if random.randrange(self.PURGE_EVERY) == 0:
+            connection.execute('DELETE FROM rate_limit WHERE expires < ?', (now,))
+        return connection.execute(
+            'INSERT INTO rate_limit (key, count, expires) VALUES (?, 1, ?) '
+            'ON CONFLICT(key) DO UPDATE SET count = count + 1 RETURNING count',
+            (key, now + timeout)
+        ).fetchone()[0]
+
+    def get(self, key):
+        row = self.connection().execute(
+            'SELECT count FROM rate_limit WHERE key = ? AND expires >= ?', (key, time.time())
+        ).fetchone()
+        return row[0] if row else 0
+
+
+class RateLimitResult:
+    """Outcome of counting a request against a limit."""
+
+    def __init__(self, allowed, limit, remaining, reset):
+        self.allowed = allowed
+        self.limit = limit
+        self.remaining = remaining
+        self.reset = reset  # Seconds until the current window ends
+
+    @property
+    def headers(self):
+        headers = {
+            'RateLimit-Limit': str(self.limit),
+            'RateLimit-Remaining': str(self.remaining),
+            'RateLimit-Reset': str(self.reset),
+        }
+        if not self.allowed:
+            headers['Retry-After'] = str(self.reset)
+        return headers
+
+
+class SlidingWindowLimiter:
+    """Allow up to a number of requests per period for each client key."""
+
+    def __init__(self, backend, period=60):
+        self.backend = backend
+        self.period = period
+
+    def hit(self, key, limit):
+        """Count a request of key and tell whether it is within limit."""
+        now = time.time()
+        window = int(now // self.period)
+        elapsed = now - window * self.period
+
+        # Counters are kept for two periods, the previous window is still weighted
+        current = self.backend.incr(f'rate_limit:{key}:{window}', 2 * self.period)
+        previous = self.backend.get(f'rate_limit:{key}:{window - 1}')
+        count = current + previous * (1 - elapsed / self.period)
+
+        return RateLimitResult(
+            allowed=count <= limit,
+            limit=limit,
+            remaining=max(0, int(limit - count)),
+            reset=math.ceil(self.period - elapsed),
+        )
+
+
+def get_rate_limiter():
+    """
+    Build the limiter configured by the RATE_LIMIT_BACKEND and RATE_LIMIT_LOCATION settings.
+
+    The 'cache' backend falls back to 'sqlite' when the cache cannot share
+    atomic counters between workers.
+    """
+    location = getattr(settings, 'RATE_LIMIT_LOCATION', None)
+    if getattr(settings, 'RATE_LIMIT_BACKEND', 'sqlite') == 'cache':
+        cache_name = location or 'default'
+        if not isinstance(caches[cache_name], CacheBackend.UNSUITABLE_CACHES):
+            return SlidingWindowLimiter(CacheBackend(cache_name))
+        logger.warning(
+            "The %s cache cannot share rate limit counters between workers, using the SQLite backend",
+            cache_name
+        )
+        location = None
+    return SlidingWindowLimiter(SQLiteBackend(location or os.path.join(settings.BASE_DIR, 'ratelimit.sqlite3')))
@@ -0,0 +1,136 @@
+"""
+Role resolution for Notes Manager application.
+The role flags of a user are resolved once per request and exposed as
+request.roles. is_superuser and is_staff come from the user, loaded fresh for
+every request. The admin flag of the profile is kept in the session and
+trusted for ROLES_MAX_AGE seconds without reading anything. After that a
+version stamp per user in the cache, changed whenever the user or their
+profile is saved, tells whether the copy is still current; with a cache local
+to the process or in the database the profile is read again instead.
+"""
+import time
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.db import DatabaseCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils.functional import SimpleLazyObject
+
+
+ROLES_SESSION_KEY = '_roles'
+
+# Seconds a session copy is trusted without checking for changes, the
+# longest an admin flag change takes to reach existing sessions. The session
+# is rewritten at most once per period.
+ROLES_MAX_AGE = 30
+
+# Caches whose stamps are not seen by all workers or cost as much as reading the profile
+UNSHARED_CACHES = (LocMemCache, DatabaseCache)
+
+
+def _version_key(user_id):
+    return f'roles:version:{user_id}'
+
+
+class Roles:
+    """Role flags of a user."""
+
+    __slots__ = ('is_authenticated', 'is_superuser', 'is_staff', 'is_admin')
+
+    def __init__(self, is_authenticated=False, is_superuser=False, is_staff=False, is_admin=False):
+        self.is_authenticated = is_authenticated
+        self.is_superuser = is_superuser
+        self.is_staff = is_staff
+        self.is_admin = is_admin
+
+    @property
+    def can_manage(self):
+        """Whether the user may access the admin areas."""
+        return self.is_superuser or self.is_staff or self.is_admin
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        flags = [name for name in self.__slots__ if getattr(self, name)]
+        return f"<Roles {' '.join(flags) or 'anonymous'}>"
+
+
+ANONYMOUS_ROLES = Roles()
+
+
+def resolve_roles(user):
+    """Read the role flags of a user from the database."""
+    if not user.is_authenticated:
+        return ANONYMOUS_ROLES
+
+    from .models import UserProfile
+    is_admin = UserProfile.objects.filter(user_id=user.pk).values_list('is_admin', flat=True).first()
+    return Roles(
+        is_authenticated=True,
+        is_superuser=user.is_superuser,
+        is_staff=user.is_staff,
+        is_admin=bool(is_admin),
+    )
+
+
+def get_user_roles(user):
+    """Get the role flags of a user, resolved at most once per user object."""
+    roles = getattr(user, '_roles', None)
+    if roles is None:
+        roles = resolve_roles(user)
+        if user.is_authenticated:
+            user._roles = roles
+    return roles
+
+
+def get_request_roles(request):
+    """Get the role flags of the user of a request, from the session when still current."""
+    user = request.user
+    if not user.is_authenticated:
+        return ANONYMOUS_ROLES
+
+    roles = getattr(user, '_roles', None)
+    if roles is not None:
+        return roles
+
+    stored = request.session.get(ROLES_SESSION_KEY)
+    if not stored or stored.get('user_id') != user.pk or 'is_admin' not in stored:
+        stored = None
+    now = time.time()
+
+    if stored and now - stored['resolved_at'] < ROLES_MAX_AGE:
+        is_admin = stored['is_admin']
+    else:
+        version = None
+        if not isinstance(caches['default'], UNSHARED_CACHES):
+            version = cache.get(_version_key(user.pk))
+        if stored and version is not None and stored['version'] == version:
+            is_admin = stored['is_admin']
+        else:
+            is_admin = resolve_roles(user).is_admin
+        request.session[ROLES_SESSION_KEY] = {
+            'user_id': user.pk,
+            'version': version,
+            'resolved_at': now,
+            'is_admin': is_admin,
+        }
+
+    # Only the profile flag is cached, the user flags are always current
+    roles = Roles(
+        is_authenticated=True,
+        is_superuser=user.is_superuser,
+        is_staff=user.is_staff,
+        is_admin=is_admin,
+    )
+    user._roles = roles
+    return roles
+
+
+def attach_roles(request):
+    """Expose the role flags of the request user as request.roles, resolved on first use."""
+    request.roles = SimpleLazyObject(lambda: get_request_roles(request))
+
+
+def roles_changed(user_id):
+    """Make the session copies of the roles of a user stale once their ROLES_MAX_AGE is over."""
+    cache.set(_version_key(user_id), time.time_ns(), timeout=None)
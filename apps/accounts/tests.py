@@ -1,7 +1,25 @@
-from django.test import TestCase
+import json
+import marshal
+import os
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+from unittest import mock
+from urllib.parse import urlencode
+
+from django.test import TestCase, modify_settings, override_settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.urls import reverse
-from apps.accounts.models import UserProfile
+from apps.accounts import memory, metrics
+from apps.accounts.models import UserProfile, QueryReport, ProfileReport
+from apps.accounts.profiling import make_profile_token
+from apps.accounts.queries import query_shape
+from apps.notes.models import Category
+from apps.accounts.middleware import classify_request
+from apps.accounts.ratelimit import SlidingWindowLimiter, SQLiteBackend, get_rate_limiter
+from apps.accounts.roles import ROLES_MAX_AGE, ROLES_SESSION_KEY, get_request_roles, roles_changed
 
 
 class UserProfileModelTest(TestCase):
@@ -130,3 +148,446 @@ class LoginViewTest(TestCase):
             response, 
             'Please enter a correct username and password'
         )
+
+
+class RequestValidationMiddlewareTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpassword'
+        )
+        self.client.login(username='testuser', password='testpassword')
+
+    def post_form(self, url, data):
+        # File uploads are not inspected, so post like a form without files
+        return self.client.post(url, urlencode(data), content_type='application/x-www-form-urlencoded')
+
+    def test_suspicious_requests_blocked(self):
+        """Test that requests matching a rule are rejected with the rule reported"""
+        with self.assertLogs('apps.accounts.middleware', level='WARNING') as logs:
+            response = self.client.get(reverse('notes:list'), {'q': 'SELECT * FROM auth_user'})
+        self.assertEqual(response.status_code, 403)
+        self.assertIn('rule sql-select on q', logs.output[0])
+
+        with self.assertLogs('apps.accounts.middleware', level='WARNING'):
+            response = self.post_form(reverse('notes:category_create'), {'name': '<script src=x>'})
+        self.assertEqual(response.status_code, 403)
+
+    def test_keywords_on_separate_lines_allowed(self):
+        """Test that the second keyword of a rule must be on the same line"""
+        response = self.client.get(reverse('notes:list'), {'q': 'select one\nfrom the list'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.wsgi_request.inspection.blocked)
+
+    def test_note_content_exempt(self):
+        """Test that note bodies may quote SQL and HTML"""
+        response = self.post_form(reverse('notes:create'), {
+            'title': 'SQL cheatsheet',
+            'content': 'Use SELECT name FROM users, or <script>alert(1)</script> in examples.',
+        })
+        self.assertEqual(response.status_code, 302)
+
+        # Other fields of note routes are still inspected
+        with self.assertLogs('apps.accounts.middleware', level='WARNING'):
+            response = self.post_form(reverse('notes:create'), {
+                'title': 'DELETE FROM notes',
+                'content': 'Some content here',
+            })
+        self.assertEqual(response.status_code, 403)
+
+    def test_inspected_length_capped(self):
+        """Test that only the first characters of a request are inspected"""
+        with self.settings(REQUEST_INSPECTION_MAX_LENGTH=1024):
+            response = self.client.get(reverse('notes:list'), {'q': 'x' * 2048 + ' SELECT * FROM t'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.wsgi_request.inspection.inspected, 1024)
+
+
+class RateLimitTest(TestCase):
+    def setUp(self):
+        # Fresh counters for each test
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = self.settings(RATE_LIMIT_LOCATION=os.path.join(directory.name, 'ratelimit.sqlite3'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpassword'
+        )
+        self.client.login(username='testuser', password='testpassword')
+
+    def test_rate_limit_headers(self):
+        """Test that limited endpoints report the remaining requests"""
+        response = self.client.get('/api/notes/')
+        self.assertEqual(response['RateLimit-Limit'], '60')
+        self.assertEqual(response['RateLimit-Remaining'], '59')
+        self.assertNotIn('Retry-After', response)
+
+        # Pages outside the limited groups are not counted
+        response = self.client.get(reverse('notes:list'))
+        self.assertNotIn('RateLimit-Limit', response)
+
+    def test_sqlite_backend(self):
+        """Test that requests over the limit are refused until the window passes"""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        limiter = SlidingWindowLimiter(SQLiteBackend(os.path.join(directory.name, 'ratelimit.sqlite3')))
+
+        results = [limiter.hit('client', 3) for _ in range(4)]
+        self.assertEqual([result.allowed for result in results], [True, True, True, False])
+        self.assertEqual(results[2].remaining, 0)
+        self.assertIn('Retry-After', results[3].headers)
+
+        # Other clients have their own counters
+        self.assertTrue(limiter.hit('other client', 3).allowed)
+
+    def test_unshared_cache_falls_back_to_sqlite(self):
+        """Test that caches that cannot share atomic counters are not used"""
+        with self.settings(RATE_LIMIT_BACKEND='cache', RATE_LIMIT_LOCATION=None):
+            with self.assertLogs('apps.accounts.ratelimit', level='WARNING'):
+                limiter = get_rate_limiter()
+        self.assertIsInstance(limiter.backend, SQLiteBackend)
+
+
+class RequestRolesTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpassword'
+        )
+        self.client.login(username='testuser', password='testpassword')
+
+    def test_roles_cached_in_session(self):
+        """Test that role flags are read once and reused by later requests"""
+        response = self.client.get(reverse('accounts:profile'))
+        request = response.wsgi_request
+        self.assertTrue(request.roles.is_authenticated)
+        self.assertFalse(request.roles.can_manage)
+
+        # A new request of the same session reads the flags from the session,
+        # without looking up the version stamp either
+        request.user = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(0), mock.patch.object(cache, 'get') as cache_get:
+            self.assertFalse(get_request_roles(request).is_admin)
+        cache_get.assert_not_called()
+
+    def age_session_roles(self):
+        session = self.client.session
+        session[ROLES_SESSION_KEY]['resolved_at'] -= ROLES_MAX_AGE
+        session.save()
+
+    def test_profile_save_refreshes_roles(self):
+        """Test that a saved profile is read again once the session copy is too old"""
+        response = self.client.get(reverse('notes:api_docs'))
+        self.assertEqual(response.status_code, 403)
+
+        self.user.profile.is_admin = True
+        self.user.profile.save()
+        self.age_session_roles()
+        response = self.client.get(reverse('notes:api_docs'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.wsgi_request.roles.can_manage)
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'notes-test-roles-cache'),
+    }})
+    def test_version_stamp_checked_after_max_age(self):
+        """Test that an old session copy is kept without a profile query while its stamp is unchanged"""
+        cache.clear()
+        roles_changed(self.user.pk)
+        request = self.client.get(reverse('accounts:profile')).wsgi_request
+
+        request.user = User.objects.get(pk=self.user.pk)
+        request.session[ROLES_SESSION_KEY]['resolved_at'] -= ROLES_MAX_AGE
+        with self.assertNumQueries(0):
+            self.assertFalse(get_request_roles(request).is_admin)
+
+        roles_changed(self.user.pk)
+        request.user = User.objects.get(pk=self.user.pk)
+        request.session[ROLES_SESSION_KEY]['resolved_at'] -= ROLES_MAX_AGE
+        with self.assertNumQueries(1):
+            get_request_roles(request)
+
+    def test_demoted_staff_loses_access_at_once(self):
+        """Test that the user flags are not taken from the session copy"""
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+        # Changed without signals, as by another process whose stamp is not seen here
+        User.objects.filter(pk=self.user.pk).update(is_staff=False)
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+
+class RequestPipelineTest(TestCase):
+    def test_classify_request(self):
+        """Test that paths are classified by prefix"""
+        cases = {
+            '/static/css/style.css': 'static',
+            '/media/attachments/file.txt': 'static',
+            '/health/': 'health',
+            '/api/notes/': 'api',
+            '/accounts/login/': 'auth',
+            '/auth/login/yandex-oauth2/': 'auth',
+            '/notes/search/': 'html',
+            '/accounts/profile/': 'html',
+        }
+        for path, route_class in cases.items():
+            self.assertEqual(classify_request(path), route_class, path)
+
+    def test_health_check_skips_checks(self):
+        """Test that health checks do not go through the custom middleware"""
+        with self.assertNumQueries(0):
+            response = self.client.get('/health/', {'q': 'SELECT * FROM auth_user'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'status': 'ok'})
+        self.assertNotIn('Content-Security-Policy', response)
+        self.assertFalse(hasattr(response.wsgi_request, 'roles'))
+
+    def test_security_headers(self):
+        """Test that pages get the precomputed security headers"""
+        response = self.client.get(reverse('accounts:login'))
+        self.assertIn("default-src 'self'", response['Content-Security-Policy'])
+        self.assertEqual(response['X-Frame-Options'], 'DENY')
+        self.assertEqual(response.wsgi_request.route_class, 'auth')
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpassword'
+        )
+
+    def test_metrics_admin_only(self):
+        """Test that only admins or the metrics token can read the metrics"""
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 403)
+
+        with self.settings(METRICS_TOKEN='secret'):
+            response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+
+        self.client.login(username='testuser', password='testpassword')
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+    def test_metrics_per_view(self):
+        """Test that requests are recorded per view and rejections per rule"""
+        self.user.profile.is_admin = True
+        self.user.profile.save()
+        self.client.login(username='testuser', password='testpassword')
+        self.client.get(reverse('notes:list'))
+        with self.assertLogs('apps.accounts.middleware', level='WARNING'):
+            self.client.get(reverse('notes:list'), {'q': 'SELECT * FROM auth_user'})
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('notes_http_requests_total{view="notes:list",method="GET",status="200"}', body)
+        self.assertIn('notes_http_request_duration_seconds_bucket{view="notes:list",le="+Inf"}', body)
+        self.assertIn('notes_db_queries_per_request_count{view="notes:list"}', body)
+        self.assertIn('notes_request_rejections_total{reason="validation",rule="sql-select"}', body)
+
+    def test_metrics_of_other_workers(self):
+        """Test that the snapshots of running and exited workers are added up"""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        exited = subprocess.Popen([sys.executable, '-c', ''])
+        exited.wait()
+        for pid, count in ((os.getppid(), 1000), (exited.pid, 500)):
+            snapshot = [['notes_request_rejections_total', ['rate_limit', 'api'], count]]
+            with open(os.path.join(directory.name, f'metrics-{pid}.json'), 'w') as file:
+                json.dump(snapshot, file)
+
+        with self.settings(METRICS_DIR=directory.name, METRICS_TOKEN='secret'):
+            for _ in range(2):
+                response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+                self.assertIn(
+                    'notes_request_rejections_total{reason="rate_limit",rule="api"} 1500', response.content.decode()
+                )
+        # The snapshot of the exited worker was folded into the exited workers file
+        self.assertFalse(os.path.exists(os.path.join(directory.name, f'metrics-{exited.pid}.json')))
+        self.assertTrue(os.path.exists(os.path.join(directory.name, 'exited-workers.json')))
+
+    def test_snapshot_of_reused_pid(self):
+        """Test that a snapshot left under the pid of this process is not mixed with its counts"""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, f'metrics-{os.getpid()}.json')
+        with open(path, 'w') as file:
+            json.dump([['notes_request_rejections_total', ['rate_limit', 'api'], 7]], file)
+
+        registry = metrics.MetricsRegistry()
+        registry.inc('notes_request_rejections_total', ('rate_limit', 'api'))
+        with self.settings(METRICS_DIR=directory.name):
+            registry.flush(force=True)
+        with open(path) as file:
+            self.assertEqual(json.load(file), [['notes_request_rejections_total', ['rate_limit', 'api'], 1]])
+        with open(os.path.join(directory.name, 'exited-workers.json')) as file:
+            self.assertEqual(json.load(file), [['notes_request_rejections_total', ['rate_limit', 'api'], 7]])
+
+    def test_unknown_methods_are_grouped(self):
+        """Test that request methods outside the standard ones share one label value"""
+        self.client.generic('BREW', reverse('accounts:login'))
+        self.client.login(username='testuser', password='testpassword')
+        with self.settings(METRICS_TOKEN='secret'):
+            body = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').content.decode()
+        self.assertIn('method="other"', body)
+        self.assertNotIn('BREW', body)
+
+
+class MemoryTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpassword'
+        )
+        self.user.profile.is_admin = True
+        self.user.profile.save()
+
+    def test_memory_per_view(self):
+        """Test that the memory of the worker is recorded per view"""
+        self.client.login(username='testuser', password='testpassword')
+        self.client.get(reverse('notes:list'))
+
+        body = self.client.get('/metrics').content.decode()
+        self.assertIn('notes_worker_rss_bytes_count{view="notes:list"}', body)
+
+    def test_memory_snapshots(self):
+        """Test that snapshots of a worker show its allocation sites and their growth"""
+        self.assertEqual(self.client.get('/metrics/memory').status_code, 403)
+        self.client.login(username='testuser', password='testpassword')
+        self.assertFalse(tracemalloc.is_tracing())
+        self.addCleanup(memory.stop_tracing)
+
+        with self.settings(MEMORY_TRACE_SECONDS=60):
+            body = self.client.get('/metrics/memory', {'snapshot': 1}).content.decode()
+        self.assertIn(f'Worker: {os.getpid()}', body)
+        self.assertIn('Tracing allocations: yes, stops in 60 s', body)
+        self.assertIn('(take two snapshots of this worker)', body)
+
+        retained = [bytearray(1024) for _ in range(1000)]
+        body = self.client.get('/metrics/memory', {'snapshot': 1}).content.decode()
+        self.assertIn('tests.py', body.split('Growth since the previous snapshot:')[1])
+        del retained
+
+        # Stopping keeps the report of the snapshots
+        body = self.client.get('/metrics/memory', {'stop': 1}).content.decode()
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertIn('Tracing allocations: no', body)
+        self.assertIn('tests.py', body)
+
+    def test_tracing_stops_by_itself(self):
+        """Test that tracing started for a snapshot does not outlive its duration"""
+        self.addCleanup(memory.stop_tracing)
+        memory.start_tracing(duration=0.05)
+        self.assertTrue(tracemalloc.is_tracing())
+        memory._stop_timer.join(5)
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_recycle_over_limit(self):
+        """Test that a worker over MEMORY_MAX_RSS_MB is recycled once"""
+        self.addCleanup(setattr, memory, '_recycling', False)
+        with self.settings(MEMORY_MAX_RSS_MB=1):
+            with self.assertLogs('apps.accounts.memory', level='WARNING') as logs:
+                self.client.get(reverse('accounts:login'))
+                self.client.get(reverse('accounts:login'))
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn('over the limit', logs.output[0])
+
+
+@modify_settings(MIDDLEWARE={'append': 'apps.accounts.middleware.QueryLogMiddleware'})
+@override_settings(QUERY_LOG_SLOW_MS=10000, QUERY_LOG_REPEAT_THRESHOLD=5)
+class QueryLogTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpassword'
+        )
+        self.client.login(username='testuser', password='testpassword')
+
+    def test_query_shape(self):
+        """Test that runs of a query with other parameters have the same shape"""
+        self.assertEqual(
+            query_shape("SELECT * FROM t WHERE id IN (%s, %s, %s) AND name = 'x'"),
+            query_shape("SELECT * FROM t WHERE id IN (%s) AND name = 'y'"),
+        )
+
+    def test_repeated_queries_reported(self):
+        """Test that a query run once per object is reported with its location"""
+        for i in range(6):
+            Category.objects.create(name=f'Category {i}', user=self.user)
+
+        with self.assertLogs('apps.accounts.queries', level='WARNING') as logs:
+            self.client.get(reverse('notes:category_list'))
+        self.assertIn('Repeated query in notes:category_list', logs.output[0])
+
+        report = QueryReport.objects.get(kind='repeated', view='notes:category_list')
+        self.assertGreaterEqual(report.max_runs, 6)
+        self.assertIn('apps/notes/views.py', report.location)
+        self.assertIn('category_list', report.location)
+        self.assertTrue(report.plan)
+
+        # The same query in a later request counts one more occurrence
+        with self.assertLogs('apps.accounts.queries', level='WARNING'):
+            self.client.get(reverse('notes:category_list'))
+        report.refresh_from_db()
+        self.assertEqual(report.occurrences, 2)
+
+    def test_slow_queries_reported(self):
+        """Test that queries above the time threshold are reported"""
+        with self.settings(QUERY_LOG_SLOW_MS=0):
+            self.client = self.client_class()
+            self.client.login(username='testuser', password='testpassword')
+            with self.assertLogs('apps.accounts.queries', level='WARNING'):
+                self.client.get(reverse('notes:category_list'))
+        self.assertTrue(QueryReport.objects.filter(kind='slow', view='notes:category_list').exists())
+
+
+class ProfilerTest(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(username='admin', password='adminpassword', is_staff=True)
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpassword'
+        )
+
+    def test_admin_profiles_request(self):
+        """Test that an admin can profile a request and download the profile"""
+        self.client.login(username='admin', password='adminpassword')
+        response = self.client.get(reverse('notes:list'), {'_profile': 'cprofile'})
+        report = ProfileReport.objects.get(pk=response['X-Profile-Report'])
+        self.assertEqual(report.view, 'notes:list')
+        self.assertEqual(report.query_count, len(report.sql_timeline))
+        self.assertTrue(marshal.loads(bytes(report.data)))
+
+        response = self.client.get(reverse('admin:accounts_profilereport_download', args=[report.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('.pstats', response['Content-Disposition'])
+
+    def test_profile_token(self):
+        """Test that a signed token profiles the requests of its user only"""
+        token = make_profile_token(self.admin, user=self.user, mode='sample')
+        self.client.login(username='testuser', password='testpassword')
+        response = self.client.get(reverse('notes:list'), HTTP_X_PROFILE=token)
+        report = ProfileReport.objects.get(pk=response['X-Profile-Report'])
+        self.assertEqual(report.created_by, self.admin)
+        self.assertEqual(report.user, self.user)
+        self.assertEqual(json.loads(bytes(report.data))['profiles'][0]['type'], 'sampled')
+
+        # Users cannot profile without a valid token
+        for value in ('cprofile', token + 'x'):
+            response = self.client.get(reverse('notes:list'), {'_profile': value})
+            self.assertNotIn('X-Profile-Report', response)
+
+        self.client.login(username='admin', password='adminpassword')
+        response = self.client.get(reverse('notes:list'), {'_profile': token})
+        self.assertNotIn('X-Profile-Report', response)
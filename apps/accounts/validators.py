@@ -10,6 +10,8 @@ from django.core.validators import validate_email as django_validate_email
 from functools import wraps
 import re
 
+from .roles import get_user_roles
+
 
 def validate_admin_role(user):
     """
@@ -21,7 +23,7 @@ def validate_admin_role(user):
     Raises:
         ValidationError: If the user does not have admin role
     """
-    if not hasattr(user, 'profile') or not user.profile.is_admin:
+    if not get_user_roles(user).is_admin:
         raise ValidationError(
             _("User does not have admin privileges."),
             code='not_admin'
@@ -62,7 +64,7 @@ def validate_object_permission(user, obj, permission_types=None):
         permission_types = ['read']
     
     # Check if user is admin (admins have all permissions)
-    if hasattr(user, 'profile') and user.profile.is_admin:
+    if get_user_roles(user).is_admin:
         return
     
     # Check if user is the owner
@@ -108,7 +110,8 @@ def require_role(role):
             if not user.is_authenticated:
                 raise PermissionDenied("Authentication required")
             
-            if role == 'admin' and (not hasattr(user, 'profile') or not user.profile.is_admin):
+            roles = getattr(request, 'roles', None) or get_user_roles(user)
+            if role == 'admin' and not roles.is_admin:
                 raise PermissionDenied("Admin privileges required")
             
             return view_func(request, *args, **kwargs)
@@ -155,7 +158,8 @@ class RolePermissionMixin:
         if not user.is_authenticated:
             raise PermissionDenied("Authentication required")
         
-        if self.required_role == 'admin' and (not hasattr(user, 'profile') or not user.profile.is_admin):
+        roles = getattr(request, 'roles', None) or get_user_roles(user)
+        if self.required_role == 'admin' and not roles.is_admin:
             raise PermissionDenied("Admin privileges required")
         
         if self.required_permission and not user.has_perm(self.required_permission):
@@ -175,7 +179,8 @@ class ObjectOwnerPermissionMixin:
         
         # Check if user is admin
         user = self.request.user
-        if hasattr(user, 'profile') and user.profile.is_admin:
+        roles = getattr(self.request, 'roles', None) or get_user_roles(user)
+        if roles.is_admin:
             return obj
         
         # Check ownership
@@ -1,7 +1,15 @@
+import os
+
 from django.shortcuts import render, redirect
 from django.contrib.auth import authenticate, login, logout
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
+from django.conf import settings
+from django.http import HttpResponse
+from django.core.exceptions import PermissionDenied
+from django.utils.crypto import constant_time_compare
+from . import memory, metrics
+from .roles import get_user_roles
 from .forms import LoginForm, RegistrationForm
 from django.contrib.auth.backends import ModelBackend
 
@@ -62,3 +70,50 @@ def logout_view(request):
     logout(request)
     messages.info(request, "You have been logged out.")
     return redirect('accounts:login')
+
+
+def _check_metrics_access(request):
+    """Allow admins, or the metrics token as a bearer token."""
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    if not (token and constant_time_compare(authorization, f'Bearer {token}')):
+        if not get_user_roles(request.user).can_manage:
+            raise PermissionDenied("Admin privileges required")
+
+
+def metrics_view(request):
+    """Expose the metrics of all workers in the Prometheus text format."""
+    _check_metrics_access(request)
+    
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def memory_view(request):
+    """
+    Describe the memory of the worker answering the request.
+    ?snapshot=1 takes a tracemalloc snapshot, starting to trace for
+    MEMORY_TRACE_SECONDS if needed, later snapshots are compared to the
+    previous one of the same worker. ?stop=1 stops tracing now.
+    """
+    _check_metrics_access(request)
+    
+    if request.GET.get('stop'):
+        memory.stop_tracing()
+    elif request.GET.get('snapshot'):
+        memory.start_tracing(duration=getattr(settings, 'MEMORY_TRACE_SECONDS', 300))
+        memory.take_snapshot()
+    
+    rss = memory.current_rss()
+    lines = [
+        f"Worker: {os.getpid()}",
+        f"Resident memory: {rss // 1024 if rss is not None else '?'} KB",
+        f"Peak resident memory: {memory.peak_rss() // 1024} KB",
+        f"Tracing allocations: {memory.tracing_status()}",
+        "",
+        "Top allocation sites:",
+        *(memory.top_allocations() or ["(take a snapshot with ?snapshot=1)"]),
+        "",
+        "Growth since the previous snapshot:",
+        *(memory.allocation_growth() or ["(take two snapshots of this worker)"]),
+    ]
+    return HttpResponse('\n'.join(lines) + '\n', content_type='text/plain; charset=utf-8')
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Category, Tag, Note
+from .models import Category, Tag, Note, NoteRevision, UserUsage, NoteImport, BlockedWord
 
 
 @admin.register(Category)
@@ -26,7 +26,7 @@ class TagInline(admin.TabularInline):
 class NoteAdmin(admin.ModelAdmin):
     list_display = ('title', 'user', 'category', 'get_tags', 'created_at', 'updated_at')
     list_filter = ('user', 'category', 'tags')
-    search_fields = ('title', 'content')
+    search_fields = ('title', 'content', 'excerpt')
     date_hierarchy = 'created_at'
     readonly_fields = ('created_at', 'updated_at')
     filter_horizontal = ('tags',)
@@ -46,3 +46,37 @@ class NoteAdmin(admin.ModelAdmin):
         return obj.get_tags_display()
     
     get_tags.short_description = 'Tags'
+
+
+@admin.register(UserUsage)
+class UserUsageAdmin(admin.ModelAdmin):
+    list_display = ('user', 'note_count', 'content_bytes', 'attachment_count', 'attachment_bytes', 'updated_at')
+    search_fields = ('user__username',)
+    readonly_fields = ('note_count', 'content_bytes', 'attachment_count', 'attachment_bytes', 'updated_at')
+
+
+@admin.register(NoteImport)
+class NoteImportAdmin(admin.ModelAdmin):
+    list_display = ('file_name', 'user', 'source_format', 'status', 'imported_count', 'failed_count', 'created_at')
+    list_filter = ('status', 'source_format')
+    search_fields = ('user__username', 'file_name')
+    readonly_fields = (
+        'bytes_total', 'bytes_read', 'imported_count', 'failed_count', 'errors', 'message',
+        'created_at', 'updated_at', 'finished_at'
+    )
+
+
+@admin.register(NoteRevision)
+class NoteRevisionAdmin(admin.ModelAdmin):
+    list_display = ('note', 'number', 'title', 'is_snapshot', 'content_bytes', 'saved_at')
+    list_filter = ('is_snapshot',)
+    search_fields = ('note__title', 'title')
+    raw_id_fields = ('note',)
+    readonly_fields = ('note', 'number', 'title', 'is_snapshot', 'data', 'content_bytes', 'saved_at', 'created_at')
+
+
+@admin.register(BlockedWord)
+class BlockedWordAdmin(admin.ModelAdmin):
+    list_display = ('word', 'word_list', 'created_at')
+    list_filter = ('word_list',)
+    search_fields = ('word',)
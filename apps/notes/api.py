@@ -1,10 +1,23 @@
 from rest_framework import viewsets, permissions, filters
 from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.response import Response
-from django.db.models import Count
+from rest_framework import status
+from django.core.exceptions import ImproperlyConfigured, ValidationError as DjangoValidationError
+from django.db.models import Count, Q
 
-from .models import Note, Category, Tag
-from .serializers import NoteSerializer, CategorySerializer, TagSerializer
+from .models import Note, NoteRevision, Category, Tag, NoteImport
+from .services import (
+    parse_flag, set_note_pinned, set_note_archived, move_note, share_notes, apply_content_patch,
+    editable_notes, restore_revision
+)
+from .bulk import apply_bulk_operations
+from .drafts import save_draft, get_draft, discard_draft, persist_draft
+from .importers import PARSERS, MAX_IMPORT_FILE_SIZE, guess_format, store_upload
+from .serializers import (
+    NoteSerializer, NoteListSerializer, CategorySerializer, TagSerializer, NoteImportSerializer,
+    NoteRevisionSerializer
+)
 
 
 class IsOwner(permissions.BasePermission):
@@ -16,16 +29,35 @@ class IsOwner(permissions.BasePermission):
         return obj.user == request.user
 
 
+class NoteSearchFilter(filters.SearchFilter):
+    """
+    Search filter for notes that also finds text in compressed note content,
+    see Note.content_search. Every term must be in the title or the content.
+    """
+    
+    def filter_queryset(self, request, queryset, view):
+        # The parameter is split into words and quoted phrases like SearchFilter does
+        terms = list(filters.search_smart_split(self.get_search_terms(request)))
+        if not terms:
+            return queryset
+        # Compressed notes are decompressed once for all terms
+        content_queries = Note.content_search_each(terms, queryset)
+        for term, content_query in zip(terms, content_queries):
+            queryset = queryset.filter(Q(title__icontains=term) | content_query)
+        return queryset
+
+
 class NoteViewSet(viewsets.ModelViewSet):
     """
     API endpoint for notes.
     """
     serializer_class = NoteSerializer
     permission_classes = [permissions.IsAuthenticated, IsOwner]
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [NoteSearchFilter, filters.OrderingFilter]
     search_fields = ['title', 'content']
     ordering_fields = ['title', 'created_at', 'updated_at']
     ordering = ['-updated_at']
+    lookup_value_regex = r'\d+'
     
     def get_queryset(self):
         user = self.request.user
@@ -41,8 +73,22 @@ class NoteViewSet(viewsets.ModelViewSet):
         if tag_id:
             queryset = queryset.filter(tags__id=tag_id)
         
+        # List responses only carry the excerpt, so skip loading note bodies
+        if self.action == 'list':
+            queryset = queryset.defer_content()
+        
         return queryset
     
+    def perform_update(self, serializer):
+        serializer.save()
+        # The explicit save supersedes the autosaved draft
+        discard_draft(self.request.user, serializer.instance.pk)
+    
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return NoteListSerializer
+        return NoteSerializer
+    
     @action(detail=False, methods=['get'])
     def stats(self, request):
         """
@@ -58,6 +104,199 @@ class NoteViewSet(viewsets.ModelViewSet):
             'total_notes': total_notes,
             'notes_by_category': notes_by_category
         })
+    
+    # Toggle actions run a single UPDATE instead of loading and re-validating the note
+    @action(detail=True, methods=['post', 'patch'])
+    def pin(self, request, pk=None):
+        """
+        Pin or unpin a note. Send {"value": true/false}, or no value to toggle.
+        """
+        if not set_note_pinned(request.user, pk, parse_flag(request.data.get('value'))):
+            return Response({'error': 'Note not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'id': int(pk), 'updated': True})
+    
+    @action(detail=True, methods=['post', 'patch'])
+    def archive(self, request, pk=None):
+        """
+        Archive or unarchive a note. Send {"value": true/false}, or no value to toggle.
+        """
+        if not set_note_archived(request.user, pk, parse_flag(request.data.get('value'))):
+            return Response({'error': 'Note not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'id': int(pk), 'updated': True})
+    
+    @action(detail=True, methods=['post', 'patch'])
+    def move(self, request, pk=None):
+        """
+        Move a note to another category. Send {"category": <id>}, or null to clear it.
+        """
+        category_id = request.data.get('category')
+        try:
+            category_id = int(category_id) if category_id not in (None, '') else None
+        except (TypeError, ValueError):
+            return Response({'category': 'Invalid category id'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        if not move_note(request.user, pk, category_id):
+            return Response({'error': 'Note or category not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'id': int(pk), 'category': category_id})
+    
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Apply several note operations in one request.
+        Send {"operations": [{"op": "create"|"update"|"archive"|"pin"|"move"|"delete", ...}]}.
+        Valid operations are applied even if others fail; each gets a result entry.
+        """
+        operations = request.data
+        if isinstance(operations, dict):
+            operations = operations.get('operations')
+        
+        try:
+            results = apply_bulk_operations(request.user, operations)
+        except DjangoValidationError as e:
+            return Response({'operations': e.messages}, status=status.HTTP_400_BAD_REQUEST)
+        
+        failed = sum(1 for result in results if result['status'] == 'error')
+        return Response({
+            'results': results,
+            'succeeded': len(results) - failed,
+            'failed': failed,
+        })
+    
+    @action(detail=True, methods=['post', 'patch'], url_path='content')
+    def patch_content(self, request, pk=None):
+        """
+        Update the content with a list of changes against a version of the note.
+        Send {"base": "<updated_at>", "changes": [{"start": 10, "end": 15, "text": "new"}]}.
+        Offsets count characters (code points), or UTF-16 code units with "offsets": "utf-16".
+        Returns 409 if the note was saved since that version.
+        """
+        try:
+            note = apply_content_patch(
+                request.user, int(pk), request.data.get('base'), request.data.get('changes'),
+                offsets=request.data.get('offsets'),
+            )
+        except Note.DoesNotExist:
+            return Response({'error': 'Note not found'}, status=status.HTTP_404_NOT_FOUND)
+        except DjangoValidationError as e:
+            if getattr(e, 'code', None) == 'stale_base':
+                return Response({'error': e.message}, status=status.HTTP_409_CONFLICT)
+            errors = e.message_dict if hasattr(e, 'error_dict') else {'non_field_errors': e.messages}
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        discard_draft(request.user, note.pk)
+        return Response({'id': note.pk, 'updated_at': note.updated_at, 'content_bytes': note.content_bytes})
+    
+    @action(detail=True, methods=['get', 'put', 'delete'])
+    def draft(self, request, pk=None):
+        """
+        Get, autosave (PUT {"title": ..., "content": ...}) or discard the draft of a note.
+        Drafts are kept in the cache and do not change the note until flushed.
+        Autosave answers 503 when the server has no cache shared by its workers.
+        """
+        try:
+            note_id = int(pk)
+        except ValueError:
+            return Response({'error': 'Note not found'}, status=status.HTTP_404_NOT_FOUND)
+        
+        if request.method == 'DELETE':
+            discard_draft(request.user, note_id)
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        
+        if request.method == 'PUT':
+            try:
+                draft = save_draft(request.user, note_id, request.data.get('title'), request.data.get('content'))
+            except Note.DoesNotExist:
+                return Response({'error': 'Note not found'}, status=status.HTTP_404_NOT_FOUND)
+            except DjangoValidationError as e:
+                return Response({'error': ' '.join(e.messages)}, status=status.HTTP_400_BAD_REQUEST)
+            except ImproperlyConfigured:
+                return Response(
+                    {'error': 'Autosave is disabled on this server.'}, status=status.HTTP_503_SERVICE_UNAVAILABLE
+                )
+            return Response({'saved_at': draft['saved_at']})
+        
+        draft = get_draft(request.user, note_id)
+        if draft is None:
+            return Response({'error': 'No draft'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(draft)
+    
+    @action(detail=True, methods=['post'], url_path='draft/flush')
+    def flush_draft(self, request, pk=None):
+        """
+        Save the draft of a note to the note now.
+        """
+        try:
+            note = persist_draft(request.user, int(pk))
+        except (Note.DoesNotExist, ValueError):
+            return Response({'error': 'Note not found'}, status=status.HTTP_404_NOT_FOUND)
+        except DjangoValidationError as e:
+            errors = e.message_dict if hasattr(e, 'error_dict') else {'non_field_errors': e.messages}
+            # The draft is kept, the user can reload the note and merge it
+            conflict = getattr(e, 'code', None) == 'conflict'
+            return Response(errors, status=status.HTTP_409_CONFLICT if conflict else status.HTTP_400_BAD_REQUEST)
+        if note is None:
+            return Response({'error': 'No draft'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(NoteSerializer(note, context=self.get_serializer_context()).data)
+    
+    @action(detail=True, methods=['get'])
+    def revisions(self, request, pk=None):
+        """
+        List the earlier versions of a note, newest first.
+        """
+        note = editable_notes(request.user).filter(pk=pk).only('pk').first()
+        if note is None:
+            return Response({'error': 'Note not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(NoteRevisionSerializer(note.revisions.defer('data'), many=True).data)
+    
+    @action(detail=True, methods=['get'], url_path=r'revisions/(?P<number>\d+)')
+    def revision(self, request, pk=None, number=None):
+        """
+        Get an earlier version of a note with its content.
+        """
+        try:
+            revision = NoteRevision.objects.get(note__in=editable_notes(request.user).filter(pk=pk), number=number)
+        except NoteRevision.DoesNotExist:
+            return Response({'error': 'Revision not found'}, status=status.HTTP_404_NOT_FOUND)
+        data = NoteRevisionSerializer(revision).data
+        data['content'] = revision.get_content()
+        return Response(data)
+    
+    @action(detail=True, methods=['post'], url_path=r'revisions/(?P<number>\d+)/restore')
+    def restore(self, request, pk=None, number=None):
+        """
+        Restore a note to an earlier version. The replaced version is kept as a new revision.
+        """
+        try:
+            note = restore_revision(request.user, int(pk), int(number))
+        except Note.DoesNotExist:
+            return Response({'error': 'Note not found'}, status=status.HTTP_404_NOT_FOUND)
+        except NoteRevision.DoesNotExist:
+            return Response({'error': 'Revision not found'}, status=status.HTTP_404_NOT_FOUND)
+        except DjangoValidationError as e:
+            errors = e.message_dict if hasattr(e, 'error_dict') else {'non_field_errors': e.messages}
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        discard_draft(request.user, note.pk)
+        return Response(NoteSerializer(note, context=self.get_serializer_context()).data)
+    
+    @action(detail=False, methods=['post'])
+    def share(self, request):
+        """
+        Share several notes with several users.
+        Send {"notes": [<id>, ...], "users": [<id>, ...], "permission": "read"|"edit"|"admin"}.
+        """
+        try:
+            note_ids = [int(pk) for pk in request.data.get('notes') or []]
+            user_ids = [int(pk) for pk in request.data.get('users') or []]
+        except (TypeError, ValueError):
+            return Response({'error': 'Notes and users must be lists of ids'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            created = share_notes(request.user, note_ids, user_ids, request.data.get('permission', 'read'))
+        except DjangoValidationError as e:
+            errors = e.message_dict if hasattr(e, 'error_dict') else {'non_field_errors': e.messages}
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'created': created})
 
 
 class CategoryViewSet(viewsets.ModelViewSet):
@@ -85,4 +324,39 @@ class TagViewSet(viewsets.ModelViewSet):
         return Tag.objects.filter(user=self.request.user)
     
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user) 
\ No newline at end of file
+        serializer.save(user=self.request.user) 
+
+
+class NoteImportViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    API endpoint for note imports.
+    Upload a file with POST (multipart "file" and optional "format": json, markdown or enex).
+    The file is imported in the background, its progress can be polled with GET.
+    """
+    serializer_class = NoteImportSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    parser_classes = [MultiPartParser, FormParser]
+    
+    def get_queryset(self):
+        return NoteImport.objects.filter(user=self.request.user)
+    
+    def create(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'file': 'No file was uploaded.'}, status=status.HTTP_400_BAD_REQUEST)
+        if upload.size > MAX_IMPORT_FILE_SIZE:
+            return Response(
+                {'file': f'Import files cannot exceed {MAX_IMPORT_FILE_SIZE // (1024 * 1024)} MB.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        source_format = request.data.get('format') or guess_format(upload.name)
+        if source_format not in PARSERS:
+            return Response(
+                {'format': f'Unknown import format. Use one of: {", ".join(PARSERS)}.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        # Imports can outlast the worker timeout, they run in `manage.py import_notes --pending`
+        note_import = store_upload(request.user, upload, source_format)
+        return Response(self.get_serializer(note_import).data, status=status.HTTP_202_ACCEPTED)
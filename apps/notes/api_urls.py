@@ -1,13 +1,14 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
-from .api import NoteViewSet, CategoryViewSet, TagViewSet
+from .api import NoteViewSet, CategoryViewSet, TagViewSet, NoteImportViewSet
 
 # Create a router for the API endpoints
 router = DefaultRouter()
 router.register(r'notes', NoteViewSet, basename='api-note')
 router.register(r'categories', CategoryViewSet, basename='api-category')
 router.register(r'tags', TagViewSet, basename='api-tag')
+router.register(r'imports', NoteImportViewSet, basename='api-import')
 
 # API URL patterns
 urlpatterns = [
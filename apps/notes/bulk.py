@@ -0,0 +1,429 @@
+"""
+Bulk note operations for Notes Manager application.
+This module applies a list of note operations (create, update, archive, pin,
+move, delete) for one user with a fixed number of queries per operation type.
+"""
+from collections import defaultdict
+
+from django.core.exceptions import ValidationError
+from django.db import connection, models, transaction
+from django.utils import timezone
+
+from .models import Note, NoteRevision, Category, Tag, UserUsage
+from .services import (
+    MAX_TAGS_PER_NOTE, parse_flag, normalize_tag_names, resolve_tags,
+    pin_update_values, archive_update_values
+)
+from .validators import validate_tag_name
+
+
+BULK_OPERATIONS = ('create', 'update', 'archive', 'pin', 'move', 'delete')
+
+# Maximum number of operations accepted in one request
+MAX_BULK_OPERATIONS = 500
+
+# Batch size for bulk INSERT and UPDATE statements
+BULK_BATCH_SIZE = 200
+
+
+class BulkOperationError(Exception):
+    """Raised for a single operation that cannot be applied."""
+
+    def __init__(self, errors):
+        super().__init__(errors)
+        self.errors = errors
+
+
+def _as_int(value, field):
+    """Convert an id from request data to an int."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise BulkOperationError({field: ['A valid id is required.']})
+
+
+def _validation_errors(error):
+    """Convert a Django ValidationError into a field -> messages dict."""
+    if hasattr(error, 'error_dict'):
+        return error.message_dict
+    return {'non_field_errors': error.messages}
+
+
+def validate_text_fields(**fields):
+    """
+    Check that note text fields from request data are strings (or missing).
+
+    Raises:
+        ValidationError: With the fields that have another type
+    """
+    errors = {
+        field: ['This field must be a string.']
+        for field, value in fields.items()
+        if value is not None and not isinstance(value, str)
+    }
+    if errors:
+        raise ValidationError(errors)
+
+
+def prepare_note(user, title, content, category=None, is_pinned=False, is_archived=False):
+    """
+    Build an unsaved note for bulk insertion.
+
+    The content is sanitized, the content metrics are filled in and the fields
+    are validated like Note.save does, except for the quota and category checks
+    which bulk callers run for the whole batch.
+
+    Raises:
+        ValidationError: If a field is invalid
+    """
+    validate_text_fields(title=title, content=content)
+    note = Note(
+        user=user,
+        category=category,
+        title=title or '',
+        content=content or '',
+        is_archived=bool(is_archived),
+        # A note cannot be both archived and pinned
+        is_pinned=bool(is_pinned) and not is_archived,
+    )
+    note.sanitize_content()
+    note.update_content_metrics()
+    note.clean_fields(exclude=['user', 'category'])
+    return note
+
+
+def insert_notes(user, entries, batch_size=BULK_BATCH_SIZE):
+    """
+    Insert prepared notes with their tags and charge them to the user's usage.
+
+    Args:
+        user: Owner of the notes
+        entries: List of (note, tags, new_tag_names) tuples, where tags are
+            Tag objects of the user and new_tag_names validated tag names
+        batch_size: Number of rows per INSERT statement
+    """
+    if not entries:
+        return
+
+    notes = [note for note, tags, new_tag_names in entries]
+    if connection.features.can_return_rows_from_bulk_insert:
+        Note.objects.bulk_create(notes, batch_size=batch_size)
+    else:
+        # Backends that do not return ids from bulk inserts need one INSERT per note;
+        # the notes are already validated, so Note.save is bypassed
+        for note in notes:
+            models.Model.save(note)
+
+    # Resolve every new tag name of the batch at once, then link all tags in one insert
+    resolved = {
+        tag.name.lower(): tag
+        for tag in resolve_tags(
+            user, [name for note, tags, new_tag_names in entries for name in new_tag_names], validate=False
+        )
+    }
+    Through = Note.tags.through
+    links = {
+        (note.pk, tag.pk)
+        for note, tags, new_tag_names in entries
+        for tag in list(tags) + [resolved[name.lower()] for name in new_tag_names if name.lower() in resolved]
+    }
+    Through.objects.bulk_create(
+        [Through(note_id=note_id, tag_id=tag_id) for note_id, tag_id in links],
+        batch_size=batch_size,
+        ignore_conflicts=True,
+    )
+
+    UserUsage.adjust(
+        user.pk,
+        note_count=len(notes),
+        content_bytes=sum(note.content_bytes for note in notes),
+    )
+
+
+def validate_new_tag_names(names, existing_count=0):
+    """
+    Normalize and validate the names of tags to create for one note.
+
+    Returns:
+        List of normalized tag names
+
+    Raises:
+        ValidationError: If there are too many tags or a name is invalid
+    """
+    if isinstance(names, str):
+        names = names.split(',')
+    elif names is not None and not (
+        isinstance(names, (list, tuple)) and all(isinstance(name, str) for name in names)
+    ):
+        raise ValidationError({'new_tags': ['Tags must be a list of names.']})
+    names = normalize_tag_names(names or [])
+    if existing_count + len(names) > MAX_TAGS_PER_NOTE:
+        raise ValidationError({'tags': [f'A note cannot have more than {MAX_TAGS_PER_NOTE} tags.']})
+    for name in names:
+        try:
+            validate_tag_name(name)
+        except ValidationError as e:
+            raise ValidationError({'new_tags': [f'Invalid tag "{name}": {" ".join(e.messages)}']})
+    return names
+
+
+def apply_bulk_operations(user, operations):
+    """
+    Apply a list of note operations for a user.
+
+    Each operation is a dict with an 'op' key and its arguments:
+    - create: title, content, category, is_pinned, is_archived, tags (ids), new_tags (names)
+    - update: id and any of title, content, category, is_pinned, is_archived
+    - archive, pin: id and optional value (omit to toggle)
+    - move: id and category (null to clear)
+    - delete: id
+
+    Ownership of all referenced notes, categories and tags is checked with one
+    query each. Creates use bulk_create, updates bulk_update, and archive, pin,
+    move and delete one UPDATE/DELETE per distinct value. Quotas are checked
+    against the user's locked usage ledger. Invalid operations are reported
+    and skipped; valid ones are applied in one transaction.
+
+    Args:
+        user: User performing the operations
+        operations: List of operation dicts
+
+    Returns:
+        List of per-operation results with 'index', 'op', 'status' ('ok' or
+        'error') and either 'id' or 'errors'
+
+    Raises:
+        ValidationError: If operations is not a list or is too long
+    """
+    if not isinstance(operations, list):
+        raise ValidationError('Operations must be a list.')
+    if len(operations) > MAX_BULK_OPERATIONS:
+        raise ValidationError(
+            f'You cannot send more than {MAX_BULK_OPERATIONS} operations at once.'
+        )
+
+    results = [None] * len(operations)
+
+    def succeed(index, op, note_id):
+        results[index] = {'index': index, 'op': op, 'status': 'ok', 'id': note_id}
+
+    def fail(index, op, errors):
+        results[index] = {'index': index, 'op': op, 'status': 'error', 'errors': errors}
+
+    # Parse the operations and collect every referenced id
+    parsed = defaultdict(list)
+    note_ids = set()
+    category_ids = set()
+    tag_ids = set()
+    for index, item in enumerate(operations):
+        op = item.get('op') if isinstance(item, dict) else None
+        try:
+            if op not in BULK_OPERATIONS:
+                raise BulkOperationError({'op': [f'Unknown operation. Use one of: {", ".join(BULK_OPERATIONS)}.']})
+
+            if op != 'create':
+                note_id = _as_int(item.get('id'), 'id')
+                if note_id in note_ids:
+                    raise BulkOperationError({'id': ['A note can only appear in one operation per request.']})
+                note_ids.add(note_id)
+                item = dict(item, id=note_id)
+
+            if item.get('category') not in (None, ''):
+                item = dict(item, category=_as_int(item['category'], 'category'))
+                category_ids.add(item['category'])
+            elif 'category' in item:
+                item = dict(item, category=None)
+
+            if op == 'create':
+                if not isinstance(item.get('tags') or [], list):
+                    raise BulkOperationError({'tags': ['Tags must be a list of ids.']})
+                item = dict(item, tags=[_as_int(tag_id, 'tags') for tag_id in item.get('tags') or []])
+                tag_ids.update(item['tags'])
+        except BulkOperationError as e:
+            fail(index, op, e.errors)
+            continue
+        parsed[op].append((index, item))
+
+    with transaction.atomic(), UserUsage.batch_adjustments():
+        # One ownership query per kind of referenced object
+        notes = {}
+        if note_ids:
+            queryset = Note.objects.filter(user=user, pk__in=note_ids)
+            if not any('content' in item for index, item in parsed['update']):
+                queryset = queryset.defer_content()
+            notes = {note.pk: note for note in queryset}
+        categories = {}
+        if category_ids:
+            categories = {category.pk: category for category in Category.objects.filter(user=user, pk__in=category_ids)}
+        tags = {}
+        if tag_ids:
+            tags = {tag.pk: tag for tag in Tag.objects.filter(user=user, pk__in=tag_ids)}
+
+        def get_note(index, op, item):
+            note = notes.get(item['id'])
+            if note is None:
+                fail(index, op, {'id': ['Note not found.']})
+            return note
+
+        def get_category(item):
+            category_id = item.get('category')
+            if category_id is not None and category_id not in categories:
+                raise BulkOperationError({'category': ['Category not found.']})
+            return categories.get(category_id)
+
+        usage = None
+        if parsed['create'] or parsed['update']:
+            usage = UserUsage.for_user(user, lock=True)
+        quota = {
+            'notes': usage.note_count if usage else 0,
+            'bytes': usage.content_bytes if usage else 0,
+        }
+
+        def check_content_quota(size_delta):
+            if quota['bytes'] + size_delta > UserUsage.MAX_CONTENT_BYTES:
+                raise BulkOperationError({'content': [
+                    f'You have reached your content quota limit of {UserUsage.MAX_CONTENT_BYTES / (1024 * 1024)} MB.'
+                ]})
+            quota['bytes'] += size_delta
+
+        # Creates
+        created = []
+        for index, item in parsed['create']:
+            try:
+                category = get_category(item)
+                missing_tags = [tag_id for tag_id in item['tags'] if tag_id not in tags]
+                if missing_tags:
+                    raise BulkOperationError({'tags': [f'Tags not found: {missing_tags}']})
+                try:
+                    note = prepare_note(
+                        user, item.get('title'), item.get('content'), category,
+                        is_pinned=parse_flag(item.get('is_pinned')),
+                        is_archived=parse_flag(item.get('is_archived')),
+                    )
+                    new_tag_names = validate_new_tag_names(item.get('new_tags'), len(item['tags']))
+                except ValidationError as e:
+                    raise BulkOperationError(_validation_errors(e))
+
+                if quota['notes'] >= UserUsage.MAX_NOTES:
+                    raise BulkOperationError({'non_field_errors': [
+                        f'You have reached the maximum number of notes allowed ({UserUsage.MAX_NOTES}).'
+                    ]})
+                check_content_quota(note.content_bytes)
+                quota['notes'] += 1
+            except BulkOperationError as e:
+                fail(index, 'create', e.errors)
+                continue
+            created.append((index, (note, [tags[tag_id] for tag_id in item['tags']], new_tag_names)))
+
+        if created:
+            insert_notes(user, [entry for index, entry in created])
+            for index, (note, note_tags, new_tag_names) in created:
+                succeed(index, 'create', note.pk)
+
+        # Updates
+        updated = []
+        revisions = []
+        update_fields = set()
+        content_delta = 0
+        now = timezone.now()
+        for index, item in parsed['update']:
+            note = get_note(index, 'update', item)
+            if note is None:
+                continue
+            try:
+                try:
+                    validate_text_fields(**{
+                        field: item[field] for field in ('title', 'content') if field in item
+                    })
+                except ValidationError as e:
+                    raise BulkOperationError(_validation_errors(e))
+                if 'category' in item:
+                    note.category = get_category(item)
+                for field in ('title', 'content'):
+                    if field in item:
+                        setattr(note, field, item[field])
+                for field in ('is_pinned', 'is_archived'):
+                    if field in item:
+                        setattr(note, field, bool(parse_flag(item[field])))
+                if note.is_archived and note.is_pinned:
+                    note.is_pinned = False
+
+                changed = note.get_changed_fields()
+                if not changed:
+                    succeed(index, 'update', note.pk)
+                    continue
+
+                if 'content' in changed:
+                    note.sanitize_content()
+                    note.update_content_metrics()
+                    changed |= set(Note.CONTENT_DERIVED_FIELDS)
+                try:
+                    note.clean_fields(exclude=[
+                        field.name for field in Note._meta.concrete_fields
+                        if field.name not in changed or field.name in ('user', 'category')
+                    ])
+                except ValidationError as e:
+                    raise BulkOperationError(_validation_errors(e))
+
+                size_delta = note.get_content_size_delta() if 'content' in changed else 0
+                check_content_quota(size_delta)
+            except BulkOperationError as e:
+                fail(index, 'update', e.errors)
+                continue
+
+            if changed & {'title', 'content'}:
+                revisions.append(note.build_revision())
+                changed.add('revision_count')
+            note.updated_at = now
+            content_delta += size_delta
+            update_fields |= changed | {'updated_at'}
+            updated.append((index, note))
+
+        if updated:
+            Note.objects.bulk_update([note for index, note in updated], update_fields, batch_size=BULK_BATCH_SIZE)
+            NoteRevision.objects.bulk_create(revisions, batch_size=BULK_BATCH_SIZE)
+            UserUsage.adjust(user.pk, content_bytes=content_delta)
+            for index, note in updated:
+                note._remember_values()
+                succeed(index, 'update', note.pk)
+
+        # Archive and pin: one UPDATE per requested value
+        for op, update_values in (('archive', archive_update_values), ('pin', pin_update_values)):
+            groups = defaultdict(list)
+            for index, item in parsed[op]:
+                if get_note(index, op, item) is not None:
+                    groups[parse_flag(item.get('value'))].append((index, item['id']))
+            for value, group in groups.items():
+                Note.objects.filter(pk__in=[note_id for index, note_id in group]).update(**update_values(value))
+                for index, note_id in group:
+                    succeed(index, op, note_id)
+
+        # Move: one UPDATE per target category
+        groups = defaultdict(list)
+        for index, item in parsed['move']:
+            if get_note(index, 'move', item) is None:
+                continue
+            try:
+                category = get_category(item)
+            except BulkOperationError as e:
+                fail(index, 'move', e.errors)
+                continue
+            groups[category.pk if category else None].append((index, item['id']))
+        for category_id, group in groups.items():
+            Note.objects.filter(pk__in=[note_id for index, note_id in group]).update(
+                category_id=category_id, updated_at=now
+            )
+            for index, note_id in group:
+                succeed(index, 'move', note_id)
+
+        # Delete: one DELETE for all notes (usage is released in one batched UPDATE)
+        deleted = [
+            (index, item['id']) for index, item in parsed['delete']
+            if get_note(index, 'delete', item) is not None
+        ]
+        if deleted:
+            Note.objects.filter(pk__in=[note_id for index, note_id in deleted]).delete()
+            for index, note_id in deleted:
+                succeed(index, 'delete', note_id)
+
+    return results
@@ -0,0 +1,51 @@
+"""
+Line-based deltas for Notes Manager application.
+A delta rebuilds a target text from a source text. It is a list of
+[start, end] ranges of source lines to copy and strings to insert as they are.
+"""
+import difflib
+
+
+# Delta that rebuilds the source text unchanged
+IDENTITY_DELTA = [[0, None]]
+
+
+def _split_lines(text):
+    return (text or '').splitlines(keepends=True)
+
+
+def make_delta(source, target):
+    """
+    Build the delta that turns source into target.
+
+    Only the lines that differ are stored, so a delta between two versions of
+    a long note with a small edit is a few ranges and the edited lines.
+    """
+    if source == target:
+        return list(IDENTITY_DELTA)
+
+    source_lines = _split_lines(source)
+    target_lines = _split_lines(target)
+    matcher = difflib.SequenceMatcher(None, source_lines, target_lines)
+
+    delta = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            delta.append([i1, i2])
+        elif j2 > j1:
+            # 'replace' and 'insert' carry the new lines, 'delete' copies nothing
+            delta.append(''.join(target_lines[j1:j2]))
+    return delta
+
+
+def apply_delta(source, delta):
+    """Rebuild the target text of a delta from its source text."""
+    source_lines = _split_lines(source)
+    parts = []
+    for op in delta:
+        if isinstance(op, str):
+            parts.append(op)
+        else:
+            start, end = op
+            parts.append(''.join(source_lines[start:end]))
+    return ''.join(parts)
@@ -0,0 +1,254 @@
+"""
+Draft autosave for Notes Manager application.
+Autosaved drafts are kept in the cache, one slot per user and note, and only
+written to the note when the user saves or after a quiet period. The cache
+must be shared by all processes (redis or database), outside of DEBUG.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.db import transaction
+
+from .bulk import validate_text_fields
+from .models import Note
+from .services import editable_notes
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds without a new autosave after which flush_drafts() persists a draft
+DRAFT_QUIET_PERIOD = 30
+
+# Seconds a draft is kept in the cache when it is never flushed
+DRAFT_TIMEOUT = 7 * 24 * 60 * 60
+
+# Largest draft accepted, in bytes of content
+MAX_DRAFT_BYTES = 2 * 1024 * 1024  # 2MB
+
+# Cache key of the index of drafts waiting for a flush
+PENDING_DRAFTS_KEY = 'note-drafts:pending'
+PENDING_DRAFTS_LOCK_KEY = 'note-drafts:pending:lock'
+
+
+def draft_key(user_id, note_id):
+    """Get the cache key of the draft of a note for a user."""
+    return f'note-draft:{user_id}:{note_id}'
+
+
+def require_shared_cache(always=False):
+    """
+    Raise ImproperlyConfigured if drafts would be kept in the memory of this process.
+
+    Other workers and the flush_note_drafts command would never see them. A
+    local memory cache is accepted with DEBUG (a single runserver process)
+    unless always is set.
+    """
+    if isinstance(caches['default'], LocMemCache) and (always or not settings.DEBUG):
+        raise ImproperlyConfigured(
+            'Note drafts need a cache shared by all processes, set CACHE_BACKEND=redis or CACHE_BACKEND=database.'
+        )
+
+
+def autosave_available():
+    """Tell whether drafts can be autosaved here, see require_shared_cache()."""
+    try:
+        require_shared_cache()
+    except ImproperlyConfigured:
+        return False
+    return True
+
+
+def _update_pending(add=(), remove=()):
+    """
+    Add or remove (user_id, note_id) pairs from the index of pending drafts.
+
+    The index is only changed when a draft slot is created or flushed, not on
+    every autosave. A short cache lock keeps concurrent updates from losing entries.
+    """
+    for attempt in range(50):
+        if cache.add(PENDING_DRAFTS_LOCK_KEY, 1, timeout=5):
+            break
+        time.sleep(0.01)
+    else:
+        logger.warning('Could not lock the pending drafts index, updating it without the lock')
+
+    try:
+        pending = set(map(tuple, cache.get(PENDING_DRAFTS_KEY, [])))
+        pending.update(add)
+        pending.difference_update(remove)
+        cache.set(PENDING_DRAFTS_KEY, sorted(pending), timeout=DRAFT_TIMEOUT)
+    finally:
+        cache.delete(PENDING_DRAFTS_LOCK_KEY)
+
+
+def save_draft(user, note_id, title=None, content=None):
+    """
+    Store the latest draft of a note in the user's cache slot.
+
+    Saving the same draft again is harmless. Edit permission is checked with a
+    database query only when the slot is created, so further autosaves are
+    cache-only.
+
+    Args:
+        user: User editing the note
+        note_id: ID of the note
+        title: Draft title (None keeps the previous draft title)
+        content: Draft content (None keeps the previous draft content)
+
+    Returns:
+        The stored draft dict
+
+    Raises:
+        Note.DoesNotExist: If the note does not exist or the user cannot edit it
+        ValidationError: If the draft is not text or too large
+        ImproperlyConfigured: If the cache is not shared by all processes
+    """
+    require_shared_cache()
+    validate_text_fields(title=title, content=content)
+    if content is not None and len(content.encode('utf-8')) > MAX_DRAFT_BYTES:
+        raise ValidationError({'content': f'Drafts cannot exceed {MAX_DRAFT_BYTES // (1024 * 1024)} MB.'})
+
+    key = draft_key(user.pk, note_id)
+    draft = cache.get(key)
+    created = draft is None
+    if created:
+        note = editable_notes(user).only('pk', 'title', 'revision_count').get(pk=note_id)
+        draft = {
+            'note_id': note.pk,
+            'title': note.title,
+            'content': None,
+            # The version of the title and content the draft started from, to
+            # detect conflicting saves (pinning or moving the note is no conflict)
+            'base_revision': note.revision_count,
+        }
+
+    if title is not None:
+        draft['title'] = title
+    if content is not None:
+        draft['content'] = content
+    draft['saved_at'] = time.time()
+    cache.set(key, draft, timeout=DRAFT_TIMEOUT)
+
+    if created:
+        _update_pending(add=[(user.pk, note_id)])
+    return draft
+
+
+def get_draft(user, note_id):
+    """Get the cached draft of a note for a user, or None."""
+    return cache.get(draft_key(user.pk, note_id))
+
+
+def discard_draft(user, note_id):
+    """Remove the draft of a note, e.g. after the note was saved explicitly."""
+    key = draft_key(user.pk, note_id)
+    if cache.get(key) is not None:
+        cache.delete(key)
+        _update_pending(remove=[(user.pk, note_id)])
+
+
+def _apply_draft(user, note_id, draft):
+    """
+    Save a draft to its note, raising ValidationError (code 'conflict') if the
+    title or content of the note was saved since the draft started.
+    """
+    with transaction.atomic():
+        note = editable_notes(user).select_for_update().get(pk=note_id)
+        if note.revision_count != draft.get('base_revision'):
+            raise ValidationError('The note was changed since this draft was started.', code='conflict')
+
+        note.title = draft['title']
+        if draft['content'] is not None:
+            note.content = draft['content']
+        note.save()
+    return note
+
+
+def persist_draft(user, note_id):
+    """
+    Write the draft of a note to the note and remove it from the cache.
+
+    The note is saved through Note.save, so it is sanitized, validated and
+    only written if the draft actually differs from it. A draft that started
+    from an older version of the note than the current one is not applied.
+
+    Returns:
+        The saved note, or None if there was no draft
+
+    Raises:
+        Note.DoesNotExist: If the note does not exist or the user cannot edit it
+        ValidationError: If the draft is invalid or the note changed since the draft started
+    """
+    draft = get_draft(user, note_id)
+    if draft is None:
+        return None
+
+    note = _apply_draft(user, note_id, draft)
+    discard_draft(user, note_id)
+    return note
+
+
+def flush_drafts(quiet_period=DRAFT_QUIET_PERIOD, now=None):
+    """
+    Persist every pending draft that has not been autosaved for quiet_period seconds.
+
+    Drafts that cannot be applied (invalid, conflicting, or no longer editable)
+    are dropped from the pending index but stay in the cache, so the user still
+    gets them back in the edit form until they expire.
+
+    Returns:
+        Tuple of (number of notes saved, number of drafts that could not be saved)
+
+    Raises:
+        ImproperlyConfigured: If the cache is local to this process, where no draft is ever seen
+    """
+    require_shared_cache(always=True)
+    now = time.time() if now is None else now
+    pending = [tuple(item) for item in cache.get(PENDING_DRAFTS_KEY, [])]
+    if not pending:
+        return 0, 0
+
+    drafts = cache.get_many([draft_key(user_id, note_id) for user_id, note_id in pending])
+    users = User.objects.in_bulk({user_id for user_id, note_id in pending})
+
+    saved = failed = 0
+    done = []
+    for user_id, note_id in pending:
+        key = draft_key(user_id, note_id)
+        draft = drafts.get(key)
+        if draft is not None and now - draft['saved_at'] < quiet_period:
+            # Still being edited
+            continue
+        if draft is None:
+            # Expired or discarded
+            done.append((user_id, note_id))
+            continue
+
+        try:
+            if user_id not in users:
+                raise Note.DoesNotExist
+            note = _apply_draft(users[user_id], note_id, draft)
+        except (Note.DoesNotExist, ValidationError) as e:
+            logger.info('Draft of note %s by user %s was not saved: %s', note_id, user_id, e)
+            failed += 1
+            done.append((user_id, note_id))
+            continue
+        saved += 1
+
+        current = cache.get(key)
+        if current is not None and current['saved_at'] != draft['saved_at']:
+            # Autosaved again while flushing: keep the newer draft, based on the saved note
+            current['base_revision'] = note.revision_count
+            cache.set(key, current, timeout=DRAFT_TIMEOUT)
+        else:
+            cache.delete(key)
+            done.append((user_id, note_id))
+
+    if done:
+        _update_pending(remove=done)
+    return saved, failed
@@ -1,14 +1,18 @@
 from django import forms
 from django.core.exceptions import ValidationError
 from django.contrib.auth.models import User
-from .models import Note, Category, Tag, NoteSharing, NoteAttachment
+from .models import Note, Category, Tag, NoteSharing, NoteAttachment, UserUsage
 from .validators import (
-    validate_note_title, validate_note_content,
+    validate_note_title, validate_note_content, ContentScan,
     validate_category_name, validate_tag_name,
     validate_user_quota, validate_file_upload,
     validate_image_file_extension, validate_document_file_extension
 )
+from django.db import transaction
 from django.db.models import Q
+from .services import (
+    parse_tag_names, resolve_tags, attach_tags, create_note, share_notes, apply_content_patch
+)
 
 
 class CategoryForm(forms.ModelForm):
@@ -148,8 +152,8 @@ class NoteForm(forms.ModelForm):
     content = forms.CharField(
         widget=forms.Textarea(
             attrs={'class': 'form-control', 'placeholder': 'Содержание заметки', 'rows': 8}
-        ),
-        validators=[validate_note_content]
+        )
+        # Validated in clean_content with a single scan that the note reuses
     )
     category = forms.ModelChoiceField(
         queryset=Category.objects.none(),
@@ -245,8 +249,8 @@ class NoteForm(forms.ModelForm):
         new_tags_text = self.cleaned_data.get('new_tags', '').strip()
         
         if new_tags_text:
-            # Split by comma and strip whitespace
-            tag_names = [t.strip() for t in new_tags_text.split(',') if t.strip()]
+            # Split by comma, strip whitespace and drop duplicates
+            tag_names = parse_tag_names(new_tags_text)
             
             # Validate each tag name
             for tag_name in tag_names:
@@ -271,6 +275,9 @@ class NoteForm(forms.ModelForm):
         """Validate content and check for potential issues."""
         content = self.cleaned_data.get('content')
         
+        self._content_scan = ContentScan(content)
+        validate_note_content(content, scan=self._content_scan)
+        
         if content:
             # Check content size
             content_size = len(content.encode('utf-8'))
@@ -293,8 +300,8 @@ class NoteForm(forms.ModelForm):
         # Check if user has reached the maximum number of notes
         if not self.instance.pk and self.user:  # Only for new notes
             try:
-                MAX_NOTES = 1000  # Maximum number of notes per user
-                validate_user_quota(self.user, Note, MAX_NOTES)
+                usage = UserUsage.for_user(self.user)
+                validate_user_quota(self.user, Note, UserUsage.MAX_NOTES, current_count=usage.note_count)
             except ValidationError as e:
                 raise ValidationError(e)
         
@@ -314,46 +321,52 @@ class NoteForm(forms.ModelForm):
         if is_archived and is_pinned:
             self.add_warning('is_pinned', 'A note cannot be both archived and pinned. The pin setting will be ignored for archived notes.')
         
+        # The title and content passed the form field checks, the note does not validate them again
+        validated = [name for name in ('title', 'content') if name in cleaned_data]
+        for name in validated:
+            setattr(self.instance, name, cleaned_data[name])
+        self.instance.mark_validated(*validated, content_scan=getattr(self, '_content_scan', None))
+        
         return cleaned_data
     
     def save(self, commit=True):
         """Save the note and process any new tags."""
-        note = super().save(commit=False)
+        # New notes go through the shared creation service
+        if commit and not self.instance.pk and self.user:
+            self.instance = create_note(
+                self.user,
+                title=self.cleaned_data['title'],
+                content=self.cleaned_data['content'],
+                category=self.cleaned_data.get('category'),
+                tags=self.cleaned_data.get('tags') or [],
+                new_tag_names=getattr(self, '_new_tag_names', []),
+                is_pinned=self.cleaned_data.get('is_pinned', False),
+                is_archived=self.cleaned_data.get('is_archived', False),
+                validate_tags=False,  # Validated in clean_new_tags
+                validated_fields=('title', 'content'),
+                content_scan=getattr(self, '_content_scan', None),
+            )
+            return self.instance
         
-        # Debug print
-        print(f"User in form: {self.user}")
-        print(f"Note user before assignment: {getattr(note, 'user', None)}")
+        note = super().save(commit=False)
         
         if self.user:
             note.user = self.user
-            print(f"Note user after assignment: {note.user}")
         
         # Logic for handling the case when a note is both archived and pinned
         if note.is_archived and note.is_pinned:
             note.is_pinned = False
         
         if commit:
-            try:
+            with transaction.atomic():
                 note.save()
-                print(f"Note saved successfully with ID: {note.pk}")
                 
                 # Process existing tags
                 self.save_m2m()
                 
-                # Process new tags
+                # Process new tags (names were validated in clean_new_tags)
                 new_tag_names = getattr(self, '_new_tag_names', [])
-                
-                for tag_name in new_tag_names:
-                    # Check if tag already exists for this user
-                    tag, created = Tag.objects.get_or_create(
-                        name=tag_name,
-                        user=self.user
-                    )
-                    # Add tag to note
-                    note.tags.add(tag)
-            except Exception as e:
-                print(f"Error saving note: {str(e)}")
-                raise e
+                attach_tags(note, resolve_tags(self.user, new_tag_names, validate=False))
         
         return note
 
@@ -457,10 +470,11 @@ class NoteSharingForm(forms.ModelForm):
         # Check maximum number of shared users per note
         if self.note and not self.instance.pk:  # Only for new sharing
             current_shared_count = NoteSharing.objects.filter(note=self.note).count()
-            MAX_SHARED_USERS = 20  # Maximum number of users to share a note with
             
-            if current_shared_count >= MAX_SHARED_USERS:
-                raise ValidationError(f'You cannot share this note with more than {MAX_SHARED_USERS} users.')
+            if current_shared_count >= NoteSharing.MAX_SHARED_USERS:
+                raise ValidationError(
+                    f'You cannot share this note with more than {NoteSharing.MAX_SHARED_USERS} users.'
+                )
         
         return cleaned_data
     
@@ -477,6 +491,90 @@ class NoteSharingForm(forms.ModelForm):
         return sharing
 
 
+class BulkNoteSharingForm(forms.Form):
+    """Form for sharing several notes with several users at once."""
+    notes = forms.ModelMultipleChoiceField(
+        queryset=Note.objects.none(),
+        widget=forms.SelectMultiple(attrs={'class': 'form-select', 'size': 10}),
+        help_text='Select the notes to share'
+    )
+    users = forms.ModelMultipleChoiceField(
+        queryset=User.objects.none(),
+        widget=forms.SelectMultiple(attrs={'class': 'form-select', 'size': 10}),
+        help_text='Select the users to share the notes with'
+    )
+    permission = forms.ChoiceField(
+        choices=NoteSharing.PERMISSION_CHOICES,
+        widget=forms.Select(attrs={'class': 'form-select'}),
+        initial='read',
+        help_text='Select permission level for these users'
+    )
+    
+    def __init__(self, *args, **kwargs):
+        """Initialize the form."""
+        self.user = kwargs.pop('user', None)
+        super().__init__(*args, **kwargs)
+        
+        if self.user:
+            # Only the user's own notes can be shared, with anyone but the user
+            self.fields['notes'].queryset = Note.objects.filter(user=self.user).only('pk', 'title')
+            self.fields['users'].queryset = User.objects.exclude(id=self.user.id).only('pk', 'username')
+    
+    def save(self):
+        """
+        Share the selected notes with the selected users.
+        
+        Returns:
+            Number of new shares
+        
+        Raises:
+            ValidationError: If a note would exceed the shared users limit
+        """
+        return share_notes(
+            self.user,
+            [note.pk for note in self.cleaned_data['notes']],
+            [user.pk for user in self.cleaned_data['users']],
+            self.cleaned_data['permission'],
+        )
+
+
+class NoteContentPatchForm(forms.Form):
+    """Form for updating the content of a note with a list of changes."""
+    base = forms.DateTimeField(
+        widget=forms.HiddenInput(),
+        help_text='updated_at of the edited version of the note'
+    )
+    changes = forms.JSONField(
+        widget=forms.HiddenInput(),
+        help_text='List of {"start", "end", "text"} changes to the content'
+    )
+    offsets = forms.ChoiceField(
+        choices=[('code_points', 'Characters'), ('utf-16', 'UTF-16 code units (JavaScript)')],
+        required=False,
+        widget=forms.HiddenInput(),
+        help_text='Unit of the change offsets, characters by default'
+    )
+    
+    def __init__(self, *args, **kwargs):
+        """Initialize the form."""
+        self.note_id = kwargs.pop('note_id', None)
+        self.user = kwargs.pop('user', None)
+        super().__init__(*args, **kwargs)
+    
+    def save(self):
+        """
+        Apply the changes to the note.
+        
+        Raises:
+            Note.DoesNotExist: If the note does not exist or the user cannot edit it
+            ValidationError: If the note changed since the base version or the changes are invalid
+        """
+        return apply_content_patch(
+            self.user, self.note_id, self.cleaned_data['base'], self.cleaned_data['changes'],
+            offsets=self.cleaned_data['offsets'],
+        )
+
+
 class NoteSearchForm(forms.Form):
     """Form for searching notes."""
     query = forms.CharField(
@@ -610,23 +708,22 @@ class NoteSearchForm(forms.Form):
                 if search_in == 'title':
                     queryset = queryset.filter(title__icontains=query)
                 elif search_in == 'content':
-                    queryset = queryset.filter(content__icontains=query)
+                    queryset = queryset.filter(Note.content_search(query, queryset))
                 else:  # both
                     queryset = queryset.filter(
-                        Q(title__icontains=query) | Q(content__icontains=query)
+                        Q(title__icontains=query) | Note.content_search(query, queryset)
                     )
             else:
                 # Word-by-word matching
                 terms = query.split()
                 q_objects = Q()
                 
-                for term in terms:
-                    if search_in == 'title':
+                if search_in != 'content':
+                    for term in terms:
                         q_objects |= Q(title__icontains=term)
-                    elif search_in == 'content':
-                        q_objects |= Q(content__icontains=term)
-                    else:  # both
-                        q_objects |= Q(title__icontains=term) | Q(content__icontains=term)
+                if search_in != 'title':
+                    # Compressed notes are decompressed once for all terms
+                    q_objects |= Note.content_search(terms, queryset)
                 
                 queryset = queryset.filter(q_objects)
         
@@ -0,0 +1,525 @@
+"""
+Note importers for Notes Manager application.
+This module streams notes out of JSON arrays, zip archives of Markdown files
+and Evernote ENEX exports and inserts them in batches for one user.
+Files uploaded through the API are stored and imported later by
+`manage.py import_notes --pending`, outside the request.
+"""
+import codecs
+import html
+import json
+import logging
+import os
+import re
+import uuid
+import zipfile
+import xml.etree.ElementTree as ET
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.html import strip_tags
+
+from .models import NoteImport, UserUsage
+from .services import parse_flag, resolve_categories
+from .bulk import prepare_note, insert_notes, validate_new_tag_names
+from .validators import validate_category_name
+
+
+logger = logging.getLogger(__name__)
+
+# Number of notes validated and inserted per transaction
+IMPORT_BATCH_SIZE = 200
+
+# Largest single note accepted from an import file (bytes of source text)
+MAX_IMPORT_NOTE_BYTES = 1024 * 1024  # 1MB
+
+# Size of the chunks read from JSON files
+JSON_CHUNK_SIZE = 64 * 1024
+
+# Largest uploaded import file
+MAX_IMPORT_FILE_SIZE = 500 * 1024 * 1024  # 500MB
+
+# Seconds a running import may go without progress before it is marked failed
+IMPORT_STALE_AFTER = 600
+
+MARKDOWN_EXTENSIONS = ('.md', '.markdown', '.txt')
+
+# File extensions used to guess the format of an upload
+FORMAT_EXTENSIONS = {
+    '.json': 'json',
+    '.zip': 'markdown',
+    '.enex': 'enex',
+}
+
+
+class ImportFormatError(Exception):
+    """Raised when an import file cannot be parsed at all."""
+
+
+class SkippedNote:
+    """A note found in an import file that cannot be imported, with the reason."""
+
+    def __init__(self, title, errors):
+        self.title = title
+        self.errors = errors
+
+
+def _read_text(reader, size):
+    """Read decoded text from a codecs reader, reporting invalid UTF-8 as a format error."""
+    try:
+        return reader.read(size)
+    except UnicodeDecodeError:
+        raise ImportFormatError('The file is not valid UTF-8 text.')
+
+
+def iter_json_notes(fileobj, chunk_size=JSON_CHUNK_SIZE):
+    """
+    Yield note dicts from a JSON array without loading the whole file.
+
+    Each element should be an object with 'title', 'content' and optional
+    'category' (name) and 'tags' (list of names or comma separated string).
+    The array is decoded one element at a time from a small text buffer.
+    """
+    reader = codecs.getreader('utf-8-sig')(fileobj)
+    decoder = json.JSONDecoder()
+    buffer = ''
+    eof = False
+    expect = 'start'
+
+    while True:
+        buffer = buffer.lstrip()
+        if not buffer:
+            if eof:
+                raise ImportFormatError('Unexpected end of the JSON file.')
+            buffer = _read_text(reader, chunk_size)
+            eof = not buffer
+            continue
+
+        if expect == 'start':
+            if buffer[0] != '[':
+                raise ImportFormatError('The JSON file must contain an array of notes.')
+            buffer = buffer[1:]
+            expect = 'first'
+            continue
+
+        if buffer[0] == ']' and expect in ('first', 'separator'):
+            return
+
+        if expect == 'separator':
+            if buffer[0] != ',':
+                raise ImportFormatError('Invalid JSON: expected "," between notes.')
+            buffer = buffer[1:]
+            expect = 'item'
+            continue
+
+        # Decode one element, reading more of the file while the element is incomplete
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError as e:
+            if eof:
+                raise ImportFormatError(f'Invalid JSON: {e.msg}.')
+            if len(buffer) > MAX_IMPORT_NOTE_BYTES * 2:
+                raise ImportFormatError('A note in the JSON file is too large.')
+            chunk = _read_text(reader, chunk_size)
+            eof = not chunk
+            buffer += chunk
+            continue
+
+        buffer = buffer[end:]
+        expect = 'separator'
+        if not isinstance(item, dict):
+            yield SkippedNote('', {'non_field_errors': ['Each note must be a JSON object.']})
+            continue
+        yield {
+            'title': item.get('title'),
+            'content': item.get('content'),
+            'category': item.get('category'),
+            'tags': item.get('tags') or [],
+            'is_pinned': item.get('is_pinned', False),
+            'is_archived': item.get('is_archived', False),
+        }
+
+
+FRONT_MATTER_RE = re.compile(r'\A---\s*\n(.*?)\n---\s*\n', re.DOTALL)
+HEADING_RE = re.compile(r'\A\s*#\s+(.+?)\s*#*\s*(?:\n|\Z)')
+
+
+def parse_markdown_note(path, text):
+    """
+    Build a note dict from a Markdown file.
+
+    The title comes from a 'title:' front matter key, the first '# ' heading or
+    the file name, the category from a 'category:' key or the parent directory,
+    and tags from a 'tags:' key.
+    """
+    meta = {}
+    match = FRONT_MATTER_RE.match(text)
+    if match:
+        for line in match.group(1).splitlines():
+            key, sep, value = line.partition(':')
+            if sep:
+                meta[key.strip().lower()] = value.strip().strip('"\'')
+        text = text[match.end():]
+
+    title = meta.get('title')
+    if not title:
+        heading = HEADING_RE.match(text)
+        if heading:
+            title = heading.group(1)
+            text = text[heading.end():]
+        else:
+            title = os.path.splitext(os.path.basename(path))[0]
+
+    directory = os.path.basename(os.path.dirname(path))
+    tags = meta.get('tags', '').strip('[]')
+    return {
+        'title': title.strip(),
+        'content': text.strip(),
+        'category': meta.get('category') or directory or None,
+        'tags': [tag.strip().strip('"\'') for tag in tags.split(',')],
+    }
+
+
+def iter_markdown_notes(fileobj):
+    """
+    Yield note dicts from a zip archive of Markdown files.
+
+    Members are decompressed one at a time and never beyond MAX_IMPORT_NOTE_BYTES.
+    """
+    try:
+        archive = zipfile.ZipFile(fileobj)
+    except zipfile.BadZipFile:
+        raise ImportFormatError('The file is not a valid zip archive.')
+
+    with archive:
+        for info in archive.infolist():
+            path = info.filename
+            name = os.path.basename(path)
+            if info.is_dir() or name.startswith('.') or path.startswith('__MACOSX/'):
+                continue
+            if not name.lower().endswith(MARKDOWN_EXTENSIONS):
+                continue
+
+            if info.file_size > MAX_IMPORT_NOTE_BYTES:
+                yield SkippedNote(name, {'content': ['The file is too large to import.']})
+                continue
+            with archive.open(info) as member:
+                # Do not trust the size in the archive header
+                data = member.read(MAX_IMPORT_NOTE_BYTES + 1)
+            if len(data) > MAX_IMPORT_NOTE_BYTES:
+                yield SkippedNote(name, {'content': ['The file is too large to import.']})
+                continue
+
+            yield parse_markdown_note(path, data.decode('utf-8-sig', errors='replace'))
+
+
+ENML_BREAK_RE = re.compile(r'<br\s*/?>|</(?:div|p|li|h[1-6]|tr|blockquote)>', re.IGNORECASE)
+
+
+def enml_to_text(enml):
+    """Convert the ENML (XHTML) body of an Evernote note to plain text."""
+    text = ENML_BREAK_RE.sub('\n', enml)
+    text = html.unescape(strip_tags(text))
+    return re.sub(r'\n{3,}', '\n\n', text).strip()
+
+
+def iter_enex_notes(fileobj):
+    """
+    Yield note dicts from an Evernote ENEX export.
+
+    The XML is read with iterparse and every processed note (including its
+    base64 resources) is cleared from the tree, so memory use does not grow
+    with the size of the export.
+    """
+    root = None
+    try:
+        for event, elem in ET.iterparse(fileobj, events=('start', 'end')):
+            if root is None:
+                root = elem
+                if root.tag != 'en-export':
+                    raise ImportFormatError('The file is not an Evernote export.')
+                continue
+            if event != 'end':
+                continue
+
+            if elem.tag == 'resource':
+                # Attachments are not imported, drop their data right away
+                elem.clear()
+            elif elem.tag == 'note':
+                yield {
+                    'title': (elem.findtext('title') or '').strip(),
+                    'content': enml_to_text(elem.findtext('content') or ''),
+                    'category': None,
+                    'tags': [tag.text.strip() for tag in elem.findall('tag') if tag.text],
+                }
+                root.clear()
+    except ET.ParseError as e:
+        raise ImportFormatError(f'Invalid ENEX file: {e}.')
+
+
+PARSERS = {
+    'json': iter_json_notes,
+    'markdown': iter_markdown_notes,
+    'enex': iter_enex_notes,
+}
+
+
+def guess_format(file_name):
+    """Guess the import format from a file name, or return None."""
+    return FORMAT_EXTENSIONS.get(os.path.splitext(file_name or '')[1].lower())
+
+
+def _errors_of(error):
+    """Convert a Django ValidationError into a field -> messages dict."""
+    if hasattr(error, 'error_dict'):
+        return error.message_dict
+    return {'non_field_errors': error.messages}
+
+
+class NoteImporter:
+    """
+    Import the notes of one file for a user.
+
+    Notes are parsed as a stream, validated one by one with the model
+    validators and inserted in batches of IMPORT_BATCH_SIZE. Each batch is its
+    own transaction that also updates the NoteImport record, so the progress
+    can be queried while the import runs.
+    """
+
+    def __init__(self, note_import, batch_size=IMPORT_BATCH_SIZE):
+        self.note_import = note_import
+        self.user = note_import.user
+        self.batch_size = batch_size
+
+    def run(self, fileobj):
+        """
+        Import all notes of a file.
+
+        Returns:
+            The updated NoteImport record
+        """
+        note_import = self.note_import
+        parser = PARSERS[note_import.source_format]
+        note_import.status = 'running'
+        note_import.save(update_fields=['status', 'updated_at'])
+
+        batch = []
+        try:
+            for position, item in enumerate(parser(fileobj), 1):
+                batch.append((position, item))
+                if len(batch) >= self.batch_size:
+                    self.flush(batch, fileobj)
+                    batch = []
+            self.flush(batch, fileobj)
+        except ImportFormatError as e:
+            note_import.status = 'failed'
+            note_import.message = str(e)
+        except Exception as e:
+            # Never leave the record running, the batches already inserted are kept
+            logger.exception("Import %s of user %s failed", note_import.pk, self.user.pk)
+            note_import.status = 'failed'
+            note_import.message = f'The import stopped unexpectedly: {e}'
+        else:
+            note_import.status = 'completed'
+            note_import.bytes_read = note_import.bytes_total
+
+        note_import.finished_at = timezone.now()
+        note_import.save()
+        return note_import
+
+    def prepare(self, item):
+        """Validate one parsed note, returning (note, new tag names, category name)."""
+        category_name = item.get('category')
+        if category_name is not None and not isinstance(category_name, str):
+            raise ValidationError({'category': ['The category must be a name.']})
+        category_name = (category_name or '').strip() or None
+        if category_name:
+            try:
+                validate_category_name(category_name)
+            except ValidationError as e:
+                raise ValidationError({'category': e.messages})
+        note = prepare_note(
+            self.user, item.get('title'), item.get('content'),
+            # Exports may write flags as strings like "false" or "0"
+            is_pinned=parse_flag(item.get('is_pinned')), is_archived=parse_flag(item.get('is_archived')),
+        )
+        new_tag_names = validate_new_tag_names(item.get('tags'))
+        return note, new_tag_names, category_name
+
+    def flush(self, batch, fileobj):
+        """Validate and insert one batch of parsed notes and record the progress."""
+        note_import = self.note_import
+        prepared = []
+        for position, item in batch:
+            if isinstance(item, SkippedNote):
+                note_import.add_error(position, item.title, item.errors)
+                continue
+            try:
+                prepared.append((position, self.prepare(item)))
+            except ValidationError as e:
+                title = item.get('title')
+                note_import.add_error(position, title if isinstance(title, str) else '', _errors_of(e))
+
+        with transaction.atomic():
+            if prepared:
+                usage = UserUsage.for_user(self.user, lock=True)
+                note_count, content_bytes = usage.note_count, usage.content_bytes
+                accepted = []
+                for position, (note, new_tag_names, category_name) in prepared:
+                    if note_count >= UserUsage.MAX_NOTES:
+                        note_import.add_error(position, note.title, {'non_field_errors': [
+                            f'You have reached the maximum number of notes allowed ({UserUsage.MAX_NOTES}).'
+                        ]})
+                    elif content_bytes + note.content_bytes > UserUsage.MAX_CONTENT_BYTES:
+                        note_import.add_error(position, note.title, {'content': [
+                            'You have reached your content quota limit.'
+                        ]})
+                    else:
+                        note_count += 1
+                        content_bytes += note.content_bytes
+                        accepted.append((note, new_tag_names, category_name))
+
+                # Categories of the whole batch are created with one INSERT
+                categories = resolve_categories(
+                    self.user, [name for note, tags, name in accepted if name], validate=False
+                )
+                for note, new_tag_names, category_name in accepted:
+                    if category_name:
+                        note.category = categories.get(category_name.lower())
+                insert_notes(self.user, [(note, (), new_tag_names) for note, new_tag_names, name in accepted])
+                note_import.imported_count += len(accepted)
+
+            try:
+                note_import.bytes_read = min(fileobj.tell(), note_import.bytes_total)
+            except (AttributeError, OSError):
+                pass
+            note_import.save(update_fields=[
+                'bytes_read', 'imported_count', 'failed_count', 'errors', 'updated_at'
+            ])
+
+
+def import_notes(user, fileobj, source_format, file_name='', batch_size=IMPORT_BATCH_SIZE):
+    """
+    Import notes for a user from a file object.
+
+    Args:
+        user: Owner of the imported notes
+        fileobj: Binary file object positioned at the start of the file
+        source_format: One of 'json', 'markdown' or 'enex'
+        file_name: Original name of the file, kept on the record
+        batch_size: Number of notes inserted per transaction
+
+    Returns:
+        The NoteImport record of the finished (or failed) import
+    """
+    if source_format not in PARSERS:
+        raise ValueError(f'Unknown import format: {source_format}')
+
+    try:
+        size = fileobj.seek(0, os.SEEK_END)
+        fileobj.seek(0)
+    except (AttributeError, OSError):
+        size = 0
+
+    note_import = NoteImport.objects.create(
+        user=user,
+        source_format=source_format,
+        file_name=os.path.basename(file_name)[:255],
+        bytes_total=size or 0,
+    )
+    return NoteImporter(note_import, batch_size=batch_size).run(fileobj)
+
+
+def store_upload(user, upload, source_format):
+    """
+    Store an uploaded file and create its pending import, which
+    run_pending_imports() picks up.
+
+    Returns:
+        The pending NoteImport record
+    """
+    directory = getattr(settings, 'IMPORT_UPLOAD_DIR', None) or os.path.join(settings.BASE_DIR, 'imports')
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{uuid.uuid4().hex}.upload')
+    with open(path, 'wb') as file:
+        for chunk in upload.chunks():
+            file.write(chunk)
+
+    try:
+        return NoteImport.objects.create(
+            user=user,
+            source_format=source_format,
+            file_name=os.path.basename(upload.name or '')[:255],
+            bytes_total=upload.size or 0,
+            upload_path=path,
+        )
+    except Exception:
+        os.remove(path)
+        raise
+
+
+def _discard_upload(note_import):
+    """Remove the stored file of an import that will not be read again."""
+    if not note_import.upload_path:
+        return
+    try:
+        os.remove(note_import.upload_path)
+    except FileNotFoundError:
+        pass
+    NoteImport.objects.filter(pk=note_import.pk).update(upload_path='')
+    note_import.upload_path = ''
+
+
+def fail_stale_imports(stale_after=None):
+    """
+    Mark running imports without progress for stale_after seconds as failed,
+    the process importing them was killed or restarted.
+
+    Returns:
+        Number of imports marked failed
+    """
+    if stale_after is None:
+        stale_after = getattr(settings, 'IMPORT_STALE_AFTER', IMPORT_STALE_AFTER)
+    now = timezone.now()
+    stale = list(NoteImport.objects.filter(status='running', updated_at__lt=now - timedelta(seconds=stale_after)))
+    for note_import in stale:
+        # Only if it still has not moved since it was read
+        NoteImport.objects.filter(pk=note_import.pk, updated_at=note_import.updated_at).update(
+            status='failed',
+            message='The import stopped making progress, the notes imported so far are kept.',
+            finished_at=now,
+            updated_at=now,
+        )
+        _discard_upload(note_import)
+    return len(stale)
+
+
+def run_pending_imports(batch_size=IMPORT_BATCH_SIZE):
+    """
+    Import the stored uploads waiting to be imported, oldest first. Several
+    processes may run this at once, each import is claimed by one of them.
+
+    Returns:
+        The NoteImport records imported by this call
+    """
+    fail_stale_imports()
+    pending = NoteImport.objects.filter(status='pending').exclude(upload_path='').order_by('created_at')
+    finished = []
+    for pk in list(pending.values_list('pk', flat=True)):
+        if not NoteImport.objects.filter(pk=pk, status='pending').update(status='running', updated_at=timezone.now()):
+            continue
+        note_import = NoteImport.objects.select_related('user').get(pk=pk)
+        try:
+            with open(note_import.upload_path, 'rb') as fileobj:
+                NoteImporter(note_import, batch_size=batch_size).run(fileobj)
+        except OSError as e:
+            note_import.status = 'failed'
+            note_import.message = f'The uploaded file could not be read: {e}'
+            note_import.finished_at = timezone.now()
+            note_import.save()
+        _discard_upload(note_import)
+        finished.append(note_import)
+    return finished
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.notes.models import Note, UserUsage
+
+
+class Command(BaseCommand):
+    """Fill in the precomputed excerpt, content size and word count of notes."""
+    help = 'Backfill the excerpt, content_bytes and word_count columns of existing notes in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of notes loaded and updated per batch (default: 500)'
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Recompute every note instead of only notes without metrics'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        queryset = Note.objects.only('pk', 'user_id', 'content', 'content_compressed', 'is_compressed').order_by('pk')
+        if not options['all']:
+            queryset = queryset.filter(content_bytes=0)
+
+        updated = 0
+        last_pk = 0
+        while True:
+            # Keyset pagination keeps each batch query cheap on large tables
+            batch = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+
+            for note in batch:
+                note.update_content_metrics()
+
+            with transaction.atomic():
+                Note.objects.bulk_update(batch, ['content', *Note.CONTENT_DERIVED_FIELDS])
+                # Usage ledgers are rebuilt from the new sizes the next time they are needed
+                UserUsage.objects.filter(user_id__in={note.user_id for note in batch}).delete()
+
+            updated += len(batch)
+            last_pk = batch[-1].pk
+            self.stdout.write(f'Updated {updated} notes...')
+
+        self.stdout.write(self.style.SUCCESS(f'Backfilled content metrics for {updated} notes.'))
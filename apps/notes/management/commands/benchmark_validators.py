@@ -0,0 +1,181 @@
+import gc
+import time
+from urllib.parse import urlencode
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+
+from apps.accounts.middleware import RequestValidationMiddleware
+from apps.accounts.validators import validate_password_strength
+from apps.notes.validators import validate_note_content
+
+
+MB = 1024 * 1024
+
+TYPICAL_NOTE = (
+    'Meeting notes: discussed the release plan for the next sprint. '
+    'Action items are in https://example.com/board, follow up with the team on Friday.\n'
+) * 8
+
+
+def _note_inputs():
+    return [
+        ('typical note', TYPICAL_NOTE),
+        ('1MB note', (TYPICAL_NOTE * (MB // len(TYPICAL_NOTE) + 1))[:MB]),
+        # Prefixes of the word lists that never complete a word
+        ('1MB near-miss words', ('explici spa scamm offensiv obscen ' * (MB // 34 + 1))[:MB]),
+        ('1MB of URLs', ('http://a.example.com/%41 ' * (MB // 25 + 1))[:MB]),
+        ('1MB uppercase', ('SHOUTING ' * (MB // 9 + 1))[:MB]),
+    ]
+
+
+def _post(path, data):
+    factory = RequestFactory()
+    body = urlencode(data)
+    # A fresh request per run, so POST parsing is part of the measured cost
+    return lambda: factory.post(path, body, content_type='application/x-www-form-urlencoded')
+
+
+def _request_inputs():
+    return [
+        ('typical GET', lambda: RequestFactory().get('/notes/', {'q': 'release plan', 'page': '2'})),
+        ('typical POST', _post('/notes/create/', {'title': 'Release plan', 'content': TYPICAL_NOTE})),
+        ('1MB POST', _post('/notes/create/', {'title': 'Large note', 'content': (TYPICAL_NOTE * 700)[:MB]})),
+        ('many fields POST', _post('/notes/bulk/', {f'field{i}': 'value %d' % i for i in range(1000)})),
+        # Each SELECT makes 'SELECT.*FROM' scan the rest of the line for FROM
+        ('backtracking POST', _post('/notes/create/', {'content': 'select ' * 2400})),
+        ('backtracking field POST', _post('/categories/create/', {'name': 'select ' * (MB // 7)})),
+        ('backtracking query', lambda: RequestFactory().get('/notes/', {'q': 'delete ' * 1000})),
+    ]
+
+
+def _password_inputs():
+    return [
+        ('typical password', 'Str0ng!Passw0rd#'),
+        ('weak password', 'password'),
+        ('1MB password', 'Aa1!' + 'xy' * (MB // 2)),
+        ('1MB repeated chars', 'Aa1!' + 'x' * MB),
+    ]
+
+
+class Command(BaseCommand):
+    """Time validators and request checks on typical and adversarial inputs."""
+    help = (
+        'Benchmark note content, request and password validation. '
+        'Fails when the worst-case latency of a case exceeds its limit.'
+    )
+
+    # Worst-case latency allowed per case, in milliseconds
+    LIMITS = {
+        'typical note': 10,
+        '1MB note': 250,
+        '1MB near-miss words': 250,
+        '1MB of URLs': 250,
+        '1MB uppercase': 250,
+        'typical GET': 10,
+        'typical POST': 10,
+        '1MB POST': 250,
+        'many fields POST': 50,
+        'backtracking POST': 50,
+        'backtracking field POST': 50,
+        'backtracking query': 50,
+        'typical password': 50,
+        'weak password': 50,
+        '1MB password': 250,
+        '1MB repeated chars': 250,
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--case',
+            action='append',
+            default=[],
+            help='Only run the cases whose name contains this text (can be repeated)'
+        )
+        parser.add_argument(
+            '--runs',
+            type=int,
+            default=5,
+            help='Minimum number of runs per case (default: 5)'
+        )
+        parser.add_argument(
+            '--duration',
+            type=float,
+            default=0.5,
+            help='Keep running a case until this many seconds have passed (default: 0.5)'
+        )
+        parser.add_argument(
+            '--limit-scale',
+            type=float,
+            default=1.0,
+            help='Multiply all latency limits, e.g. 2 on a slow machine (default: 1)'
+        )
+
+    def handle(self, *args, **options):
+        middleware = RequestValidationMiddleware(lambda request: None)
+
+        cases = [
+            (f'validate_note_content: {name}', name, validate_note_content, lambda value=value: value)
+            for name, value in _note_inputs()
+        ] + [
+            (f'_is_suspicious_request: {name}', name, middleware._is_suspicious_request, make_request)
+            for name, make_request in _request_inputs()
+        ] + [
+            (f'validate_password_strength: {name}', name, validate_password_strength, lambda value=value: value)
+            for name, value in _password_inputs()
+        ]
+        if options['case']:
+            cases = [case for case in cases if any(text in case[0] for text in options['case'])]
+        if not cases:
+            raise CommandError('No benchmark case matches --case.')
+
+        self.stdout.write(f'{"Case":<52} {"Runs":>6} {"Ops/sec":>10} {"Mean ms":>9} {"Worst ms":>9} {"Limit":>7}')
+        failed = []
+        for label, name, func, make_arg in cases:
+            limit = self.LIMITS[name] * options['limit_scale']
+            timings = self.run_case(func, make_arg, options['runs'], options['duration'])
+
+            mean = sum(timings) / len(timings)
+            worst = max(timings)
+            line = (
+                f'{label:<52} {len(timings):>6} {1 / mean:>10.1f} '
+                f'{mean * 1000:>9.2f} {worst * 1000:>9.2f} {limit:>7g}'
+            )
+            if worst * 1000 > limit:
+                failed.append(label)
+                self.stdout.write(self.style.ERROR(line + '  FAIL'))
+            else:
+                self.stdout.write(line)
+
+        if failed:
+            raise CommandError(f'{len(failed)} case(s) exceeded their latency limit: ' + ', '.join(failed))
+        self.stdout.write(self.style.SUCCESS(f'All {len(cases)} cases within their latency limits.'))
+
+    def run_case(self, func, make_arg, runs, duration):
+        """Time func on fresh arguments until both runs and duration are reached."""
+        # One untimed run loads lazy state, e.g. the common password list and the word lists
+        self.call(func, make_arg())
+
+        timings = []
+        # Like timeit, keep garbage collection pauses out of the timings
+        gc.collect()
+        gc.disable()
+        try:
+            deadline = time.perf_counter() + duration
+            while len(timings) < runs or time.perf_counter() < deadline:
+                arg = make_arg()
+                started = time.perf_counter()
+                self.call(func, arg)
+                timings.append(time.perf_counter() - started)
+        finally:
+            gc.enable()
+        return timings
+
+    @staticmethod
+    def call(func, arg):
+        try:
+            func(arg)
+        except ValidationError:
+            # Rejecting the input is a valid outcome, its cost is what is measured
+            pass
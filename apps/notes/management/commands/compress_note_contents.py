@@ -0,0 +1,101 @@
+import time
+import zlib
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from apps.notes.models import Note
+
+
+class Command(BaseCommand):
+    """Move the content of large notes to the compressed content column."""
+    help = 'Compress the content of existing notes above the size threshold, or benchmark the compressed storage.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=200,
+            help='Number of notes loaded and updated per batch (default: 200)'
+        )
+        parser.add_argument(
+            '--benchmark',
+            action='store_true',
+            help='Only report the storage saved and the decompression cost of compressed notes'
+        )
+        parser.add_argument(
+            '--sample',
+            type=int,
+            default=1000,
+            help='Number of compressed notes decompressed by --benchmark (default: 1000)'
+        )
+
+    def handle(self, *args, **options):
+        if options['benchmark']:
+            self.benchmark(options['sample'])
+            return
+
+        batch_size = options['batch_size']
+        # Uncompressed notes that should be compressed, and compressed notes
+        # that no longer should be (e.g. after the threshold was raised)
+        queryset = Note.objects.filter(
+            Q(is_compressed=False, content_bytes__gte=Note.COMPRESS_THRESHOLD)
+            | Q(is_compressed=True, content_bytes__lt=Note.COMPRESS_THRESHOLD)
+        ).only('pk', 'content', 'content_compressed', 'is_compressed').order_by('pk')
+
+        checked = compressed = raw_bytes = stored_bytes = 0
+        last_pk = 0
+        while True:
+            # Keyset pagination keeps each batch query cheap on large tables
+            batch = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+
+            for note in batch:
+                note.compress_content()
+                if note.is_compressed:
+                    compressed += 1
+                    raw_bytes += len(note.content.encode('utf-8'))
+                    stored_bytes += len(note.content_compressed)
+
+            with transaction.atomic():
+                Note.objects.bulk_update(batch, ['content', 'content_compressed', 'is_compressed'])
+
+            checked += len(batch)
+            last_pk = batch[-1].pk
+            self.stdout.write(f'Checked {checked} notes...')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Compressed {compressed} of {checked} notes, '
+            f'{raw_bytes} bytes of content stored in {stored_bytes} bytes.'
+        ))
+
+    def benchmark(self, sample):
+        """Report how much space compression saves and how long decompressing takes."""
+        rows = Note.objects.filter(is_compressed=True).values_list(
+            'content_bytes', 'content_compressed'
+        ).order_by('pk')[:sample]
+
+        count = raw_bytes = stored_bytes = 0
+        elapsed = 0.0
+        for content_bytes, packed in rows.iterator():
+            packed = bytes(packed)
+            started = time.perf_counter()
+            zlib.decompress(packed)
+            elapsed += time.perf_counter() - started
+            count += 1
+            raw_bytes += content_bytes
+            stored_bytes += len(packed)
+
+        if not count:
+            self.stdout.write('No compressed notes to benchmark.')
+            return
+
+        saved = raw_bytes - stored_bytes
+        self.stdout.write(f'Notes sampled:        {count}')
+        self.stdout.write(f'Content size:         {raw_bytes} bytes')
+        self.stdout.write(f'Stored size:          {stored_bytes} bytes')
+        self.stdout.write(f'Saved:                {saved} bytes ({saved * 100 / raw_bytes:.1f}%)')
+        self.stdout.write(f'Decompression time:   {elapsed * 1e6 / count:.1f} us per note')
+        self.stdout.write(f'Decompression speed:  {raw_bytes / max(elapsed, 1e-9) / (1024 * 1024):.1f} MB/s')
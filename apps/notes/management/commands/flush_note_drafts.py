@@ -0,0 +1,37 @@
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.notes.drafts import DRAFT_QUIET_PERIOD, flush_drafts
+
+
+class Command(BaseCommand):
+    """Write autosaved note drafts that are no longer being edited to their notes."""
+    help = 'Persist cached note drafts that have not been autosaved for a quiet period.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--quiet-period',
+            type=int,
+            default=DRAFT_QUIET_PERIOD,
+            help=f'Seconds without autosave before a draft is saved (default: {DRAFT_QUIET_PERIOD})'
+        )
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=0,
+            help='Keep running and flush every INTERVAL seconds instead of once'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                saved, failed = flush_drafts(quiet_period=options['quiet_period'])
+            except ImproperlyConfigured as e:
+                raise CommandError(str(e))
+            if saved or failed or options['verbosity'] > 1:
+                self.stdout.write(f'Saved {saved} drafts, {failed} could not be saved.')
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
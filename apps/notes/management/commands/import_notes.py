@@ -0,0 +1,87 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.notes.importers import PARSERS, IMPORT_BATCH_SIZE, guess_format, import_notes, run_pending_imports
+
+
+class Command(BaseCommand):
+    """Import notes for a user from a JSON, Markdown zip or ENEX file on the server, or the uploaded files."""
+    help = (
+        'Import notes for a user from a JSON array, a zip of Markdown files or an Evernote ENEX export, '
+        'or with --pending the files uploaded to /api/imports/.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', nargs='?', help='Username of the owner of the imported notes')
+        parser.add_argument('path', nargs='?', help='Path of the file to import')
+        parser.add_argument(
+            '--format',
+            choices=sorted(PARSERS),
+            help='Format of the file (default: guessed from the file extension)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=IMPORT_BATCH_SIZE,
+            help=f'Number of notes inserted per transaction (default: {IMPORT_BATCH_SIZE})'
+        )
+        parser.add_argument(
+            '--pending',
+            action='store_true',
+            help='Import the files uploaded through the API instead of a file on the server'
+        )
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=0,
+            help='With --pending, keep running and look for uploads every INTERVAL seconds instead of once'
+        )
+
+    def handle(self, *args, **options):
+        if options['pending']:
+            return self.handle_pending(options)
+        if not options['username'] or not options['path']:
+            raise CommandError('Give a username and a path, or --pending.')
+
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"User '{options['username']}' does not exist.")
+
+        source_format = options['format'] or guess_format(options['path'])
+        if source_format is None:
+            raise CommandError('Cannot guess the file format, use --format.')
+
+        try:
+            with open(options['path'], 'rb') as fileobj:
+                note_import = import_notes(
+                    user, fileobj, source_format, file_name=options['path'], batch_size=options['batch_size']
+                )
+        except OSError as e:
+            raise CommandError(str(e))
+
+        for error in note_import.errors:
+            self.stdout.write(self.style.WARNING(f"#{error['position']} {error['title']}: {error['errors']}"))
+        if note_import.status == 'failed':
+            raise CommandError(f'Import failed after {note_import.imported_count} notes: {note_import.message}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {note_import.imported_count} notes, {note_import.failed_count} skipped.'
+        ))
+
+    def handle_pending(self, options):
+        while True:
+            for note_import in run_pending_imports(batch_size=options['batch_size']):
+                message = (
+                    f'Import {note_import.pk} of {note_import.user.username} {note_import.status}: '
+                    f'{note_import.imported_count} notes, {note_import.failed_count} skipped.'
+                )
+                if note_import.status == 'failed':
+                    self.stdout.write(self.style.WARNING(f'{message} {note_import.message}'))
+                else:
+                    self.stdout.write(message)
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from apps.notes.models import NoteRevision
+from apps.notes.services import prune_revisions
+
+
+class Command(BaseCommand):
+    """Delete old note revisions beyond the number kept per note."""
+    help = 'Keep only the newest revisions of every note, deleting older ones in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--keep',
+            type=int,
+            default=NoteRevision.MAX_REVISIONS,
+            help=f'Number of revisions kept per note (default: {NoteRevision.MAX_REVISIONS})'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of revisions deleted per query (default: 1000)'
+        )
+
+    def handle(self, *args, **options):
+        deleted = prune_revisions(keep=options['keep'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} old note revisions.'))
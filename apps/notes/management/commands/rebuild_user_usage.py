@@ -0,0 +1,30 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.notes.models import UserUsage
+
+
+class Command(BaseCommand):
+    """Rebuild the per-user usage ledgers from the notes and attachments tables."""
+    help = 'Recalculate the note and attachment usage ledger of every user (or a single user).'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            help='Username of a single user to rebuild'
+        )
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('pk')
+        if options['user']:
+            users = users.filter(username=options['user'])
+            if not users.exists():
+                raise CommandError(f"User '{options['user']}' does not exist.")
+
+        rebuilt = 0
+        for user in users.iterator():
+            usage, created = UserUsage.objects.get_or_create(user=user)
+            usage.recalculate()
+            rebuilt += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt usage ledgers for {rebuilt} users.'))
@@ -0,0 +1,28 @@
+# Generated by Django 5.2 on 2026-10-19 00:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0002_alter_note_options_note_is_archived_note_is_pinned_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='content_bytes',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Content size in bytes'),
+        ),
+        migrations.AddField(
+            model_name='note',
+            name='excerpt',
+            field=models.CharField(blank=True, editable=False, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='note',
+            name='word_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
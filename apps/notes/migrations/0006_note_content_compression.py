@@ -0,0 +1,30 @@
+# Generated by Django 5.2 on 2026-10-19 01:06
+
+import apps.notes.models
+import apps.notes.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0005_noteimport'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='content_compressed',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='note',
+            name='is_compressed',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='note',
+            name='content',
+            field=apps.notes.models.NoteContentField(validators=[apps.notes.validators.validate_note_content]),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2 on 2026-10-19 01:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0006_note_content_compression'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='revision_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='NoteRevision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField()),
+                ('title', models.CharField(max_length=200)),
+                ('is_snapshot', models.BooleanField(default=False)),
+                ('data', models.TextField()),
+                ('content_bytes', models.PositiveIntegerField(default=0, help_text='Content size in bytes')),
+                ('saved_at', models.DateTimeField(help_text='When this version of the note was saved')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('note', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='revisions', to='notes.note')),
+            ],
+            options={
+                'ordering': ['-number'],
+                'unique_together': {('note', 'number')},
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2 on 2026-10-19 01:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0007_noterevision'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BlockedWord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('word_list', models.CharField(choices=[('title', 'Note titles'), ('content', 'Note content'), ('name', 'Category and tag names'), ('profanity', 'Profanity (whole words, everywhere)')], max_length=20)),
+                ('word', models.CharField(max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['word_list', 'word'],
+                'unique_together': {('word_list', 'word')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-19 02:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0008_blockedword'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='noteimport',
+            name='upload_path',
+            field=models.CharField(blank=True, editable=False, max_length=500),
+        ),
+    ]
@@ -1,17 +1,87 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Sum
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.contrib.auth.models import User
 from django.urls import reverse
 from django.core.exceptions import ValidationError
 from django.utils.html import strip_tags
 from django.utils.text import Truncator
+from contextlib import contextmanager
 import json
+import threading
+import zlib
+from .deltas import IDENTITY_DELTA, make_delta, apply_delta
+from .wordlists import word_lists_changed
 from .validators import (
     validate_note_title, validate_note_content,
     validate_category_name, validate_tag_name,
-    validate_content_quota
+    validate_content_quota, validate_user_quota
 )
 
 
+class FieldTrackerMixin:
+    """
+    Remember the values of concrete fields as they were loaded from the database.
+    
+    Lets models compute deltas and changed fields without re-fetching the row.
+    """
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+    
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        # Deferred fields loaded on access come through here as well
+        self._remember_values(fields)
+    
+    def _remember_values(self, fields=None):
+        """Record the current values of the given (or all loaded) fields as original."""
+        if not hasattr(self, '_loaded_values'):
+            self._loaded_values = {}
+        deferred = self.get_deferred_fields()
+        for field in self._meta.concrete_fields:
+            if field.attname in deferred:
+                continue
+            if fields is None or field.name in fields or field.attname in fields:
+                self._loaded_values[field.attname] = getattr(self, field.attname)
+    
+    def get_original_value(self, field_name, default=None):
+        """Get the value a field had when the instance was loaded or last saved."""
+        field = self._meta.get_field(field_name)
+        return getattr(self, '_loaded_values', {}).get(field.attname, default)
+    
+    def get_changed_fields(self):
+        """
+        Get names of loaded fields whose value differs from the original one.
+        
+        Instances that have not been saved yet report every concrete field.
+        """
+        loaded_values = getattr(self, '_loaded_values', None)
+        if self._state.adding or loaded_values is None:
+            return {field.name for field in self._meta.concrete_fields}
+        
+        changed = set()
+        deferred = self.get_deferred_fields()
+        for field in self._meta.concrete_fields:
+            if field.attname in deferred:
+                continue
+            if field.attname not in loaded_values:
+                # A deferred field that was assigned without being loaded
+                changed.add(field.name)
+            elif getattr(self, field.attname) != loaded_values[field.attname]:
+                changed.add(field.name)
+        return changed
+    
+    def has_changes(self):
+        """Check if any loaded field differs from its original value."""
+        return bool(self.get_changed_fields())
+
+
 class Category(models.Model):
     name = models.CharField(max_length=100, validators=[validate_category_name])
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='categories')
@@ -77,6 +147,9 @@ class NoteSharing(models.Model):
         ('admin', 'Admin'),
     ]
     
+    # Maximum number of users a note can be shared with
+    MAX_SHARED_USERS = 20
+    
     note = models.ForeignKey('Note', on_delete=models.CASCADE, related_name='sharing_permissions')
     shared_with = models.ForeignKey(User, on_delete=models.CASCADE, related_name='shared_with_me')
     permission = models.CharField(max_length=10, choices=PERMISSION_CHOICES, default='read')
@@ -90,9 +163,55 @@ class NoteSharing(models.Model):
         return f"{self.note.title} shared with {self.shared_with.username} ({self.permission})"
 
 
-class Note(models.Model):
+class NoteContentField(models.TextField):
+    """
+    Text field for note content that is left empty in the database when the
+    note keeps its content compressed in content_compressed.
+    """
+    
+    def pre_save(self, model_instance, add):
+        if getattr(model_instance, 'is_compressed', False):
+            return ''
+        return super().pre_save(model_instance, add)
+
+
+class NoteQuerySet(models.QuerySet):
+    
+    def defer_content(self):
+        """Defer the content columns, for listings that only need the excerpt."""
+        return self.defer('content', 'content_compressed')
+    
+    def bulk_update(self, objs, fields, batch_size=None):
+        """Bulk update notes, leaving the content column empty for compressed notes like save() does."""
+        objs = list(objs)
+        if 'content' not in fields:
+            return super().bulk_update(objs, fields, batch_size=batch_size)
+        
+        compressed = [(note, note.content) for note in objs if note.is_compressed]
+        for note, content in compressed:
+            note.content = ''
+        try:
+            return super().bulk_update(objs, fields, batch_size=batch_size)
+        finally:
+            for note, content in compressed:
+                note.content = content
+
+
+class Note(FieldTrackerMixin, models.Model):
+    # Number of characters kept in the precomputed excerpt column
+    EXCERPT_LENGTH = 200
+    
+    # Content of at least this many bytes is stored zlib-compressed
+    COMPRESS_THRESHOLD = 4096
+    COMPRESS_LEVEL = 6
+    # Compressed content must be at most this fraction of the original size to be kept
+    COMPRESS_MAX_RATIO = 0.9
+    
+    # Columns derived from the content and written whenever the content changes
+    CONTENT_DERIVED_FIELDS = ('excerpt', 'content_bytes', 'word_count', 'content_compressed', 'is_compressed')
+    
     title = models.CharField(max_length=200, validators=[validate_note_title])
-    content = models.TextField(validators=[validate_note_content])
+    content = NoteContentField(validators=[validate_note_content])
     category = models.ForeignKey(
         Category, 
         on_delete=models.SET_NULL, 
@@ -110,12 +229,92 @@ class Note(models.Model):
     shared_with = models.ManyToManyField(User, through=NoteSharing, related_name='shared_notes')
     is_archived = models.BooleanField(default=False, help_text="Archive this note")
     
+    # Content metrics precomputed on save so listings can defer the content column
+    excerpt = models.CharField(max_length=EXCERPT_LENGTH, blank=True, editable=False)
+    content_bytes = models.PositiveIntegerField(default=0, editable=False, help_text="Content size in bytes")
+    word_count = models.PositiveIntegerField(default=0, editable=False)
+    
+    # Large content is kept compressed here instead of in the content column
+    content_compressed = models.BinaryField(null=True, blank=True, editable=False)
+    is_compressed = models.BooleanField(default=False, editable=False)
+    
+    # Number of the latest revision recorded for this note
+    revision_count = models.PositiveIntegerField(default=0, editable=False)
+    
+    objects = NoteQuerySet.as_manager()
+    
     class Meta:
         ordering = ['-is_pinned', '-updated_at']
     
     def __str__(self):
         return self.title
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        loaded = instance._loaded_values
+        if 'content' not in loaded:
+            return instance
+        
+        if loaded.get('is_compressed') and loaded.get('content_compressed') is not None:
+            content = zlib.decompress(loaded['content_compressed']).decode('utf-8')
+            instance.content = loaded['content'] = content
+        elif 'is_compressed' not in loaded or (loaded['is_compressed'] and 'content_compressed' not in loaded):
+            # The content column alone may be empty, load the content with its
+            # compressed copy when it is accessed
+            del instance.__dict__['content']
+            del loaded['content']
+        return instance
+    
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        if fields is not None and 'content' in fields:
+            fields = set(fields) | {'content_compressed', 'is_compressed'}
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+    
+    @classmethod
+    def content_search(cls, terms, notes):
+        """
+        Get a Q matching the notes whose content contains any of terms.
+        
+        The content column of compressed notes is empty, so the compressed notes
+        among notes are decompressed and searched here, one query for all terms.
+        Narrow notes down to the notes that can match (e.g. one user's notes).
+        
+        Args:
+            terms: A search term or a list of terms
+            notes: Queryset of the candidate notes
+        """
+        if isinstance(terms, str):
+            terms = [terms]
+        query = models.Q()
+        for term_query in cls.content_search_each(terms, notes):
+            query |= term_query
+        return query
+    
+    @classmethod
+    def content_search_each(cls, terms, notes):
+        """
+        Get one Q per term matching the notes whose content contains that term,
+        for searches needing every term. Compressed notes are decompressed once
+        for all terms, see content_search.
+        """
+        lowered = [term.lower() for term in terms]
+        matches = [[] for term in terms]
+        compressed = notes.filter(is_compressed=True).values_list('pk', 'content_compressed')
+        for pk, packed in compressed.iterator():
+            content = zlib.decompress(packed).decode('utf-8').lower()
+            for index, term in enumerate(lowered):
+                if term in content:
+                    matches[index].append(pk)
+        
+        queries = []
+        for term, pks in zip(terms, matches):
+            query = models.Q(content__icontains=term)
+            if pks:
+                query |= models.Q(pk__in=pks)
+            queries.append(query)
+        return queries
+    
     def get_absolute_url(self):
         return reverse('notes:detail', kwargs={'pk': self.pk})
     
@@ -126,8 +325,12 @@ class Note(models.Model):
         """Validate the note."""
         super().clean()
         
+        # Only re-check what changed since the note was loaded
+        changed = self.get_changed_fields()
+        
         # Check if category belongs to the same user
-        if self.category and self.user and self.category.user != self.user:
+        if ('category' in changed or 'user' in changed) and self.category and self.user_id \
+                and self.category.user_id != self.user_id:
             raise ValidationError({'category': 'You do not have permission to use this category.'})
         
         # Check maximum number of tags
@@ -135,39 +338,214 @@ class Note(models.Model):
         if hasattr(self, '_tags') and len(self._tags) > MAX_TAGS:
             raise ValidationError({'tags': f'You cannot add more than {MAX_TAGS} tags to a note.'})
         
+        if not self.user_id or not (self._state.adding or 'content' in changed):
+            return
+        
+        # Quotas are checked against the user's usage ledger, locked when saving
+        usage = UserUsage.for_user(self.user_id, lock=transaction.get_connection().in_atomic_block)
+        
+        # Check maximum number of notes for new notes
+        if not self.pk:
+            validate_user_quota(self.user_id, Note, UserUsage.MAX_NOTES, current_count=usage.note_count)
+        
         # Check content quota
-        if self.content:
+        if 'content' in changed and self.content:
             try:
-                # Calculate content size difference for existing notes
-                if self.pk:
-                    old_note = Note.objects.get(pk=self.pk)
-                    old_size = len(old_note.content.encode('utf-8'))
-                    new_size = len(self.content.encode('utf-8'))
-                    content_diff = new_size - old_size
-                else:
-                    content_diff = len(self.content.encode('utf-8'))
-                
-                # User's content quota is 10MB (can be adjusted)
-                validate_content_quota(self.user, content_diff)
+                validate_content_quota(self.user_id, self.get_content_size_delta(), usage=usage)
             except Exception as e:
                 raise ValidationError({'content': str(e)})
     
     def sanitize_content(self):
         """Sanitize note content to remove potentially harmful HTML."""
-        self.content = strip_tags(self.content)
+        # Text without '<' has no tags, skip parsing it
+        if self.content and '<' in self.content:
+            self.content = strip_tags(self.content)
+    
+    def mark_validated(self, *field_names, content_scan=None):
+        """
+        Record that the current values of the given fields already passed their
+        validators (e.g. in a form), so validating the note does not run them
+        again until it is saved, unless the values change in between.
+        
+        A ContentScan of the content lets save() reuse its measurements.
+        """
+        self._validated_values = {name: getattr(self, name) for name in field_names}
+        self._content_scan = content_scan
+    
+    def clean_fields(self, exclude=None):
+        # Fields validated by the caller and unchanged since are not validated again
+        validated = getattr(self, '_validated_values', None)
+        if validated:
+            exclude = set(exclude or ()) | {
+                name for name, value in validated.items() if getattr(self, name) == value
+            }
+        super().clean_fields(exclude=exclude)
+    
+    def get_content_size_delta(self):
+        """Return how many bytes saving this note adds to the user's content usage."""
+        new_size = len((self.content or '').encode('utf-8'))
+        if not self.pk:
+            return new_size
+        
+        # Use the size the note was loaded with, only hitting the database if unknown
+        old_size = self.get_original_value('content_bytes')
+        if old_size is None:
+            old_size = Note.objects.filter(pk=self.pk).values_list(
+                'content_bytes', flat=True
+            ).first() or 0
+        return new_size - old_size
+    
+    def update_content_metrics(self):
+        """Recompute the excerpt, byte size, word count and compressed copy from the content."""
+        content = self.content or ''
+        self.excerpt = Truncator(content).chars(self.EXCERPT_LENGTH)
+        
+        scan = getattr(self, '_content_scan', None)
+        if scan is not None and scan.matches(content):
+            # Measured when the content was validated
+            data = None
+            self.content_bytes = scan.content_bytes
+            self.word_count = scan.word_count
+        else:
+            data = content.encode('utf-8')
+            self.content_bytes = len(data)
+            self.word_count = len(content.split())
+        self.compress_content(data)
+    
+    def compress_content(self, data=None):
+        """
+        Keep the content compressed in content_compressed if it is large enough
+        and compresses well, otherwise store it in the content column.
+        """
+        if data is None:
+            data = (self.content or '').encode('utf-8')
+        
+        if len(data) >= self.COMPRESS_THRESHOLD:
+            packed = zlib.compress(data, self.COMPRESS_LEVEL)
+            if len(packed) <= len(data) * self.COMPRESS_MAX_RATIO:
+                self.content_compressed = packed
+                self.is_compressed = True
+                return
+        
+        self.content_compressed = None
+        self.is_compressed = False
+    
+    def build_revision(self):
+        """
+        Build the revision that records the version of this note before its
+        current title and content changes, and advance revision_count to it.
+        
+        The revision is not saved. Original values that were not loaded with
+        the note are read in one query.
+        """
+        content_changed = 'content' in self.get_changed_fields()
+        names = ['title', 'updated_at', 'content_bytes', 'revision_count']
+        if content_changed:
+            names.append('content')
+        
+        loaded = getattr(self, '_loaded_values', {})
+        original = {name: loaded[name] for name in names if name in loaded}
+        missing = [name for name in names if name not in original]
+        if missing:
+            fields = missing + (['content_compressed', 'is_compressed'] if 'content' in missing else [])
+            stored = Note.objects.only(*fields).get(pk=self.pk)
+            original.update((name, getattr(stored, name)) for name in missing)
+        
+        number = original['revision_count'] + 1
+        old_content = original['content'] if content_changed else None
+        revision = NoteRevision(
+            note=self,
+            number=number,
+            title=original['title'],
+            content_bytes=original['content_bytes'],
+            saved_at=original['updated_at'],
+        )
+        
+        delta = json.dumps(
+            make_delta(self.content, old_content) if content_changed else IDENTITY_DELTA,
+            ensure_ascii=False, separators=(',', ':'),
+        )
+        if number % NoteRevision.SNAPSHOT_INTERVAL == 0 or (content_changed and len(delta) >= len(old_content)):
+            # Full copy, also used when the delta would not be smaller
+            revision.is_snapshot = True
+            revision.data = self.content if old_content is None else old_content
+        else:
+            revision.data = delta
+        
+        self.revision_count = number
+        return revision
     
     def save(self, *args, **kwargs):
-        """Save the note and validate it."""
-        # Sanitize content
-        self.sanitize_content()
+        """
+        Save the note and validate it.
         
-        # Validate the note
-        self.full_clean()
+        Existing notes only sanitize, validate and write the fields that changed
+        since they were loaded, and are not written at all if nothing changed.
+        Changes of the title or content record the previous version as a
+        NoteRevision, inserted in the same transaction.
+        """
+        adding = self._state.adding
+        update_fields = kwargs.get('update_fields')
         
-        super().save(*args, **kwargs)
+        if adding or kwargs.get('force_insert'):
+            changed = None  # Everything is new
+        elif update_fields is not None:
+            changed = {self._meta.get_field(name).name for name in update_fields}
+        else:
+            changed = self.get_changed_fields()
+            if not changed:
+                return
+        
+        content_changed = changed is None or 'content' in changed
+        if content_changed:
+            # Sanitize content
+            self.sanitize_content()
+            
+            # Keep the precomputed content columns in sync
+            self.update_content_metrics()
+        
+        record_revision = changed is not None and bool(changed & {'title', 'content'})
+        
+        exclude = None
+        if changed is not None:
+            save_fields = changed | {'updated_at'}
+            if content_changed:
+                save_fields |= set(self.CONTENT_DERIVED_FIELDS)
+            if record_revision:
+                save_fields.add('revision_count')
+            kwargs['update_fields'] = save_fields
+            
+            # Skip validators of fields that are not being written
+            exclude = [field.name for field in self._meta.concrete_fields if field.name not in save_fields]
+        
+        # Validate, save and account the note in one transaction so the
+        # usage ledger row stays locked between the quota check and the write
+        with transaction.atomic():
+            content_delta = self.get_content_size_delta() if content_changed else 0
+            self.full_clean(exclude=exclude)
+            
+            revision = self.build_revision() if record_revision else None
+            super().save(*args, **kwargs)
+            if revision is not None:
+                revision.save()
+            
+            UserUsage.adjust(
+                self.user_id,
+                note_count=1 if adding else 0,
+                content_bytes=content_delta,
+            )
+        
+        # Values validated by the caller only count for this save
+        self._validated_values = self._content_scan = None
+        
+        # The saved values are the new baseline for change tracking
+        self._remember_values(kwargs.get('update_fields'))
     
     def get_excerpt(self, length=100):
         """Get a truncated version of the content."""
+        # The stored excerpt is enough for short excerpts and avoids loading the content
+        if self.excerpt and length <= self.EXCERPT_LENGTH:
+            return Truncator(self.excerpt).chars(length)
         return Truncator(self.content).chars(length)
     
     def is_shared_with_user(self, user):
@@ -201,7 +579,65 @@ class Note(models.Model):
         return self.is_shared_with_user(user)
 
 
-class NoteAttachment(models.Model):
+class NoteRevision(models.Model):
+    """
+    An earlier version of a note.
+    
+    Revisions are stored as reverse deltas: the content of a revision is
+    rebuilt from the next newer version, that is the next revision or the note
+    itself. Every SNAPSHOT_INTERVAL-th revision stores the full content, so no
+    version needs more than SNAPSHOT_INTERVAL deltas to rebuild.
+    """
+    # Every revision with a number divisible by this is a full copy
+    SNAPSHOT_INTERVAL = 10
+    
+    # Number of revisions kept per note by prune_note_revisions
+    MAX_REVISIONS = 100
+    
+    note = models.ForeignKey(Note, on_delete=models.CASCADE, related_name='revisions')
+    number = models.PositiveIntegerField()
+    title = models.CharField(max_length=200)
+    is_snapshot = models.BooleanField(default=False)
+    # Full content for snapshots, otherwise the JSON delta from the next newer version
+    data = models.TextField()
+    content_bytes = models.PositiveIntegerField(default=0, help_text="Content size in bytes")
+    saved_at = models.DateTimeField(help_text="When this version of the note was saved")
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-number']
+        unique_together = ['note', 'number']
+    
+    def __str__(self):
+        return f"{self.title} (revision {self.number})"
+    
+    def get_content(self):
+        """Rebuild the content of this version of the note."""
+        if self.is_snapshot:
+            return self.data
+        
+        # Newer revisions up to the next snapshot, which is at most SNAPSHOT_INTERVAL away
+        newer = []
+        content = None
+        for revision in NoteRevision.objects.filter(
+            note_id=self.note_id,
+            number__gt=self.number,
+            number__lte=self.number + self.SNAPSHOT_INTERVAL,
+        ).order_by('number'):
+            if revision.is_snapshot:
+                content = revision.data
+                break
+            newer.append(revision)
+        if content is None:
+            # No snapshot after this revision, start from the note itself
+            content = Note.objects.only('content', 'content_compressed', 'is_compressed').get(pk=self.note_id).content
+        
+        for revision in newer[::-1] + [self]:
+            content = apply_delta(content, json.loads(revision.data))
+        return content
+
+
+class NoteAttachment(FieldTrackerMixin, models.Model):
     """Model for storing file attachments for notes."""
     note = models.ForeignKey(Note, on_delete=models.CASCADE, related_name='attachments')
     file = models.FileField(upload_to='note_attachments/%Y/%m/%d/')
@@ -224,25 +660,264 @@ class NoteAttachment(models.Model):
         if self.file_size > 5 * 1024 * 1024:  # 5MB in bytes
             raise ValidationError({'file': 'File size cannot exceed 5MB.'})
         
-        # Check user's attachment quota
-        user = self.note.user
-        total_attachments = NoteAttachment.objects.filter(note__user=user).count()
-        if total_attachments >= 100:  # Limit to 100 attachments per user
+        # Check user's attachment quotas against the usage ledger
+        usage = UserUsage.for_user(self.note.user, lock=transaction.get_connection().in_atomic_block)
+        if not self.pk and usage.attachment_count >= UserUsage.MAX_ATTACHMENTS:
             raise ValidationError({'file': 'You have reached the maximum number of attachments allowed.'})
         
         # Check total attachment size per user
-        total_size = NoteAttachment.objects.filter(note__user=user).exclude(pk=self.pk).aggregate(
-            total=models.Sum('file_size')
-        )['total'] or 0
-        
-        MAX_ATTACHMENT_SIZE = 100 * 1024 * 1024  # 100MB per user
-        if total_size + self.file_size > MAX_ATTACHMENT_SIZE:
+        if usage.attachment_bytes + self.get_file_size_delta() > UserUsage.MAX_ATTACHMENT_BYTES:
             raise ValidationError({'file': 'You have reached your attachment quota limit.'})
     
+    def get_file_size_delta(self):
+        """Return how many bytes saving this attachment adds to the user's attachment usage."""
+        if not self.pk:
+            return self.file_size
+        
+        old_size = self.get_original_value('file_size')
+        if old_size is None:
+            old_size = NoteAttachment.objects.filter(pk=self.pk).values_list(
+                'file_size', flat=True
+            ).first() or 0
+        return self.file_size - old_size
+    
     def save(self, *args, **kwargs):
         """Save the attachment and validate it."""
         if not self.file_size and self.file:
             self.file_size = self.file.size
         
-        self.full_clean()
+        with transaction.atomic():
+            adding = self._state.adding
+            size_delta = self.get_file_size_delta()
+            self.full_clean()
+            super().save(*args, **kwargs)
+            
+            UserUsage.adjust(
+                self.note.user_id,
+                attachment_count=1 if adding else 0,
+                attachment_bytes=size_delta,
+            )
+        
+        self._remember_values(kwargs.get('update_fields'))
+
+
+# Usage deltas collected by UserUsage.batch_adjustments() in the current thread
+_pending_usage = threading.local()
+
+
+class UserUsage(models.Model):
+    """Per-user ledger of note and attachment usage used for quota checks."""
+    # Per-user quotas
+    MAX_NOTES = 1000
+    MAX_CONTENT_BYTES = 10 * 1024 * 1024  # 10MB
+    MAX_ATTACHMENTS = 100
+    MAX_ATTACHMENT_BYTES = 100 * 1024 * 1024  # 100MB
+    
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='usage')
+    note_count = models.PositiveIntegerField(default=0)
+    content_bytes = models.PositiveBigIntegerField(default=0)
+    attachment_count = models.PositiveIntegerField(default=0)
+    attachment_bytes = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name_plural = 'User usage'
+    
+    def __str__(self):
+        return f"{self.user.username}'s usage"
+    
+    @classmethod
+    def for_user(cls, user, lock=False):
+        """
+        Get the usage row for a user (or user id), creating it from the user's data if missing.
+        
+        With lock=True the row is read with SELECT ... FOR UPDATE, so it must be
+        called inside a transaction.
+        """
+        user_id = getattr(user, 'pk', user)
+        queryset = cls.objects.select_for_update() if lock else cls.objects.all()
+        try:
+            return queryset.get(user_id=user_id)
+        except cls.DoesNotExist:
+            pass
+        
+        usage = cls(user_id=user_id)
+        usage.recalculate(commit=False)
+        try:
+            with transaction.atomic():
+                usage.save()
+        except IntegrityError:
+            # Another request created the row concurrently
+            return queryset.get(user_id=user_id)
+        return usage
+    
+    @classmethod
+    def adjust(cls, user_id, note_count=0, content_bytes=0, attachment_count=0, attachment_bytes=0):
+        """Atomically apply usage deltas to a user's ledger row."""
+        deltas = {
+            'note_count': note_count,
+            'content_bytes': content_bytes,
+            'attachment_count': attachment_count,
+            'attachment_bytes': attachment_bytes,
+        }
+        
+        # Inside batch_adjustments() the deltas are only collected
+        pending = getattr(_pending_usage, 'deltas', None)
+        if pending is not None:
+            user_deltas = pending.setdefault(user_id, dict.fromkeys(deltas, 0))
+            for field, delta in deltas.items():
+                user_deltas[field] += delta
+            return
+        
+        changes = {}
+        for field, delta in deltas.items():
+            if delta > 0:
+                changes[field] = F(field) + delta
+            elif delta < 0:
+                # Never let a counter go negative if the ledger has drifted
+                changes[field] = Greatest(F(field) + delta, 0)
+        
+        # A missing row is rebuilt from the user's data the next time it is needed
+        if changes:
+            cls.objects.filter(user_id=user_id).update(**changes)
+    
+    @classmethod
+    @contextmanager
+    def batch_adjustments(cls):
+        """
+        Collect adjust() calls (including those from delete signals) and apply
+        them as one UPDATE per user when the block exits without an error.
+        """
+        if getattr(_pending_usage, 'deltas', None) is not None:
+            # Already batching in an outer block
+            yield
+            return
+        
+        _pending_usage.deltas = {}
+        try:
+            yield
+            pending = _pending_usage.deltas
+        finally:
+            _pending_usage.deltas = None
+        
+        for user_id, deltas in pending.items():
+            cls.adjust(user_id, **deltas)
+    
+    def recalculate(self, commit=True):
+        """Rebuild the ledger from the user's notes and attachments."""
+        notes = Note.objects.filter(user_id=self.user_id).aggregate(
+            count=models.Count('pk'), size=Sum('content_bytes')
+        )
+        attachments = NoteAttachment.objects.filter(note__user_id=self.user_id).aggregate(
+            count=models.Count('pk'), size=Sum('file_size')
+        )
+        self.note_count = notes['count']
+        self.content_bytes = notes['size'] or 0
+        self.attachment_count = attachments['count']
+        self.attachment_bytes = attachments['size'] or 0
+        
+        if commit:
+            self.save()
+
+
+class NoteImport(models.Model):
+    """Progress record of an import of notes from an uploaded file."""
+    FORMAT_CHOICES = [
+        ('json', 'JSON array'),
+        ('markdown', 'Zip archive of Markdown files'),
+        ('enex', 'Evernote export (ENEX)'),
+    ]
+    
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+    
+    # Number of per-note errors kept on the record
+    MAX_ERRORS = 100
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='note_imports')
+    source_format = models.CharField(max_length=20, choices=FORMAT_CHOICES)
+    file_name = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    bytes_total = models.PositiveBigIntegerField(default=0)
+    bytes_read = models.PositiveBigIntegerField(default=0)
+    imported_count = models.PositiveIntegerField(default=0)
+    failed_count = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)
+    message = models.TextField(blank=True)
+    # Uploaded file waiting for `manage.py import_notes --pending`, removed once imported
+    upload_path = models.CharField(max_length=500, blank=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.get_source_format_display()} import by {self.user.username} ({self.status})"
+    
+    @property
+    def progress(self):
+        """Share of the uploaded file processed so far, as a percentage."""
+        if self.status == 'completed':
+            return 100
+        if not self.bytes_total:
+            return 0
+        return min(100, int(self.bytes_read * 100 / self.bytes_total))
+    
+    def add_error(self, position, title, errors):
+        """Record that the note at the given position of the file could not be imported."""
+        self.failed_count += 1
+        if len(self.errors) < self.MAX_ERRORS:
+            self.errors.append({'position': position, 'title': title, 'errors': errors})
+
+
+class BlockedWord(models.Model):
+    """A word added to one of the validator word lists without a deploy."""
+    WORD_LIST_CHOICES = [
+        ('title', 'Note titles'),
+        ('content', 'Note content'),
+        ('name', 'Category and tag names'),
+        ('profanity', 'Profanity (whole words, everywhere)'),
+    ]
+    
+    word_list = models.CharField(max_length=20, choices=WORD_LIST_CHOICES)
+    word = models.CharField(max_length=100)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['word_list', 'word']
+        unique_together = ['word_list', 'word']
+    
+    def __str__(self):
+        return f"{self.word} ({self.get_word_list_display()})"
+    
+    def save(self, *args, **kwargs):
+        # Lists are matched case-insensitively
+        self.word = self.word.strip().lower()
         super().save(*args, **kwargs)
+
+
+@receiver(post_save, sender=BlockedWord)
+@receiver(post_delete, sender=BlockedWord)
+def reload_word_lists_on_change(sender, **kwargs):
+    """Rebuild the compiled word lists in every process once the change is committed."""
+    transaction.on_commit(word_lists_changed)
+
+
+@receiver(post_delete, sender=Note)
+def release_note_usage(sender, instance, **kwargs):
+    """Remove a deleted note from its owner's usage ledger."""
+    UserUsage.adjust(instance.user_id, note_count=-1, content_bytes=-instance.content_bytes)
+
+
+@receiver(post_delete, sender=NoteAttachment)
+def release_attachment_usage(sender, instance, **kwargs):
+    """Remove a deleted attachment from its owner's usage ledger."""
+    user_id = Note.objects.filter(pk=instance.note_id).values_list('user_id', flat=True).first()
+    if user_id:
+        UserUsage.adjust(user_id, attachment_count=-1, attachment_bytes=-instance.file_size)
@@ -1,5 +1,8 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
 from rest_framework import serializers
-from .models import Note, Category, Tag
+from .models import Note, Category, Tag, NoteImport, NoteRevision
+from .services import create_note
+from .validators import ContentScan, validate_note_content
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -37,10 +40,17 @@ class NoteSerializer(serializers.ModelSerializer):
         fields = ['id', 'title', 'content', 'category', 'category_name', 
                   'tags', 'tags_list', 'created_at', 'updated_at']
         read_only_fields = ['user', 'created_at', 'updated_at']
+        # Content is validated in validate_content with a single scan that the note reuses
+        extra_kwargs = {'content': {'validators': []}}
     
     def get_category_name(self, obj):
         return obj.category.name if obj.category else None
     
+    def validate_content(self, value):
+        self._content_scan = ContentScan(value)
+        validate_note_content(value, scan=self._content_scan)
+        return value
+    
     def validate_category(self, value):
         if value and value.user != self.context['request'].user:
             raise serializers.ValidationError("You don't have access to this category")
@@ -53,5 +63,56 @@ class NoteSerializer(serializers.ModelSerializer):
         return value
     
     def create(self, validated_data):
-        validated_data['user'] = self.context['request'].user
-        return super().create(validated_data) 
\ No newline at end of file
+        try:
+            return create_note(
+                self.context['request'].user,
+                title=validated_data['title'],
+                content=validated_data['content'],
+                category=validated_data.get('category'),
+                tags=validated_data.get('tags', []),
+                validated_fields=('title', 'content'),
+                content_scan=getattr(self, '_content_scan', None),
+            )
+        except DjangoValidationError as e:
+            raise serializers.ValidationError(
+                e.message_dict if hasattr(e, 'error_dict') else {'non_field_errors': e.messages}
+            ) 
+    
+    def update(self, instance, validated_data):
+        # The title and content were validated by this serializer, the note does not validate them again
+        validated = [name for name in ('title', 'content') if name in validated_data]
+        for name in validated:
+            setattr(instance, name, validated_data[name])
+        instance.mark_validated(*validated, content_scan=getattr(self, '_content_scan', None))
+        return super().update(instance, validated_data)
+
+
+class NoteListSerializer(NoteSerializer):
+    """Compact note representation for list endpoints without the full content."""
+    
+    class Meta(NoteSerializer.Meta):
+        fields = ['id', 'title', 'excerpt', 'content_bytes', 'word_count', 'category',
+                  'category_name', 'tags', 'created_at', 'updated_at']
+        read_only_fields = ['user', 'excerpt', 'content_bytes', 'word_count',
+                            'created_at', 'updated_at']
+
+
+class NoteImportSerializer(serializers.ModelSerializer):
+    progress = serializers.IntegerField(read_only=True)
+    
+    class Meta:
+        model = NoteImport
+        fields = [
+            'id', 'source_format', 'file_name', 'status', 'progress', 'bytes_total', 'bytes_read',
+            'imported_count', 'failed_count', 'errors', 'message', 'created_at', 'finished_at'
+        ]
+        read_only_fields = fields
+
+
+class NoteRevisionSerializer(serializers.ModelSerializer):
+    """An earlier version of a note, without its content."""
+    
+    class Meta:
+        model = NoteRevision
+        fields = ['number', 'title', 'content_bytes', 'saved_at', 'created_at']
+        read_only_fields = fields
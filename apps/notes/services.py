@@ -0,0 +1,595 @@
+"""
+Service functions for Notes Manager application.
+This module contains note operations shared by the HTML views and the API.
+"""
+import bisect
+import re
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q, F, Case, When, Value, Exists, OuterRef, Count, Max
+from django.dispatch import Signal
+from django.db.models.functions import Lower
+from django.contrib.auth.models import User
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Note, NoteRevision, Category, Tag, NoteSharing
+from .validators import validate_tag_name, validate_category_name, validate_note_content_change
+
+
+# Maximum number of tags per note
+MAX_TAGS_PER_NOTE = 10
+
+# Maximum number of changes in one content patch
+MAX_PATCH_CHANGES = 1000
+
+# Units of content patch offsets: Python characters (code points), or UTF-16
+# code units as counted by JavaScript string indexes and textarea selections
+PATCH_OFFSET_UNITS = ('code_points', 'utf-16')
+
+# Characters outside the Basic Multilingual Plane, two UTF-16 code units each
+ASTRAL_RE = re.compile('[\U00010000-\U0010FFFF]')
+
+# Sent after the transaction creating a note commits, e.g. for search indexing.
+# Receivers get the note and the user as keyword arguments.
+note_created = Signal()
+
+
+def editable_notes(user):
+    """
+    Get a queryset of notes the user is allowed to edit.
+
+    Owners can edit their notes, other users need an 'edit' or 'admin' share.
+    """
+    # An EXISTS subquery instead of a join keeps UPDATEs on this queryset a single statement
+    shared_for_edit = NoteSharing.objects.filter(
+        note=OuterRef('pk'), shared_with=user, permission__in=['edit', 'admin']
+    )
+    return Note.objects.filter(Q(user=user) | Q(Exists(shared_for_edit)))
+
+
+def parse_flag(value):
+    """
+    Parse a boolean flag from request data.
+
+    Returns None for a missing or empty value, which the toggle services treat as "toggle".
+    """
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool):
+        return value
+    return str(value).lower() in ('1', 'true', 'on', 'yes')
+
+
+def pin_update_values(pinned=None):
+    """
+    Get the UPDATE values that pin, unpin or toggle the pin of notes.
+
+    Args:
+        pinned: New pin state, or None to toggle the current one
+    """
+    if pinned is None:
+        pinned = Case(When(Q(is_pinned=True) | Q(is_archived=True), then=Value(False)), default=Value(True))
+    elif pinned:
+        # Archived notes cannot be pinned (same rule as NoteForm.save)
+        pinned = Case(When(is_archived=True, then=Value(False)), default=Value(True))
+    return {'is_pinned': pinned, 'updated_at': timezone.now()}
+
+
+def archive_update_values(archived=None):
+    """
+    Get the UPDATE values that archive, unarchive or toggle the archive state of notes.
+
+    Args:
+        archived: New archive state, or None to toggle the current one
+    """
+    # is_pinned is assigned before is_archived because MySQL evaluates SET
+    # assignments left to right and must see the old archive state
+    changes = {}
+    if archived is None:
+        changes['is_pinned'] = Case(When(is_archived=False, then=Value(False)), default=F('is_pinned'))
+        changes['is_archived'] = Case(When(is_archived=True, then=Value(False)), default=Value(True))
+    else:
+        if archived:
+            # Archived notes lose their pin
+            changes['is_pinned'] = False
+        changes['is_archived'] = archived
+    changes['updated_at'] = timezone.now()
+    return changes
+
+
+def set_note_pinned(user, note_id, pinned=None):
+    """
+    Pin or unpin a note with a single UPDATE query.
+
+    Args:
+        user: User performing the change
+        note_id: ID of the note
+        pinned: New pin state, or None to toggle the current one
+
+    Returns:
+        True if the note was updated, False if it does not exist or is not editable
+    """
+    return bool(editable_notes(user).filter(pk=note_id).update(**pin_update_values(pinned)))
+
+
+def set_note_archived(user, note_id, archived=None):
+    """
+    Archive or unarchive a note with a single UPDATE query.
+
+    Args:
+        user: User performing the change
+        note_id: ID of the note
+        archived: New archive state, or None to toggle the current one
+
+    Returns:
+        True if the note was updated, False if it does not exist or is not editable
+    """
+    return bool(editable_notes(user).filter(pk=note_id).update(**archive_update_values(archived)))
+
+
+def move_note(user, note_id, category_id=None):
+    """
+    Move a note to another category (or out of any category) with a single UPDATE query.
+
+    The category must belong to the owner of the note.
+
+    Args:
+        user: User performing the change
+        note_id: ID of the note
+        category_id: ID of the target category, or None to clear the category
+
+    Returns:
+        True if the note was updated, False if the note is not editable
+        or the category does not belong to the note owner
+    """
+    notes = editable_notes(user).filter(pk=note_id)
+    if category_id is not None:
+        notes = notes.filter(Exists(
+            Category.objects.filter(pk=category_id, user_id=OuterRef('user_id'))
+        ))
+
+    return bool(notes.update(category_id=category_id, updated_at=timezone.now()))
+
+
+def parse_tag_names(text):
+    """
+    Split a comma separated string of tag names.
+
+    Names are stripped and de-duplicated case-insensitively, keeping the first spelling.
+    """
+    return normalize_tag_names(text.split(',')) if text else []
+
+
+def normalize_tag_names(names):
+    """Strip tag names and drop empty and case-insensitive duplicate names."""
+    seen = set()
+    normalized = []
+    for name in names:
+        name = name.strip()
+        if name and name.lower() not in seen:
+            seen.add(name.lower())
+            normalized.append(name)
+    return normalized
+
+
+def resolve_tags(user, names, validate=True):
+    """
+    Get or create the user's tags with the given names in a fixed number of queries.
+
+    Existing tags are matched case-insensitively with one query, missing ones are
+    created with one bulk INSERT that ignores conflicts and then fetched back.
+
+    Args:
+        user: Owner of the tags
+        names: Iterable of tag names
+        validate: Run validate_tag_name on each name first (skip if already validated)
+
+    Returns:
+        List of Tag objects in the order of the normalized names
+
+    Raises:
+        ValidationError: If validate is True and a name is not a valid tag name
+    """
+    names = normalize_tag_names(names)
+    if not names:
+        return []
+
+    if validate:
+        for name in names:
+            validate_tag_name(name)
+
+    def fetch(lowered_names):
+        return {
+            tag.name.lower(): tag
+            for tag in Tag.objects.annotate(name_lower=Lower('name')).filter(
+                user=user, name_lower__in=lowered_names
+            )
+        }
+
+    tags = fetch([name.lower() for name in names])
+    missing = [name for name in names if name.lower() not in tags]
+    if missing:
+        Tag.objects.bulk_create(
+            [Tag(name=name, user=user) for name in missing],
+            ignore_conflicts=True,
+        )
+        # Primary keys are not returned when conflicts are ignored
+        tags.update(fetch([name.lower() for name in missing]))
+
+    return [tags[name.lower()] for name in names if name.lower() in tags]
+
+
+def resolve_categories(user, names, validate=True):
+    """
+    Get or create the user's categories with the given names in a fixed number of queries.
+
+    Works like resolve_tags: names are matched case-insensitively and missing
+    categories are created with one bulk INSERT.
+
+    Args:
+        user: Owner of the categories
+        names: Iterable of category names
+        validate: Run validate_category_name on each name first (skip if already validated)
+
+    Returns:
+        Dict of lowercased name -> Category
+
+    Raises:
+        ValidationError: If validate is True and a name is not a valid category name
+    """
+    names = normalize_tag_names(names)
+    if not names:
+        return {}
+
+    if validate:
+        for name in names:
+            validate_category_name(name)
+
+    def fetch(lowered_names):
+        return {
+            category.name.lower(): category
+            for category in Category.objects.annotate(name_lower=Lower('name')).filter(
+                user=user, name_lower__in=lowered_names
+            )
+        }
+
+    categories = fetch([name.lower() for name in names])
+    missing = [name for name in names if name.lower() not in categories]
+    if missing:
+        Category.objects.bulk_create(
+            [Category(name=name, user=user) for name in missing],
+            ignore_conflicts=True,
+        )
+        categories.update(fetch([name.lower() for name in missing]))
+
+    return categories
+
+
+def attach_tags(note, tags):
+    """Add tags to a note with a single INSERT into the through table."""
+    if not tags:
+        return
+    Through = Note.tags.through
+    Through.objects.bulk_create(
+        [Through(note_id=note.pk, tag_id=tag.pk) for tag in tags],
+        ignore_conflicts=True,
+    )
+
+
+def create_note(user, title, content, category=None, tags=(), new_tag_names=(),
+                is_pinned=False, is_archived=False, validate_tags=True,
+                validated_fields=(), content_scan=None):
+    """
+    Create a note with its category and tags in a single transaction.
+
+    This is the one creation path used by the HTML view, NoteForm and the API.
+    The note is validated and quota-checked by Note.save, tags are resolved and
+    attached in bulk, and note_created is sent once the transaction commits.
+
+    Args:
+        user: Owner of the new note
+        title: Note title
+        content: Note content
+        category: Category object or ID, or None
+        tags: Existing Tag objects to attach (must belong to the user)
+        new_tag_names: Tag names to get or create for the user
+        is_pinned: Pin the note (ignored for archived notes)
+        is_archived: Archive the note
+        validate_tags: Validate new tag names (skip if already validated)
+        validated_fields: Names of note fields the caller already validated, e.g. ('title', 'content')
+        content_scan: ContentScan of the content, if the caller has one
+
+    Returns:
+        The created Note
+
+    Raises:
+        ValidationError: If the note, its category or its tags are invalid
+    """
+    if category is not None and not isinstance(category, Category):
+        try:
+            category = Category.objects.get(pk=category, user=user)
+        except (Category.DoesNotExist, ValueError, TypeError):
+            raise ValidationError({'category': 'Selected category does not exist.'})
+
+    tags = list(tags)
+    if any(tag.user_id != user.pk for tag in tags):
+        raise ValidationError({'tags': 'You do not have permission to use these tags.'})
+
+    new_tag_names = normalize_tag_names(new_tag_names)
+    if len(tags) + len(new_tag_names) > MAX_TAGS_PER_NOTE:
+        raise ValidationError({'tags': f'A note cannot have more than {MAX_TAGS_PER_NOTE} tags.'})
+
+    with transaction.atomic():
+        note = Note(
+            title=title,
+            content=content,
+            category=category,
+            user=user,
+            is_archived=is_archived,
+            # A note cannot be both archived and pinned
+            is_pinned=is_pinned and not is_archived,
+        )
+        note.mark_validated(*validated_fields, content_scan=content_scan)
+        note.save()
+
+        new_tags = resolve_tags(user, new_tag_names, validate=validate_tags)
+        known_ids = {tag.pk for tag in tags}
+        attach_tags(note, tags + [tag for tag in new_tags if tag.pk not in known_ids])
+
+        transaction.on_commit(lambda: note_created.send(sender=Note, note=note, user=user))
+
+    return note
+
+
+def share_notes(user, note_ids, user_ids, permission='read'):
+    """
+    Share several notes of a user with several other users in a fixed number of queries.
+
+    The notes are locked and checked for ownership with one query, the shared
+    users limit of all notes is checked with one grouped count, and the shares
+    are inserted with one bulk INSERT. Existing shares keep their permission.
+
+    Args:
+        user: Owner of the notes
+        note_ids: IDs of the notes to share
+        user_ids: IDs of the users to share the notes with
+        permission: Permission of the new shares ('read', 'edit' or 'admin')
+
+    Returns:
+        Number of new shares
+
+    Raises:
+        ValidationError: If a note or user does not exist, the permission is
+            invalid, or a note would be shared with too many users
+    """
+    if permission not in dict(NoteSharing.PERMISSION_CHOICES):
+        raise ValidationError({'permission': 'Select a valid permission.'})
+
+    note_ids = set(note_ids)
+    user_ids = set(user_ids) - {user.pk}
+    if not note_ids or not user_ids:
+        return 0
+
+    with transaction.atomic():
+        # Locking the notes serializes concurrent shares of the same notes
+        notes = {
+            note.pk: note for note in
+            Note.objects.select_for_update().filter(user=user, pk__in=note_ids).only('pk', 'title')
+        }
+        if len(notes) != len(note_ids):
+            raise ValidationError({'notes': 'Some of the selected notes do not exist.'})
+        if User.objects.filter(pk__in=user_ids).count() != len(user_ids):
+            raise ValidationError({'users': 'Some of the selected users do not exist.'})
+
+        # One grouped count of all current shares and of those already with the selected users
+        counts = {
+            row['note_id']: row for row in
+            NoteSharing.objects.filter(note_id__in=note_ids).values('note_id').annotate(
+                total=Count('pk'),
+                existing=Count('pk', filter=Q(shared_with_id__in=user_ids)),
+            )
+        }
+        new_shares = 0
+        too_many = []
+        for note_id, note in notes.items():
+            row = counts.get(note_id, {'total': 0, 'existing': 0})
+            added = len(user_ids) - row['existing']
+            if row['total'] + added > NoteSharing.MAX_SHARED_USERS:
+                too_many.append(note.title)
+            new_shares += added
+        if too_many:
+            raise ValidationError(
+                f'You cannot share a note with more than {NoteSharing.MAX_SHARED_USERS} users: '
+                f'{", ".join(sorted(too_many))}.'
+            )
+
+        NoteSharing.objects.bulk_create(
+            [
+                NoteSharing(note_id=note_id, shared_with_id=shared_with_id, permission=permission)
+                for note_id in notes for shared_with_id in user_ids
+            ],
+            ignore_conflicts=True,
+        )
+
+    return new_shares
+
+
+def utf16_offset_converter(content):
+    """
+    Get a function turning UTF-16 offsets in content into character offsets.
+
+    The function raises ValueError for an offset between the two halves of
+    a character outside the Basic Multilingual Plane, like most emoji.
+    """
+    # UTF-16 offsets of the characters taking two code units
+    starts = [match.start() + count for count, match in enumerate(ASTRAL_RE.finditer(content))]
+    if not starts:
+        return lambda offset: offset
+
+    def convert(offset):
+        before = bisect.bisect_left(starts, offset)
+        if before and starts[before - 1] + 1 == offset:
+            raise ValueError(f'Offset {offset} splits a character.')
+        return offset - before
+    return convert
+
+
+def splice_content(content, changes, offsets='code_points'):
+    """
+    Apply a list of replacements to a text.
+
+    Each change is a dict with 'start' and 'end' character offsets into the
+    original text and the 'text' replacing that range. Changes must be sorted
+    and must not overlap; an empty range inserts and an empty text deletes.
+    Offsets count code points (Python characters) unless offsets is 'utf-16',
+    where they count UTF-16 code units like JavaScript strings, so a character
+    such as an emoji counts twice.
+
+    Returns:
+        Tuple of (new text, list of (start, end) spans of the new text that changed)
+
+    Raises:
+        ValidationError: If the changes are malformed or out of range
+    """
+    if not isinstance(changes, list) or not changes:
+        raise ValidationError({'changes': 'Send a non-empty list of changes.'})
+    if len(changes) > MAX_PATCH_CHANGES:
+        raise ValidationError({'changes': f'A patch cannot have more than {MAX_PATCH_CHANGES} changes.'})
+    if offsets not in PATCH_OFFSET_UNITS:
+        raise ValidationError({'offsets': f'Offsets are counted in one of: {", ".join(PATCH_OFFSET_UNITS)}.'})
+    convert = utf16_offset_converter(content) if offsets == 'utf-16' else int
+
+    pieces = []
+    regions = []
+    position = 0
+    length = 0
+    for change in changes:
+        try:
+            start, end, text = int(change['start']), int(change['end']), change.get('text', '')
+        except (TypeError, KeyError, ValueError, AttributeError):
+            raise ValidationError({'changes': 'Each change needs integer "start" and "end" and a "text".'})
+        try:
+            start, end = convert(start), convert(end)
+        except ValueError as e:
+            raise ValidationError({'changes': str(e)})
+        if not isinstance(text, str) or not position <= start <= end <= len(content):
+            raise ValidationError({'changes': 'Changes must be sorted, must not overlap and must be within the content.'})
+
+        pieces.append(content[position:start])
+        length += start - position
+        pieces.append(text)
+        regions.append((length, length + len(text)))
+        length += len(text)
+        position = end
+    pieces.append(content[position:])
+
+    return ''.join(pieces), regions
+
+
+def apply_content_patch(user, note_id, base, changes, offsets='code_points'):
+    """
+    Update the content of a note with a list of changes instead of the whole text.
+
+    The patch is only applied if the note has not been saved since the version
+    the client edited (its updated_at). Only the edited regions are checked for
+    prohibited words; the rest of the content was validated when it was saved.
+
+    Args:
+        user: User editing the note
+        note_id: ID of the note
+        base: updated_at of the edited version, as a datetime or ISO 8601 string
+        changes: List of {'start', 'end', 'text'} changes, see splice_content
+        offsets: Unit of the change offsets, 'code_points' or 'utf-16', see splice_content
+
+    Returns:
+        The updated note
+
+    Raises:
+        Note.DoesNotExist: If the note does not exist or the user cannot edit it
+        ValidationError: With code 'stale_base' if the note changed since base,
+            or if the patch or the resulting content is invalid
+    """
+    if isinstance(base, str):
+        try:
+            base = parse_datetime(base)
+        except ValueError:
+            # Well formed but not a real date, like month 13
+            base = None
+    if base is None:
+        raise ValidationError({'base': 'Send the updated_at of the edited version of the note.'})
+
+    with transaction.atomic():
+        note = editable_notes(user).select_for_update().get(pk=note_id)
+        if note.updated_at != base:
+            raise ValidationError(
+                'The note was changed since this version, reload it and apply the changes again.',
+                code='stale_base'
+            )
+
+        content, regions = splice_content(note.content, changes, offsets=offsets or 'code_points')
+        if content == note.content:
+            return note
+
+        try:
+            scan = validate_note_content_change(content, regions)
+        except ValidationError as e:
+            raise ValidationError({'content': e.messages})
+
+        note.content = content
+        note.mark_validated('content', content_scan=scan)
+        note.save()
+
+    return note
+
+
+def restore_revision(user, note_id, number):
+    """
+    Restore the title and content of a note from one of its revisions.
+
+    The note is saved normally, so the version being replaced is recorded as
+    a new revision and the restore itself can be undone.
+
+    Returns:
+        The restored note
+
+    Raises:
+        Note.DoesNotExist: If the note does not exist or the user cannot edit it
+        NoteRevision.DoesNotExist: If the note has no such revision
+        ValidationError: If the restored note is invalid, e.g. over the quota
+    """
+    with transaction.atomic():
+        note = editable_notes(user).select_for_update().get(pk=note_id)
+        revision = note.revisions.get(number=number)
+
+        note.title = revision.title
+        note.content = revision.get_content()
+        note.save()
+
+    return note
+
+
+def prune_revisions(keep=NoteRevision.MAX_REVISIONS, batch_size=1000):
+    """
+    Delete all but the newest keep revisions of every note, batch_size rows per DELETE.
+
+    Older revisions are never needed to rebuild newer ones, so pruning from
+    the oldest end keeps every remaining revision rebuildable.
+
+    Returns:
+        Number of deleted revisions
+    """
+    deleted = 0
+    over_limit = NoteRevision.objects.values('note_id').annotate(
+        latest=Max('number'), total=Count('pk')
+    ).filter(total__gt=keep).order_by('note_id')
+
+    for row in over_limit.iterator():
+        old = NoteRevision.objects.filter(note_id=row['note_id'], number__lte=row['latest'] - keep)
+        while True:
+            ids = list(old.values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                break
+            deleted += NoteRevision.objects.filter(pk__in=ids).delete()[0]
+    return deleted
@@ -8,7 +8,8 @@ from apps.notes.tests.test_models import (
 
 from apps.notes.tests.test_forms import (
     CategoryFormTest,
-    TagFormTest
+    TagFormTest,
+    NoteFormTest
 )
 
 from apps.notes.tests.test_views import (
@@ -23,6 +24,17 @@ from apps.notes.tests.test_api import (
     TagAPITest
 )
 
+from apps.notes.tests.test_services import (
+    TagResolutionTest,
+    CreateNoteServiceTest,
+    BulkOperationsTest,
+    NoteImportTest,
+    ShareNotesServiceTest,
+    DraftAutosaveTest,
+    ContentPatchTest,
+    NoteRevisionTest
+)
+
 # Make all test classes available to the test runner
 __all__ = [
     'CategoryModelTest',
@@ -31,10 +43,19 @@ __all__ = [
     'NoteSharingModelTest',
     'CategoryFormTest',
     'TagFormTest',
+    'NoteFormTest',
     'NoteViewsTest',
     'CategoryViewsTest',
     'TagViewsTest',
     'NoteAPITest',
     'CategoryAPITest',
-    'TagAPITest'
+    'TagAPITest',
+    'TagResolutionTest',
+    'CreateNoteServiceTest',
+    'BulkOperationsTest',
+    'NoteImportTest',
+    'ShareNotesServiceTest',
+    'DraftAutosaveTest',
+    'ContentPatchTest',
+    'NoteRevisionTest'
 ]
@@ -1,10 +1,21 @@
-from django.test import TestCase
+import io
+import os
+import tempfile
+import zlib
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.core.management import call_command
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.urls import reverse
 from django.contrib.auth.models import User
 from rest_framework.test import APIClient
 from rest_framework import status
 
-from apps.notes.models import Category, Tag, Note
+from apps.notes.models import Category, Tag, Note, NoteSharing
+from apps.notes.drafts import PENDING_DRAFTS_KEY
+from apps.notes.tests.test_services import SHARED_CACHES
 
 
 class NoteAPITest(TestCase):
@@ -151,6 +162,206 @@ class NoteAPITest(TestCase):
         )
 
 
+    def test_note_toggle_actions(self):
+        """Test pin, archive and move API actions"""
+        self.client.force_authenticate(user=self.user)
+        
+        response = self.client.post(reverse('api-note-pin', kwargs={'pk': self.note.pk}), {'value': True})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(Note.objects.get(pk=self.note.pk).is_pinned)
+        
+        response = self.client.patch(reverse('api-note-archive', kwargs={'pk': self.note.pk}), {'value': True})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(Note.objects.get(pk=self.note.pk).is_archived)
+        
+        with self.assertNumQueries(1):
+            response = self.client.post(
+                reverse('api-note-move', kwargs={'pk': self.note.pk}), {'category': ''}
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(Note.objects.get(pk=self.note.pk).category)
+        
+        # Other users get a 404
+        self.client.force_authenticate(user=self.other_user)
+        response = self.client.post(reverse('api-note-pin', kwargs={'pk': self.note.pk}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_note_bulk_operations(self):
+        """Test applying several operations with the bulk API action"""
+        self.client.force_authenticate(user=self.user)
+        other_note = Note.objects.create(title='Other', content='Other content', user=self.other_user)
+        operations = [
+            {'op': 'create', 'title': 'Bulk Note', 'content': 'Bulk content', 'tags': [self.tag.pk]},
+            {'op': 'update', 'id': self.note.pk, 'title': 'Renamed'},
+            {'op': 'delete', 'id': other_note.pk},
+            {'op': 'rename', 'id': self.note.pk},
+        ]
+        
+        response = self.client.post(reverse('api-note-bulk'), {'operations': operations}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['succeeded'], 2)
+        self.assertEqual(response.data['failed'], 2)
+        self.assertEqual([r['status'] for r in response.data['results']], ['ok', 'ok', 'error', 'error'])
+        
+        created = Note.objects.get(pk=response.data['results'][0]['id'])
+        self.assertEqual(created.user, self.user)
+        self.assertEqual(list(created.tags.all()), [self.tag])
+        self.assertEqual(Note.objects.get(pk=self.note.pk).title, 'Renamed')
+        # Notes of other users are never touched
+        self.assertTrue(Note.objects.filter(pk=other_note.pk).exists())
+        
+        response = self.client.post(reverse('api-note-bulk'), {'operations': 'nope'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+    @override_settings(IMPORT_UPLOAD_DIR=os.path.join(tempfile.gettempdir(), 'notes-test-imports'))
+    def test_note_import_upload(self):
+        """Test uploading an import file, importing it in the background and reading its progress record"""
+        self.client.force_authenticate(user=self.user)
+        upload = SimpleUploadedFile(
+            'notes.json', b'[{"title": "Imported note", "content": "Imported content"}]',
+            content_type='application/json'
+        )
+        response = self.client.post(reverse('api-import-list'), {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['status'], 'pending')
+        self.assertFalse(Note.objects.filter(user=self.user, title='Imported note').exists())
+        
+        call_command('import_notes', '--pending', stdout=io.StringIO())
+        response = self.client.get(reverse('api-import-detail', kwargs={'pk': response.data['id']}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], 'completed')
+        self.assertEqual(response.data['imported_count'], 1)
+        self.assertTrue(Note.objects.filter(user=self.user, title='Imported note').exists())
+        
+        # Import records are private
+        self.client.force_authenticate(user=self.other_user)
+        response = self.client.get(reverse('api-import-detail', kwargs={'pk': response.data['id']}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_note_bulk_share(self):
+        """Test sharing notes with users through the API"""
+        self.client.force_authenticate(user=self.user)
+        url = reverse('api-note-share')
+        
+        response = self.client.post(url, {
+            'notes': [self.note.pk], 'users': [self.other_user.pk, self.user.pk], 'permission': 'read'
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['created'], 1)
+        # Sharing again does not create duplicates
+        response = self.client.post(url, {'notes': [self.note.pk], 'users': [self.other_user.pk]}, format='json')
+        self.assertEqual(response.data['created'], 0)
+        self.assertEqual(NoteSharing.objects.filter(note=self.note).count(), 1)
+        
+        response = self.client.post(url, {
+            'notes': [self.note.pk], 'users': [self.other_user.pk], 'permission': 'owner'
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_note_patch_content(self):
+        """Test updating the content with a patch through the API"""
+        self.client.force_authenticate(user=self.user)
+        url = reverse('api-note-patch-content', kwargs={'pk': self.note.pk})
+        base = self.client.get(reverse('api-note-detail', kwargs={'pk': self.note.pk})).data['updated_at']
+        
+        response = self.client.post(url, {
+            'base': base, 'changes': [{'start': 8, 'end': 12, 'text': 'patched'}]
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Note.objects.get(pk=self.note.pk).content, 'This is patched content')
+        
+        # The old version is stale now
+        response = self.client.post(url, {
+            'base': base, 'changes': [{'start': 0, 'end': 4, 'text': 'That'}]
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        
+        # Offsets from JavaScript count the emoji as two code units
+        note = Note.objects.get(pk=self.note.pk)
+        note.content = '\U0001F600 This is content'
+        note.save()
+        base = self.client.get(reverse('api-note-detail', kwargs={'pk': self.note.pk})).data['updated_at']
+        response = self.client.post(url, {
+            'base': base, 'offsets': 'utf-16', 'changes': [{'start': 3, 'end': 7, 'text': 'That'}]
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Note.objects.get(pk=self.note.pk).content, '\U0001F600 That is content')
+    
+    def test_search_finds_compressed_content(self):
+        """Test that API search finds text deep inside long notes"""
+        self.client.force_authenticate(user=self.user)
+        long_note = Note.objects.create(
+            title='Long note', content='Lorem ipsum dolor sit amet. ' * 300 + 'needle', user=self.user
+        )
+        self.assertTrue(long_note.is_compressed)
+        
+        response = self.client.get(reverse('api-note-list'), {'search': 'needle'})
+        self.assertEqual([note['id'] for note in response.data['results']], [long_note.pk])
+        response = self.client.get(reverse('api-note-list'), {'search': 'long needle'})
+        self.assertEqual(len(response.data['results']), 1)
+        
+        # Every term must match, and the long note is decompressed once for both terms
+        with mock.patch('apps.notes.models.zlib.decompress', wraps=zlib.decompress) as decompress:
+            response = self.client.get(reverse('api-note-list'), {'search': 'needle missing'})
+        self.assertEqual(response.data['results'], [])
+        self.assertEqual(decompress.call_count, 1)
+        response = self.client.get(reverse('api-note-list'), {'search': 'test content'})
+        self.assertEqual([note['id'] for note in response.data['results']], [self.note.pk])
+    
+    @override_settings(CACHES=SHARED_CACHES)
+    def test_note_draft(self):
+        """Test autosaving, conflicting and discarding a draft through the API"""
+        cache.clear()
+        self.client.force_authenticate(user=self.user)
+        url = reverse('api-note-draft', kwargs={'pk': self.note.pk})
+        
+        response = self.client.put(url, {'content': 5}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        
+        response = self.client.put(url, {'content': 'Draft content'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(url).data['content'], 'Draft content')
+        
+        Note.objects.filter(pk=self.note.pk).update(revision_count=5)
+        response = self.client.post(reverse('api-note-flush-draft', kwargs={'pk': self.note.pk}))
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+        # Discarding removes the draft from the index of the flush command too
+        self.assertEqual(cache.get(PENDING_DRAFTS_KEY), [])
+    
+    def test_note_draft_without_shared_cache(self):
+        """Test that autosave through the API answers 503 with a cache local to the worker"""
+        self.client.force_authenticate(user=self.user)
+        response = self.client.put(
+            reverse('api-note-draft', kwargs={'pk': self.note.pk}), {'content': 'Draft content'}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+    
+    def test_note_revisions(self):
+        """Test listing, reading and restoring earlier versions through the API"""
+        self.client.force_authenticate(user=self.user)
+        self.client.patch(
+            reverse('api-note-detail', kwargs={'pk': self.note.pk}), {'content': 'This is new content'}, format='json'
+        )
+        
+        response = self.client.get(reverse('api-note-revisions', kwargs={'pk': self.note.pk}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([revision['number'] for revision in response.data], [1])
+        
+        response = self.client.get(reverse('api-note-revision', kwargs={'pk': self.note.pk, 'number': 1}))
+        self.assertEqual(response.data['content'], 'This is test content')
+        
+        response = self.client.post(reverse('api-note-restore', kwargs={'pk': self.note.pk, 'number': 1}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['content'], 'This is test content')
+        
+        response = self.client.post(reverse('api-note-restore', kwargs={'pk': self.note.pk, 'number': 9}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
 class CategoryAPITest(TestCase):
     def setUp(self):
         self.client = APIClient()
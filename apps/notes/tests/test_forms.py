@@ -1,8 +1,12 @@
+from unittest import mock
+
 from django.test import TestCase
 from django.contrib.auth.models import User
 
-from apps.notes.models import Category, Tag
-from apps.notes.forms import NoteForm, CategoryForm, TagForm
+from apps.notes.models import Category, Tag, Note, BlockedWord
+from apps.notes.forms import NoteForm, NoteSearchForm, CategoryForm, TagForm
+from apps.notes.validators import ContentScan
+from apps.notes.wordlists import WordMatcher, reload_word_lists
 
 
 class CategoryFormTest(TestCase):
@@ -80,4 +84,103 @@ class TagFormTest(TestCase):
         }
         form = TagForm(data=form_data, user=self.user)
         self.assertFalse(form.is_valid())
-        self.assertIn('name', form.errors) 
\ No newline at end of file
+        self.assertIn('name', form.errors) 
+
+
+class NoteFormTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpassword'
+        )
+    
+    def count_scans(self):
+        """Patch ContentScan to record every text it scans."""
+        scanned = []
+        original_init = ContentScan.__init__
+        
+        def init(scan, value):
+            scanned.append(value)
+            original_init(scan, value)
+        return scanned, mock.patch.object(ContentScan, '__init__', init)
+    
+    def test_content_is_scanned_once_per_save(self):
+        """Test that the form, the model validation and the save share one content scan"""
+        scanned, patch = self.count_scans()
+        with patch:
+            form = NoteForm(data={'title': 'Form Note', 'content': 'Content of the form note'}, user=self.user)
+            self.assertTrue(form.is_valid())
+            note = form.save()
+        self.assertEqual(scanned, ['Content of the form note'])
+        self.assertEqual(note.word_count, 5)
+        
+        scanned, patch = self.count_scans()
+        with patch:
+            form = NoteForm(
+                data={'title': 'Form Note', 'content': 'Edited content of the form note'},
+                instance=Note.objects.get(pk=note.pk), user=self.user
+            )
+            self.assertTrue(form.is_valid())
+            form.save()
+        self.assertEqual(scanned, ['Edited content of the form note'])
+    
+    def test_content_errors(self):
+        """Test that each content check reports its error"""
+        cases = {
+            'Buy cheap SPAM today': 'prohibited word: spam',
+            'Tiny': 'too short',
+            ' '.join(f'http://example{i}.com' for i in range(11)): 'too many URLs (11)',
+            'This is explicit material': 'profanity',
+            'THIS NOTE IS SHOUTING AT YOU': 'excessive capitalization',
+            'ЭТА ЗАМЕТКА КРИЧИТ НА ВАС ВСЕХ': 'excessive capitalization',
+        }
+        for content, error in cases.items():
+            form = NoteForm(data={'title': 'Form Note', 'content': content}, user=self.user)
+            self.assertFalse(form.is_valid())
+            self.assertIn(error, form.errors['content'][0])
+        
+        # Words only match on word boundaries
+        form = NoteForm(data={'title': 'Form Note', 'content': 'Explicitly allowed content'}, user=self.user)
+        self.assertTrue(form.is_valid())
+
+
+    def test_blocked_words(self):
+        """Test that words added to a list are rejected once saved"""
+        self.addCleanup(reload_word_lists)
+        form = NoteForm(data={'title': 'Form Note', 'content': 'Visit my phishing page'}, user=self.user)
+        self.assertTrue(form.is_valid())
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            BlockedWord.objects.create(word_list='content', word=' Phishing ')
+        form = NoteForm(data={'title': 'Form Note', 'content': 'Visit my phishing page'}, user=self.user)
+        self.assertFalse(form.is_valid())
+        self.assertIn('prohibited word: phishing', form.errors['content'][0])
+    
+    def test_word_matcher(self):
+        """Test that long lists compiled to one pattern match like short ones"""
+        words = ['spa', 'spam', 'scam', 'scammer', 'offensive', 'junk', 'junkmail', 'vulgar', 'obscene', 'rude']
+        for whole_words in (False, True):
+            long_matcher = WordMatcher(words, whole_words=whole_words)
+            self.assertIsNotNone(long_matcher.pattern)
+            for text in ('Plain text', 'SPAMMY text', 'a scammer', 'junkmail here', 'so rude!'):
+                expected = {
+                    word for word in words
+                    if WordMatcher([word], whole_words=whole_words).search(text)
+                }
+                found = long_matcher.search(text)
+                self.assertEqual(found is not None, bool(expected), text)
+                if found is not None:
+                    self.assertIn(found, expected)
+    
+    def test_search_finds_compressed_content(self):
+        """Test that searching content finds words beyond the excerpt of long notes"""
+        content = 'Lorem ipsum dolor sit amet. ' * 300 + 'needle'
+        note = Note.objects.create(title='Long note', content=content, user=self.user)
+        self.assertTrue(note.is_compressed)
+        
+        for data in ({'query': 'needle'}, {'query': 'haystack needle', 'search_in': 'content'},
+                     {'query': 'needle', 'exact_match': True}):
+            form = NoteSearchForm(data=data, user=self.user)
+            self.assertTrue(form.is_valid())
+            self.assertEqual(list(form.get_search_queryset(self.user)), [note], data)
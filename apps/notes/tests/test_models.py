@@ -1,8 +1,10 @@
 from django.test import TestCase
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
-from apps.notes.models import Category, Tag, Note, NoteSharing
+from apps.notes.models import Category, Tag, Note, NoteSharing, UserUsage
 
 
 class CategoryModelTest(TestCase):
@@ -103,6 +105,113 @@ class NoteModelTest(TestCase):
         # Проверяем начало строки (символ многоточия может различаться)
         self.assertTrue(note.get_excerpt(10).startswith('This is a'))
 
+    def test_note_content_metrics(self):
+        """Test that excerpt, byte size and word count are stored on save"""
+        note = Note.objects.create(
+            title='Metrics Note',
+            content='Привет world ' * 30,
+            user=self.user
+        )
+        note = Note.objects.defer('content').get(pk=note.pk)
+        self.assertEqual(note.word_count, 60)
+        self.assertEqual(note.content_bytes, len(('Привет world ' * 30).encode('utf-8')))
+        self.assertTrue(note.excerpt.startswith('Привет world'))
+        
+        # Short excerpts are served from the stored column without loading content
+        with self.assertNumQueries(0):
+            self.assertTrue(note.get_excerpt(20).startswith('Привет world'))
+
+    def test_large_content_is_stored_compressed(self):
+        """Test that large content is compressed at rest and read back transparently"""
+        content = 'The quick brown fox jumps over the lazy dog. ' * 200
+        note = Note.objects.create(title='Large Note', content=content, user=self.user)
+        self.assertTrue(note.is_compressed)
+        
+        stored, is_compressed = Note.objects.filter(pk=note.pk).values_list('content', 'is_compressed').get()
+        self.assertEqual(stored, '')
+        self.assertTrue(is_compressed)
+        
+        note = Note.objects.get(pk=note.pk)
+        self.assertEqual(note.content, content)
+        self.assertEqual(note.content_bytes, len(content))
+        self.assertFalse(note.has_changes())
+        
+        # Deferred content is loaded together with its compressed copy
+        note = Note.objects.only('pk', 'content').get(pk=note.pk)
+        self.assertEqual(note.content, content)
+        
+        # Shrinking the content below the threshold stores it uncompressed again
+        note.content = 'Short content now'
+        note.save()
+        stored, is_compressed = Note.objects.filter(pk=note.pk).values_list('content', 'is_compressed').get()
+        self.assertEqual(stored, 'Short content now')
+        self.assertFalse(is_compressed)
+    
+    def test_compressed_content_is_searchable(self):
+        """Test that text beyond the excerpt of compressed notes is found"""
+        content = 'The quick brown fox jumps over the lazy dog. ' * 200 + 'Hidden Zebra'
+        note = Note.objects.create(title='Large Note', content=content, user=self.user)
+        self.assertTrue(note.is_compressed)
+        
+        notes = Note.objects.filter(user=self.user)
+        self.assertEqual(list(notes.filter(Note.content_search('hidden zebra', notes))), [note])
+        self.assertEqual(list(notes.filter(Note.content_search(['giraffe', 'zebra'], notes))), [note])
+        self.assertFalse(notes.filter(Note.content_search('giraffe', notes)).exists())
+    
+    def test_small_content_is_not_compressed(self):
+        """Test that content below the threshold stays in the content column"""
+        self.assertFalse(self.note.is_compressed)
+        self.assertIsNone(Note.objects.get(pk=self.note.pk).content_compressed)
+    
+    def test_bulk_update_keeps_content_compressed(self):
+        """Test that bulk updates leave the content column empty for compressed notes"""
+        note = Note.objects.create(title='Large Note', content='Lorem ipsum dolor sit amet. ' * 300, user=self.user)
+        note.content = 'Consectetur adipiscing elit. ' * 300
+        note.update_content_metrics()
+        Note.objects.bulk_update([note], ['content', *Note.CONTENT_DERIVED_FIELDS])
+        self.assertEqual(note.content, 'Consectetur adipiscing elit. ' * 300)
+        self.assertEqual(Note.objects.filter(pk=note.pk).values_list('content', flat=True).get(), '')
+        self.assertEqual(Note.objects.get(pk=note.pk).content, 'Consectetur adipiscing elit. ' * 300)
+    
+    def test_note_tracks_original_values(self):
+        """Test that loaded notes remember their original field values"""
+        note = Note.objects.get(pk=self.note.pk)
+        self.assertFalse(note.has_changes())
+        
+        note.title = 'Changed Title'
+        note.category = None
+        self.assertEqual(note.get_changed_fields(), {'title', 'category'})
+        self.assertEqual(note.get_original_value('title'), 'Test Note')
+        
+        # Saving uses the loaded values instead of re-reading the row
+        with CaptureQueriesContext(connection) as queries:
+            note.save()
+        self.assertFalse(any(
+            query['sql'].startswith('SELECT') and 'FROM "notes_note"' in query['sql']
+            for query in queries.captured_queries
+        ))
+        self.assertFalse(note.has_changes())
+        self.assertEqual(note.get_original_value('title'), 'Changed Title')
+
+    def test_unchanged_note_save_skips_write(self):
+        """Test that saving a note without changes does not hit the database"""
+        note = Note.objects.get(pk=self.note.pk)
+        with self.assertNumQueries(0):
+            note.save()
+
+    def test_note_save_writes_only_changed_fields(self):
+        """Test that toggling a flag updates only that column"""
+        note = Note.objects.defer('content').get(pk=self.note.pk)
+        note.is_pinned = True
+        with CaptureQueriesContext(connection) as queries:
+            note.save()
+        updates = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('UPDATE "notes_note"')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"is_pinned"', updates[0])
+        self.assertNotIn('"content"', updates[0])
+        self.assertNotIn('"title"', updates[0])
+        self.assertTrue(Note.objects.get(pk=self.note.pk).is_pinned)
+
     def test_note_with_wrong_category(self):
         """Test that a note cannot use a category from another user"""
         user2 = User.objects.create_user(
@@ -186,4 +295,48 @@ class NoteSharingModelTest(TestCase):
         self.note_sharing.save()
         
         # Now shared user can edit
-        self.assertTrue(self.note.can_user_edit(self.shared_user)) 
\ No newline at end of file
+        self.assertTrue(self.note.can_user_edit(self.shared_user)) 
+
+
+class UserUsageModelTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpassword'
+        )
+
+    def test_usage_tracks_note_changes(self):
+        """Test that the ledger follows note creation, edits and deletion"""
+        note = Note.objects.create(title='First Note', content='Some content', user=self.user)
+        usage = UserUsage.objects.get(user=self.user)
+        self.assertEqual(usage.note_count, 1)
+        self.assertEqual(usage.content_bytes, len('Some content'))
+        
+        note.content = 'Some longer content'
+        note.save()
+        usage.refresh_from_db()
+        self.assertEqual(usage.content_bytes, len('Some longer content'))
+        
+        note.delete()
+        usage.refresh_from_db()
+        self.assertEqual(usage.note_count, 0)
+        self.assertEqual(usage.content_bytes, 0)
+
+    def test_missing_usage_is_rebuilt(self):
+        """Test that a missing ledger row is rebuilt from existing notes"""
+        Note.objects.create(title='First Note', content='Some content', user=self.user)
+        UserUsage.objects.filter(user=self.user).delete()
+        
+        usage = UserUsage.for_user(self.user)
+        self.assertEqual(usage.note_count, 1)
+        self.assertEqual(usage.content_bytes, len('Some content'))
+
+    def test_content_quota_uses_ledger(self):
+        """Test that the content quota is enforced from the ledger"""
+        Note.objects.create(title='First Note', content='Some content', user=self.user)
+        UserUsage.objects.filter(user=self.user).update(content_bytes=UserUsage.MAX_CONTENT_BYTES)
+        
+        note = Note(title='Second Note', content='More content', user=self.user)
+        with self.assertRaises(ValidationError):
+            note.full_clean()
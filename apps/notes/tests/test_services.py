@@ -0,0 +1,705 @@
+import io
+import json
+import os
+import tempfile
+import zipfile
+from datetime import timedelta
+
+from django.test import TestCase, override_settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.utils import timezone
+from django.core.cache import cache
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.db import connection
+
+from apps.notes.models import Category, Tag, Note, NoteRevision, UserUsage, NoteImport, NoteSharing
+from apps.notes.services import (
+    parse_tag_names, resolve_tags, attach_tags, create_note, share_notes, splice_content, apply_content_patch,
+    restore_revision, prune_revisions
+)
+from apps.notes.bulk import apply_bulk_operations
+from apps.notes.drafts import save_draft, get_draft, persist_draft, flush_drafts
+from apps.notes.wordlists import get_matcher
+from apps.notes.importers import (
+    iter_json_notes, iter_markdown_notes, iter_enex_notes, import_notes, store_upload, run_pending_imports,
+    fail_stale_imports,
+)
+
+
+class TagResolutionTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpassword'
+        )
+        self.existing = Tag.objects.create(name='Python', user=self.user)
+        self.note = Note.objects.create(
+            title='Test Note',
+            content='This is test content',
+            user=self.user
+        )
+
+    def test_parse_tag_names(self):
+        """Test that tag names are stripped and de-duplicated"""
+        self.assertEqual(
+            parse_tag_names(' python, django ,,Python, web'),
+            ['python', 'django', 'web']
+        )
+
+    def test_resolve_tags_reuses_and_creates(self):
+        """Test that existing tags are matched case-insensitively and missing ones created"""
+        tags = resolve_tags(self.user, ['python', 'django', 'web'])
+        self.assertEqual([tag.name for tag in tags], ['Python', 'django', 'web'])
+        self.assertEqual(tags[0].pk, self.existing.pk)
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 3)
+
+    def test_resolve_and_attach_many_tags_in_fixed_queries(self):
+        """Test that ten new tags are created and attached in a fixed number of queries"""
+        names = [f'tag{i}' for i in range(10)]
+        # Build the tag name word list first, it may be due for a version check
+        get_matcher('name')
+        with self.assertNumQueries(4):
+            attach_tags(self.note, resolve_tags(self.user, names))
+        self.assertEqual(self.note.tags.count(), 10)
+
+
+class CreateNoteServiceTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpassword'
+        )
+        self.category = Category.objects.create(name='Work', user=self.user)
+
+    def test_create_note_with_category_and_tags(self):
+        """Test that a note is created with its category, existing and new tags"""
+        existing = Tag.objects.create(name='existing', user=self.user)
+        note = create_note(
+            self.user,
+            title='Service Note',
+            content='Created through the service',
+            category=self.category.pk,
+            tags=[existing],
+            new_tag_names=['fresh', 'Existing'],
+        )
+        self.assertEqual(note.category, self.category)
+        self.assertEqual(
+            sorted(note.tags.values_list('name', flat=True)),
+            ['existing', 'fresh']
+        )
+        self.assertEqual(UserUsage.objects.get(user=self.user).note_count, 1)
+
+    def test_create_note_query_count_is_fixed(self):
+        """Test that the number of queries does not grow with the number of tags"""
+        def queries_for(tag_count, title):
+            with CaptureQueriesContext(connection) as queries:
+                create_note(
+                    self.user,
+                    title=title,
+                    content='Created through the service',
+                    new_tag_names=[f'{title}tag{i}' for i in range(tag_count)],
+                )
+            return len(queries)
+
+        queries_for(1, 'warmup')  # Creates the usage ledger row
+        self.assertEqual(queries_for(1, 'single'), queries_for(10, 'many'))
+
+    def test_create_note_rejects_foreign_category(self):
+        """Test that another user's category cannot be used"""
+        other_user = User.objects.create_user(username='other', password='password')
+        other_category = Category.objects.create(name='Other', user=other_user)
+        with self.assertRaises(ValidationError):
+            create_note(self.user, title='Bad Note', content='Some content', category=other_category.pk)
+        self.assertFalse(Note.objects.filter(title='Bad Note').exists())
+
+
+class BulkOperationsTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpassword'
+        )
+        self.category = Category.objects.create(name='Work', user=self.user)
+        self.notes = [
+            Note.objects.create(title=f'Note {i}', content=f'Content {i}', user=self.user)
+            for i in range(4)
+        ]
+
+    def test_mixed_operations_update_usage(self):
+        """Test that every operation type is applied and the usage ledger stays exact"""
+        results = apply_bulk_operations(self.user, [
+            {'op': 'create', 'title': 'New', 'content': 'Brand new', 'category': self.category.pk,
+             'new_tags': ['Python', 'python', 'web']},
+            {'op': 'update', 'id': self.notes[0].pk, 'content': 'Longer updated content', 'is_archived': True},
+            {'op': 'pin', 'id': self.notes[1].pk, 'value': True},
+            {'op': 'move', 'id': self.notes[2].pk, 'category': self.category.pk},
+            {'op': 'delete', 'id': self.notes[3].pk},
+        ])
+        self.assertTrue(all(result['status'] == 'ok' for result in results))
+        
+        created = Note.objects.get(pk=results[0]['id'])
+        self.assertEqual(created.category, self.category)
+        self.assertEqual(sorted(created.tags.values_list('name', flat=True)), ['Python', 'web'])
+        self.assertEqual(created.word_count, 2)
+        updated = Note.objects.get(pk=self.notes[0].pk)
+        self.assertTrue(updated.is_archived)
+        self.assertEqual(updated.excerpt, 'Longer updated content')
+        self.assertTrue(Note.objects.get(pk=self.notes[1].pk).is_pinned)
+        self.assertEqual(Note.objects.get(pk=self.notes[2].pk).category, self.category)
+        self.assertFalse(Note.objects.filter(pk=self.notes[3].pk).exists())
+        
+        usage = UserUsage.objects.get(user=self.user)
+        ledger = (usage.note_count, usage.content_bytes)
+        usage.recalculate(commit=False)
+        self.assertEqual(ledger, (usage.note_count, usage.content_bytes))
+
+    def test_invalid_operations_are_reported(self):
+        """Test that invalid operations fail individually without affecting others"""
+        other_user = User.objects.create_user(username='other', password='otherpassword')
+        other_category = Category.objects.create(name='Other', user=other_user)
+        results = apply_bulk_operations(self.user, [
+            {'op': 'create', 'title': '', 'content': 'No title'},
+            {'op': 'move', 'id': self.notes[0].pk, 'category': other_category.pk},
+            {'op': 'pin', 'id': self.notes[1].pk},
+            {'op': 'delete', 'id': self.notes[1].pk},
+            {'op': 'update', 'id': 'abc'},
+        ])
+        self.assertEqual(
+            [result['status'] for result in results],
+            ['error', 'error', 'ok', 'error', 'error']
+        )
+        self.assertIn('title', results[0]['errors'])
+        self.assertIsNone(Note.objects.get(pk=self.notes[0].pk).category)
+        self.assertTrue(Note.objects.filter(pk=self.notes[1].pk).exists())
+        
+        with self.assertRaises(ValidationError):
+            apply_bulk_operations(self.user, {'op': 'delete'})
+
+    def test_invalid_types_are_reported(self):
+        """Test that values of the wrong type fail their operation instead of the request"""
+        results = apply_bulk_operations(self.user, [
+            {'op': 'create', 'title': 'Number', 'content': 5},
+            {'op': 'create', 'title': 'Tags', 'content': 'Some content', 'new_tags': [1]},
+            {'op': 'create', 'title': 'Tag ids', 'content': 'Some content', 'tags': 3},
+            {'op': 'update', 'id': self.notes[0].pk, 'content': ['x']},
+            {'op': 'update', 'id': self.notes[1].pk, 'title': 'Still works'},
+        ])
+        self.assertEqual(
+            [result['status'] for result in results],
+            ['error', 'error', 'error', 'error', 'ok']
+        )
+        self.assertIn('content', results[0]['errors'])
+        self.assertIn('new_tags', results[1]['errors'])
+        self.assertIn('tags', results[2]['errors'])
+        self.assertIn('content', results[3]['errors'])
+        self.assertEqual(Note.objects.get(pk=self.notes[0].pk).content, 'Content 0')
+        self.assertEqual(Note.objects.get(pk=self.notes[1].pk).title, 'Still works')
+
+    def test_creates_respect_note_quota(self):
+        """Test that creates beyond the note quota fail"""
+        UserUsage.objects.filter(user=self.user).update(note_count=UserUsage.MAX_NOTES - 1)
+        results = apply_bulk_operations(self.user, [
+            {'op': 'create', 'title': 'First', 'content': 'Fits in the quota'},
+            {'op': 'create', 'title': 'Second', 'content': 'Over quota'},
+        ])
+        self.assertEqual([result['status'] for result in results], ['ok', 'error'])
+        self.assertFalse(Note.objects.filter(title='Second').exists())
+
+    def test_query_count_does_not_grow_with_operations(self):
+        """Test that the number of queries is fixed per operation type"""
+        def run(count):
+            notes = [
+                Note.objects.create(title=f'Bulk {i}', content='Bulk content', user=self.user)
+                for i in range(2 * count)
+            ]
+            operations = [
+                {'op': 'create', 'title': f'Created {i}', 'content': 'Created content'}
+                for i in range(count)
+            ]
+            operations += [{'op': 'archive', 'id': note.pk, 'value': True} for note in notes[:count]]
+            operations += [{'op': 'delete', 'id': note.pk} for note in notes[count:]]
+            with CaptureQueriesContext(connection) as queries:
+                results = apply_bulk_operations(self.user, operations)
+            self.assertTrue(all(result['status'] == 'ok' for result in results))
+            return len(queries)
+        
+        self.assertEqual(run(2), run(6))
+
+
+ENEX_EXPORT = b"""<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE en-export SYSTEM "http://xml.evernote.com/pub/evernote-export3.dtd">
+<en-export application="Evernote" version="10">
+  <note>
+    <title>Evernote note</title>
+    <content><![CDATA[<?xml version="1.0" encoding="UTF-8"?><en-note><div>First line</div><div>Second &amp; last</div></en-note>]]></content>
+    <tag>travel</tag>
+    <resource><data encoding="base64">aGVsbG8=</data></resource>
+  </note>
+  <note>
+    <title>Another note</title>
+    <content><![CDATA[<en-note>Plain body text</en-note>]]></content>
+  </note>
+</en-export>
+"""
+
+
+class NoteImportTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpassword'
+        )
+
+    def test_json_array_is_parsed_in_small_chunks(self):
+        """Test that the JSON reader decodes notes split across reads"""
+        notes = [{'title': f'Note {i}', 'content': 'Caf\u00e9 content ' * 5, 'tags': ['one']} for i in range(20)]
+        data = json.dumps(notes, ensure_ascii=False).encode('utf-8')
+        parsed = list(iter_json_notes(io.BytesIO(data), chunk_size=7))
+        self.assertEqual([item['title'] for item in parsed], [note['title'] for note in notes])
+        self.assertEqual(parsed[3]['content'], notes[3]['content'])
+
+    def test_markdown_and_enex_parsers(self):
+        """Test that Markdown archives and ENEX exports are turned into notes"""
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zf:
+            zf.writestr('Work/plan.md', '---\ntags: planning, ideas\n---\n# Weekly plan\nWrite the report')
+            zf.writestr('readme.md', 'Notes without a heading')
+            zf.writestr('image.png', b'binary')
+        archive.seek(0)
+        notes = list(iter_markdown_notes(archive))
+        self.assertEqual(len(notes), 2)
+        self.assertEqual(notes[0]['title'], 'Weekly plan')
+        self.assertEqual(notes[0]['content'], 'Write the report')
+        self.assertEqual(notes[0]['category'], 'Work')
+        self.assertEqual(notes[0]['tags'], ['planning', 'ideas'])
+        self.assertEqual(notes[1]['title'], 'readme')
+        
+        notes = list(iter_enex_notes(io.BytesIO(ENEX_EXPORT)))
+        self.assertEqual(notes[0]['title'], 'Evernote note')
+        self.assertEqual(notes[0]['content'], 'First line\nSecond & last')
+        self.assertEqual(notes[0]['tags'], ['travel'])
+        self.assertEqual(notes[1]['content'], 'Plain body text')
+
+    def test_import_notes_in_batches(self):
+        """Test that notes are imported in batches with categories, tags and per-note errors"""
+        Category.objects.create(name='Work', user=self.user)
+        notes = [
+            {'title': f'Imported {i}', 'content': 'Imported content', 'category': 'work' if i % 2 else 'Home',
+             'tags': 'alpha, beta'}
+            for i in range(5)
+        ]
+        notes.insert(2, {'title': 'x', 'content': 'Title is too short'})
+        data = io.BytesIO(json.dumps(notes).encode('utf-8'))
+        
+        note_import = import_notes(self.user, data, 'json', file_name='notes.json', batch_size=2)
+        self.assertEqual(note_import.status, 'completed')
+        self.assertEqual(note_import.imported_count, 5)
+        self.assertEqual(note_import.failed_count, 1)
+        self.assertEqual(note_import.errors[0]['position'], 3)
+        self.assertEqual(note_import.progress, 100)
+        
+        self.assertEqual(Note.objects.filter(user=self.user).count(), 5)
+        self.assertEqual(
+            sorted(Category.objects.filter(user=self.user).values_list('name', flat=True)), ['Home', 'Work']
+        )
+        self.assertEqual(Note.objects.get(title='Imported 1').category.name, 'Work')
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(Note.tags.through.objects.filter(note__user=self.user).count(), 10)
+        self.assertEqual(UserUsage.objects.get(user=self.user).note_count, 5)
+
+    def test_invalid_file_marks_import_failed(self):
+        """Test that an unparsable file fails the import record"""
+        note_import = import_notes(self.user, io.BytesIO(b'{"title": "not an array"}'), 'json')
+        self.assertEqual(note_import.status, 'failed')
+        self.assertTrue(note_import.message)
+        self.assertEqual(NoteImport.objects.get(pk=note_import.pk).status, 'failed')
+        
+        note_import = import_notes(self.user, io.BytesIO(b'[{"title": "Caf\xe9", "content": "Bad text"}]'), 'json')
+        self.assertEqual(note_import.status, 'failed')
+        self.assertIn('UTF-8', note_import.message)
+        
+        class BrokenFile(io.BytesIO):
+            def read(self, *args):
+                raise OSError('Disk error')
+        
+        with self.assertLogs('apps.notes.importers', level='ERROR'):
+            note_import = import_notes(self.user, BrokenFile(b'[]'), 'json')
+        self.assertEqual(NoteImport.objects.get(pk=note_import.pk).status, 'failed')
+        self.assertIn('Disk error', note_import.message)
+
+    def test_string_flags(self):
+        """Test that flags written as strings are parsed, not taken as truthy"""
+        notes = [
+            {'title': 'Not pinned', 'content': 'Some content', 'is_pinned': 'false', 'is_archived': '0'},
+            {'title': 'Pinned note', 'content': 'Some content', 'is_pinned': 'true'},
+            {'title': 'Archived note', 'content': 'Some content', 'is_archived': '1'},
+        ]
+        import_notes(self.user, io.BytesIO(json.dumps(notes).encode('utf-8')), 'json')
+        flags = dict(
+            (title, (pinned, archived))
+            for title, pinned, archived in Note.objects.values_list('title', 'is_pinned', 'is_archived')
+        )
+        self.assertEqual(flags, {
+            'Not pinned': (False, False),
+            'Pinned note': (True, False),
+            'Archived note': (False, True),
+        })
+
+    def test_invalid_types_are_per_note_errors(self):
+        """Test that fields of the wrong type skip their note instead of failing the import"""
+        notes = [
+            {'title': 'Number content', 'content': 5},
+            {'title': 'Number category', 'content': 'Some content', 'category': 7},
+            {'title': 'Number tags', 'content': 'Some content', 'tags': [1, 2]},
+            {'title': 42, 'content': 'Some content'},
+            {'title': 'Valid note', 'content': 'Some content'},
+        ]
+        note_import = import_notes(self.user, io.BytesIO(json.dumps(notes).encode('utf-8')), 'json')
+        self.assertEqual(note_import.status, 'completed')
+        self.assertEqual(note_import.imported_count, 1)
+        self.assertEqual(note_import.failed_count, 4)
+        self.assertEqual(
+            [list(error['errors']) for error in note_import.errors],
+            [['content'], ['category'], ['new_tags'], ['title']]
+        )
+
+
+    @override_settings(IMPORT_UPLOAD_DIR=os.path.join(tempfile.gettempdir(), 'notes-test-imports'))
+    def test_pending_imports_run_once(self):
+        """Test that stored uploads are imported by one run and their files removed"""
+        upload = SimpleUploadedFile('notes.json', b'[{"title": "Later", "content": "Imported later"}]')
+        note_import = store_upload(self.user, upload, 'json')
+        self.assertEqual(note_import.status, 'pending')
+        self.assertTrue(os.path.exists(note_import.upload_path))
+        
+        finished = run_pending_imports()
+        self.assertEqual([item.pk for item in finished], [note_import.pk])
+        note_import.refresh_from_db()
+        self.assertEqual(note_import.status, 'completed')
+        self.assertEqual(note_import.upload_path, '')
+        self.assertTrue(Note.objects.filter(user=self.user, title='Later').exists())
+        self.assertEqual(run_pending_imports(), [])
+
+    def test_stale_running_imports_fail(self):
+        """Test that running imports without progress are marked failed"""
+        note_import = NoteImport.objects.create(user=self.user, source_format='json', status='running')
+        self.assertEqual(fail_stale_imports(), 0)
+        NoteImport.objects.filter(pk=note_import.pk).update(updated_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(fail_stale_imports(), 1)
+        note_import.refresh_from_db()
+        self.assertEqual(note_import.status, 'failed')
+        self.assertIsNotNone(note_import.finished_at)
+
+
+class ShareNotesServiceTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpassword'
+        )
+        self.notes = [
+            Note.objects.create(title=f'Note {i}', content=f'Content {i}', user=self.user)
+            for i in range(3)
+        ]
+        self.users = [
+            User.objects.create_user(username=f'user{i}', password='password')
+            for i in range(NoteSharing.MAX_SHARED_USERS + 1)
+        ]
+
+    def test_share_notes_in_fixed_queries(self):
+        """Test that sharing many notes with many users takes a fixed number of queries"""
+        note_ids = [note.pk for note in self.notes]
+        user_ids = [user.pk for user in self.users[:5]]
+        with CaptureQueriesContext(connection) as queries:
+            created = share_notes(self.user, note_ids, user_ids, 'edit')
+        self.assertEqual(created, 15)
+        self.assertLessEqual(len(queries), 6)
+        self.assertEqual(NoteSharing.objects.filter(permission='edit').count(), 15)
+
+    def test_share_notes_enforces_shared_users_limit(self):
+        """Test that no share is created if a note would exceed the limit"""
+        limit = NoteSharing.MAX_SHARED_USERS
+        share_notes(self.user, [self.notes[0].pk], [user.pk for user in self.users[:limit]])
+        
+        # Already shared users do not count twice
+        self.assertEqual(share_notes(self.user, [self.notes[0].pk], [self.users[0].pk]), 0)
+        
+        with self.assertRaises(ValidationError):
+            share_notes(self.user, [self.notes[0].pk, self.notes[1].pk], [self.users[limit].pk])
+        self.assertFalse(NoteSharing.objects.filter(note=self.notes[1]).exists())
+
+
+# Drafts need a cache shared by all processes
+SHARED_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'notes-test-cache'),
+    }
+}
+
+
+@override_settings(CACHES=SHARED_CACHES)
+class DraftAutosaveTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpassword'
+        )
+        self.note = Note.objects.create(title='Test Note', content='Original content', user=self.user)
+
+    def test_autosave_does_not_touch_the_database(self):
+        """Test that only the first autosave of a note queries the database"""
+        save_draft(self.user, self.note.pk, content='First draft')
+        with self.assertNumQueries(0):
+            for i in range(5):
+                save_draft(self.user, self.note.pk, content=f'Draft number {i}')
+        
+        self.assertEqual(get_draft(self.user, self.note.pk)['content'], 'Draft number 4')
+        self.assertEqual(Note.objects.get(pk=self.note.pk).content, 'Original content')
+        
+        other_user = User.objects.create_user(username='other', password='otherpassword')
+        with self.assertRaises(Note.DoesNotExist):
+            save_draft(other_user, self.note.pk, content='Not my note')
+
+    def test_flush_persists_quiet_drafts_only(self):
+        """Test that flushing saves drafts after the quiet period and removes them"""
+        draft = save_draft(self.user, self.note.pk, title='Draft title', content='Draft content')
+        
+        self.assertEqual(flush_drafts(quiet_period=30, now=draft['saved_at'] + 5), (0, 0))
+        self.assertEqual(Note.objects.get(pk=self.note.pk).title, 'Test Note')
+        
+        self.assertEqual(flush_drafts(quiet_period=30, now=draft['saved_at'] + 60), (1, 0))
+        note = Note.objects.get(pk=self.note.pk)
+        self.assertEqual((note.title, note.content), ('Draft title', 'Draft content'))
+        self.assertIsNone(get_draft(self.user, self.note.pk))
+        self.assertEqual(flush_drafts(quiet_period=0), (0, 0))
+
+    def test_stale_draft_is_not_applied(self):
+        """Test that a draft is not applied over a newer version of the note"""
+        save_draft(self.user, self.note.pk, content='Draft content')
+        note = Note.objects.get(pk=self.note.pk)
+        note.content = 'Saved from another device'
+        note.save()
+        
+        with self.assertRaises(ValidationError):
+            persist_draft(self.user, self.note.pk)
+        self.assertEqual(flush_drafts(quiet_period=0), (0, 1))
+        self.assertEqual(Note.objects.get(pk=self.note.pk).content, 'Saved from another device')
+        # The draft is kept for the user to recover
+        self.assertIsNotNone(get_draft(self.user, self.note.pk))
+
+    def test_pinning_is_not_a_conflict(self):
+        """Test that changes that keep the title and content do not block a draft"""
+        save_draft(self.user, self.note.pk, content='Draft content')
+        note = Note.objects.get(pk=self.note.pk)
+        note.is_pinned = True
+        note.save()
+        
+        persist_draft(self.user, self.note.pk)
+        note = Note.objects.get(pk=self.note.pk)
+        self.assertEqual(note.content, 'Draft content')
+        self.assertTrue(note.is_pinned)
+
+    def test_invalid_drafts(self):
+        """Test that drafts that are not text are rejected"""
+        with self.assertRaises(ValidationError):
+            save_draft(self.user, self.note.pk, content=5)
+        with self.assertRaises(ValidationError):
+            save_draft(self.user, self.note.pk, title=['x'])
+        self.assertIsNone(get_draft(self.user, self.note.pk))
+
+    def test_drafts_need_a_shared_cache(self):
+        """Test that drafts are refused when each process would keep its own"""
+        with self.settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            with self.assertRaises(ImproperlyConfigured):
+                save_draft(self.user, self.note.pk, content='Draft content')
+            with self.assertRaises(ImproperlyConfigured):
+                flush_drafts()
+
+
+class ContentPatchTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpassword'
+        )
+        self.note = Note.objects.create(
+            title='Test Note',
+            content='The quick brown fox jumps over the lazy dog.',
+            user=self.user
+        )
+
+    def test_splice_content(self):
+        """Test that changes are applied at their offsets in the original text"""
+        content, regions = splice_content('Hello big world', [
+            {'start': 0, 'end': 5, 'text': 'Goodbye'},
+            {'start': 6, 'end': 10, 'text': ''},
+            {'start': 15, 'end': 15, 'text': '!'},
+        ])
+        self.assertEqual(content, 'Goodbye world!')
+        self.assertEqual(regions, [(0, 7), (8, 8), (13, 14)])
+        
+        with self.assertRaises(ValidationError):
+            splice_content('Hello', [{'start': 3, 'end': 4, 'text': 'x'}, {'start': 2, 'end': 3, 'text': 'y'}])
+        with self.assertRaises(ValidationError):
+            splice_content('Hello', [{'start': 0, 'end': 10, 'text': 'x'}])
+
+    def test_splice_content_utf16_offsets(self):
+        """Test that UTF-16 offsets count characters outside the BMP twice"""
+        text = 'Hi 😀 there'
+        # Code point offsets count the emoji once
+        self.assertEqual(splice_content(text, [{'start': 5, 'end': 10, 'text': 'you'}])[0], 'Hi 😀 you')
+        # JavaScript offsets count it as a surrogate pair
+        content, regions = splice_content(text, [{'start': 6, 'end': 11, 'text': 'you'}], offsets='utf-16')
+        self.assertEqual(content, 'Hi 😀 you')
+        self.assertEqual(regions, [(5, 8)])
+        
+        with self.assertRaises(ValidationError):
+            splice_content(text, [{'start': 4, 'end': 4, 'text': 'x'}], offsets='utf-16')
+        with self.assertRaises(ValidationError):
+            splice_content(text, [{'start': 0, 'end': 12, 'text': 'x'}], offsets='utf-16')
+        with self.assertRaises(ValidationError):
+            splice_content(text, [{'start': 0, 'end': 1, 'text': 'x'}], offsets='bytes')
+
+    def test_apply_content_patch(self):
+        """Test that a patch updates the content, metrics and usage"""
+        note = apply_content_patch(self.user, self.note.pk, self.note.updated_at, [
+            {'start': 10, 'end': 15, 'text': 'red'},
+        ])
+        self.assertEqual(note.content, 'The quick red fox jumps over the lazy dog.')
+        note = Note.objects.get(pk=self.note.pk)
+        self.assertEqual(note.content, 'The quick red fox jumps over the lazy dog.')
+        self.assertEqual(note.content_bytes, len(note.content))
+        self.assertEqual(UserUsage.objects.get(user=self.user).content_bytes, len(note.content))
+
+    def test_stale_base_is_rejected(self):
+        """Test that a patch against an old version of the note is rejected"""
+        base = self.note.updated_at
+        apply_content_patch(self.user, self.note.pk, base.isoformat(), [{'start': 0, 'end': 3, 'text': 'A'}])
+        with self.assertRaises(ValidationError) as cm:
+            apply_content_patch(self.user, self.note.pk, base.isoformat(), [{'start': 0, 'end': 1, 'text': 'One'}])
+        self.assertEqual(cm.exception.code, 'stale_base')
+
+    def test_invalid_base_is_rejected(self):
+        """Test that a base that is not a valid timestamp is a validation error"""
+        for base in ('yesterday', '2024-13-01T00:00:00Z'):
+            with self.assertRaises(ValidationError) as cm:
+                apply_content_patch(self.user, self.note.pk, base, [{'start': 0, 'end': 1, 'text': 'One'}])
+            self.assertIn('base', cm.exception.message_dict)
+
+    def test_edited_region_is_validated(self):
+        """Test that prohibited words created by a patch are caught, also across the edit boundary"""
+        with self.assertRaises(ValidationError):
+            apply_content_patch(self.user, self.note.pk, self.note.updated_at, [
+                {'start': 4, 'end': 9, 'text': 'spam'},
+            ])
+        # 'sc' + 'am' joins into a prohibited word with the unchanged text
+        note = Note.objects.get(pk=self.note.pk)
+        note.content = 'This is sc and more text here.'
+        note.save()
+        with self.assertRaises(ValidationError):
+            apply_content_patch(self.user, note.pk, note.updated_at, [{'start': 10, 'end': 10, 'text': 'am'}])
+        self.assertEqual(Note.objects.get(pk=note.pk).content, 'This is sc and more text here.')
+
+
+class NoteRevisionTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpassword'
+        )
+        self.note = Note.objects.create(
+            title='Test Note',
+            content=self.version(0),
+            user=self.user
+        )
+
+    def version(self, i):
+        return f'First line of the note\nThis is version {i}\n' + 'Unchanged line\n' * 20
+
+    def edit(self, count):
+        for i in range(1, count + 1):
+            note = Note.objects.get(pk=self.note.pk)
+            note.content = self.version(i)
+            note.save()
+
+    def test_save_records_previous_versions(self):
+        """Test that every content change records the replaced version as a revision"""
+        self.edit(25)
+        note = Note.objects.get(pk=self.note.pk)
+        self.assertEqual(note.revision_count, 25)
+        self.assertEqual(note.revisions.count(), 25)
+        self.assertEqual(
+            list(note.revisions.filter(is_snapshot=True).values_list('number', flat=True)), [20, 10]
+        )
+
+        # Deltas only carry the changed line
+        delta = note.revisions.get(number=25)
+        self.assertFalse(delta.is_snapshot)
+        self.assertLess(len(delta.data), 100)
+
+        for revision in note.revisions.all():
+            # Any version is rebuilt from at most one snapshot and SNAPSHOT_INTERVAL deltas
+            with self.assertNumQueries(2 if revision.number > 20 else 1 if not revision.is_snapshot else 0):
+                content = revision.get_content()
+            self.assertEqual(content, self.version(revision.number - 1))
+
+    def test_save_inserts_one_revision(self):
+        """Test that a change adds a single INSERT to the save and unchanged saves none"""
+        note = Note.objects.get(pk=self.note.pk)
+        note.title = 'Renamed Note'
+        with CaptureQueriesContext(connection) as queries:
+            note.save()
+        inserts = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('INSERT INTO "notes_noterevision"')]
+        self.assertEqual(len(inserts), 1)
+
+        revision = note.revisions.get()
+        self.assertEqual(revision.title, 'Test Note')
+        self.assertEqual(revision.get_content(), self.version(0))
+
+        note.is_pinned = True
+        note.save()
+        self.assertEqual(note.revisions.count(), 1)
+
+    def test_restore_revision(self):
+        """Test that restoring a version records the replaced one, so it can be undone"""
+        self.edit(3)
+        note = restore_revision(self.user, self.note.pk, 1)
+        self.assertEqual(note.content, self.version(0))
+        self.assertEqual(note.revision_count, 4)
+        self.assertEqual(note.revisions.get(number=4).get_content(), self.version(3))
+
+        other = User.objects.create_user(username='otheruser', password='testpassword')
+        with self.assertRaises(Note.DoesNotExist):
+            restore_revision(other, self.note.pk, 1)
+        with self.assertRaises(NoteRevision.DoesNotExist):
+            restore_revision(self.user, self.note.pk, 99)
+
+    def test_bulk_update_records_revisions(self):
+        """Test that bulk updates record revisions like single saves"""
+        apply_bulk_operations(self.user, [{'op': 'update', 'id': self.note.pk, 'content': self.version(1)}])
+        note = Note.objects.get(pk=self.note.pk)
+        self.assertEqual(note.revision_count, 1)
+        self.assertEqual(note.revisions.get(number=1).get_content(), self.version(0))
+
+    def test_prune_revisions(self):
+        """Test that pruning keeps the newest revisions rebuildable"""
+        self.edit(12)
+        self.assertEqual(prune_revisions(keep=5, batch_size=3), 7)
+
+        revisions = list(NoteRevision.objects.filter(note=self.note))
+        self.assertEqual([revision.number for revision in revisions], [12, 11, 10, 9, 8])
+        for revision in revisions:
+            self.assertEqual(revision.get_content(), self.version(revision.number - 1))
+
@@ -1,8 +1,10 @@
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
+from django.core.cache import cache
 from django.urls import reverse
 from django.contrib.auth.models import User
 
-from apps.notes.models import Category, Tag, Note
+from apps.notes.models import Category, Tag, Note, NoteSharing
+from apps.notes.tests.test_services import SHARED_CACHES
 
 
 class NoteViewsTest(TestCase):
@@ -139,6 +141,125 @@ class NoteViewsTest(TestCase):
         )
 
 
+    def test_note_toggle_views(self):
+        """Test pin, archive and move endpoints"""
+        self.client.login(username='testuser', password='testpassword')
+        
+        response = self.client.post(reverse('notes:pin', kwargs={'pk': self.note.pk}), {'value': 'true'})
+        self.assertRedirects(response, reverse('notes:detail', kwargs={'pk': self.note.pk}))
+        self.assertTrue(Note.objects.get(pk=self.note.pk).is_pinned)
+        
+        # Archiving removes the pin
+        self.client.post(reverse('notes:archive', kwargs={'pk': self.note.pk}))
+        note = Note.objects.get(pk=self.note.pk)
+        self.assertTrue(note.is_archived)
+        self.assertFalse(note.is_pinned)
+        
+        self.client.post(reverse('notes:move', kwargs={'pk': self.note.pk}), {'category': ''})
+        self.assertIsNone(Note.objects.get(pk=self.note.pk).category)
+
+    def test_note_toggle_views_permissions(self):
+        """Test that other users cannot pin or move a note"""
+        other_category = Category.objects.create(name='Other Category', user=self.other_user)
+        
+        self.client.login(username='otheruser', password='otherpassword')
+        self.client.post(reverse('notes:pin', kwargs={'pk': self.note.pk}), {'value': 'true'})
+        self.assertFalse(Note.objects.get(pk=self.note.pk).is_pinned)
+        
+        # The owner cannot move a note into someone else's category
+        self.client.login(username='testuser', password='testpassword')
+        self.client.post(reverse('notes:move', kwargs={'pk': self.note.pk}), {'category': other_category.pk})
+        self.assertEqual(Note.objects.get(pk=self.note.pk).category, self.category)
+
+
+    @override_settings(CACHES=SHARED_CACHES)
+    def test_note_autosave_view(self):
+        """Test that autosaved drafts are restored in the edit form and dropped on save"""
+        cache.clear()
+        self.client.login(username='testuser', password='testpassword')
+        response = self.client.post(
+            reverse('notes:autosave', kwargs={'pk': self.note.pk}),
+            {'title': 'Draft Title', 'content': 'Unsaved draft content'}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Note.objects.get(pk=self.note.pk).title, 'Test Note')
+        
+        response = self.client.get(reverse('notes:edit', kwargs={'pk': self.note.pk}))
+        self.assertContains(response, 'Unsaved draft content')
+        
+        self.client.post(reverse('notes:edit', kwargs={'pk': self.note.pk}), {
+            'title': 'Saved Title', 'content': 'Saved content', 'category': self.category.pk,
+        })
+        response = self.client.get(reverse('notes:edit', kwargs={'pk': self.note.pk}))
+        self.assertNotContains(response, 'Unsaved draft content')
+        
+        # Other users cannot autosave drafts of the note
+        self.client.login(username='otheruser', password='otherpassword')
+        response = self.client.post(
+            reverse('notes:autosave', kwargs={'pk': self.note.pk}), {'content': 'Not mine'}
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_autosave_disabled_without_shared_cache(self):
+        """Test that autosave is turned off instead of failing with a cache local to the worker"""
+        self.client.login(username='testuser', password='testpassword')
+        response = self.client.get(reverse('notes:edit', kwargs={'pk': self.note.pk}))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, 'data-autosave-url')
+        
+        response = self.client.post(
+            reverse('notes:autosave', kwargs={'pk': self.note.pk}), {'content': 'Unsaved draft content'}
+        )
+        self.assertEqual(response.status_code, 503)
+
+    def test_note_history_view(self):
+        """Test viewing and restoring an earlier version of a note"""
+        self.client.login(username='testuser', password='testpassword')
+        self.client.post(reverse('notes:edit', kwargs={'pk': self.note.pk}), {
+            'title': 'Saved Title', 'content': 'Saved content', 'category': self.category.pk,
+        })
+        
+        response = self.client.get(reverse('notes:history', kwargs={'pk': self.note.pk}) + '?revision=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'This is test content')
+        
+        response = self.client.post(reverse('notes:restore_revision', kwargs={'pk': self.note.pk, 'number': 1}))
+        self.assertRedirects(response, reverse('notes:detail', kwargs={'pk': self.note.pk}))
+        note = Note.objects.get(pk=self.note.pk)
+        self.assertEqual((note.title, note.content), ('Test Note', 'This is test content'))
+        
+        # Users who cannot edit the note cannot see its history
+        self.client.login(username='otheruser', password='otherpassword')
+        response = self.client.get(reverse('notes:history', kwargs={'pk': self.note.pk}))
+        self.assertRedirects(response, reverse('notes:list'))
+    
+    def test_note_bulk_share_view(self):
+        """Test sharing several notes with several users from the UI"""
+        second_note = Note.objects.create(title='Second Note', content='Second content', user=self.user)
+        third_user = User.objects.create_user(username='thirduser', password='thirdpassword')
+        
+        self.client.login(username='testuser', password='testpassword')
+        response = self.client.get(reverse('notes:bulk_share'))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, '>testuser<')
+        
+        response = self.client.post(reverse('notes:bulk_share'), {
+            'notes': [self.note.pk, second_note.pk],
+            'users': [self.other_user.pk, third_user.pk],
+            'permission': 'edit',
+        })
+        self.assertRedirects(response, reverse('notes:list'))
+        self.assertEqual(NoteSharing.objects.filter(permission='edit').count(), 4)
+        
+        # Notes of other users cannot be selected
+        other_note = Note.objects.create(title='Other Note', content='Other content', user=self.other_user)
+        response = self.client.post(reverse('notes:bulk_share'), {
+            'notes': [other_note.pk], 'users': [third_user.pk], 'permission': 'read',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(NoteSharing.objects.filter(note=other_note).exists())
+
+
 class CategoryViewsTest(TestCase):
     def setUp(self):
         self.client = Client()
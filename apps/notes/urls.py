@@ -5,15 +5,24 @@ app_name = 'notes'
 
 urlpatterns = [
     path('', views.dashboard, name='dashboard'),
+    path('health/', views.health_check, name='health'),
     path('notes/', views.note_list, name='list'),
     path('notes/create/', views.note_create, name='create'),
     path('notes/<int:pk>/', views.note_detail, name='detail'),
     path('notes/<int:pk>/edit/', views.note_edit, name='edit'),
+    path('notes/<int:pk>/autosave/', views.note_autosave, name='autosave'),
+    path('notes/<int:pk>/patch/', views.note_patch_content, name='patch_content'),
     path('notes/<int:pk>/delete/', views.note_delete, name='delete'),
+    path('notes/<int:pk>/history/', views.note_history, name='history'),
+    path('notes/<int:pk>/history/<int:number>/restore/', views.note_restore_revision, name='restore_revision'),
+    path('notes/<int:pk>/pin/', views.note_pin, name='pin'),
+    path('notes/<int:pk>/archive/', views.note_archive, name='archive'),
+    path('notes/<int:pk>/move/', views.note_move, name='move'),
     path('notes/export/pdf/', views.export_notes, name='export_pdf'),
     path('notes/search/', views.advanced_search, name='advanced_search'),
     
     # New note action URLs
+    path('notes/share/', views.note_bulk_share, name='bulk_share'),
     path('notes/<int:pk>/share/', views.note_share, name='share'),
     path('notes/<int:pk>/share/<int:share_id>/delete/', views.note_share_delete, name='share_delete'),
     path('notes/<int:pk>/attachment/add/', views.note_add_attachment, name='add_attachment'),
@@ -8,27 +8,33 @@ from django.utils.translation import gettext_lazy as _
 from django.core.validators import FileExtensionValidator
 from django.db import models
 
+from .wordlists import WordMatcher, get_matcher
+
 
 class BlacklistValidator:
     """
     Validator for checking if text contains blacklisted words.
+    Checks either a fixed list of words, or a named list from apps.notes.wordlists.
     """
-    def __init__(self, blacklist=None, message=None):
+    def __init__(self, blacklist=None, message=None, word_list=None):
         self.blacklist = blacklist or []
+        self.word_list = word_list
         self.message = message or _("This text contains prohibited word: %(word)s")
+        # Fixed lists are compiled once, named lists are looked up on each call to pick up changes
+        self.matcher = WordMatcher(self.blacklist) if word_list is None else None
 
     def __call__(self, value):
         if not value:
             return
         
-        value_lower = value.lower()
-        for word in self.blacklist:
-            if word.lower() in value_lower:
-                raise ValidationError(
-                    self.message,
-                    params={'word': word},
-                    code='blacklisted_word'
-                )
+        matcher = self.matcher or get_matcher(self.word_list)
+        word = matcher.search(value)
+        if word is not None:
+            raise ValidationError(
+                self.message,
+                params={'word': word},
+                code='blacklisted_word'
+            )
 
 
 class SpecialCharValidator:
@@ -86,27 +92,20 @@ class LengthValidator:
 class ProfanityValidator:
     """
     Validator for checking if text contains profanity.
-    Uses a more comprehensive list than BlacklistValidator.
+    Matches whole words of the 'profanity' word list (add more words in the
+    NOTES_WORD_LISTS setting or as BlockedWord rows), or of a fixed list.
     """
     def __init__(self, profanity_list=None, message=None):
-        self.profanity_list = profanity_list or [
-            'profanity', 'obscene', 'vulgar', 'explicit',
-            # Add more profanity words here
-        ]
+        self.profanity_list = profanity_list
         self.message = message or _("This text contains profanity.")
+        self.matcher = WordMatcher(profanity_list, whole_words=True) if profanity_list else None
 
     def __call__(self, value):
         if not value:
             return
         
-        value_lower = value.lower()
-        found_profanity = []
-        
-        for word in self.profanity_list:
-            if re.search(r'\b' + re.escape(word) + r'\b', value_lower):
-                found_profanity.append(word)
-        
-        if found_profanity:
+        matcher = self.matcher or get_matcher('profanity')
+        if matcher.search(value) is not None:
             raise ValidationError(
                 self.message,
                 code='contains_profanity'
@@ -142,13 +141,27 @@ class HTMLContentValidator:
                 )
         else:
             # No tags allowed
-            if re.search(r'<[^>]*>', value):
+            if self.pattern.search(value):
                 raise ValidationError(
                     self.message,
                     code='html_not_allowed'
                 )
 
 
+# Validators shared by the functions below, built once instead of on every call
+_title_blacklist = BlacklistValidator(word_list='title')
+_content_blacklist = BlacklistValidator(word_list='content')
+_name_blacklist = BlacklistValidator(word_list='name')
+_profanity = ProfanityValidator()
+_no_html = HTMLContentValidator()
+_title_length = LengthValidator(min_length=3, max_length=200)
+_content_length = LengthValidator(min_length=5)
+_category_name_length = LengthValidator(min_length=2, max_length=100)
+_tag_name_length = LengthValidator(min_length=2, max_length=50)
+_category_name_chars = SpecialCharValidator(allowed_chars=r'a-zA-Z0-9\s_-')
+_tag_name_chars = SpecialCharValidator(allowed_chars=r'a-zA-Z0-9_-')
+
+
 # Common validators for notes
 def validate_note_title(value):
     """
@@ -158,53 +171,188 @@ def validate_note_title(value):
     - Must not contain prohibited words
     """
     # Check for prohibited words
-    prohibited_words = ['spam', 'junk', 'inappropriate', 'offensive']
-    BlacklistValidator(blacklist=prohibited_words)(value)
+    _title_blacklist(value)
     
     # Check length
-    LengthValidator(min_length=3, max_length=200)(value)
+    _title_length(value)
     
     # Check for HTML tags (simple check)
-    HTMLContentValidator()(value)
+    _no_html(value)
     
     # Check for profanity
-    ProfanityValidator()(value)
+    _profanity(value)
+
+
+# Characters of unchanged text around an edited region that are re-checked
+# for prohibited words (longer than any prohibited word)
+CONTENT_CHANGE_CONTEXT = 64
+
+
+# URLs counted by the content checks
+URL_PATTERN = re.compile(r'https?://(?:[-\w.]|(?:%[\da-fA-F]{2}))+')
 
+_ASCII_UPPERCASE = b'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+_ASCII_LOWERCASE = b'abcdefghijklmnopqrstuvwxyz'
 
-def validate_note_content(value):
+
+class ContentScan:
+    """
+    Everything the note content checks look at, gathered in one scan of the text.
+    
+    The text is lowercased once and shared by the word list matchers. For
+    ASCII text letters are counted with bytes.translate instead of per
+    character. The byte size and word count are kept as well, so a note saved
+    with a scan of its content does not measure it again.
+    """
+    
+    def __init__(self, value):
+        value = value or ''
+        self.value = value
+        self.length = len(value)
+        
+        lowered = value.lower()
+        self.prohibited_word = get_matcher('content').search(lowered, lowered=True)
+        self.has_profanity = get_matcher('profanity').search(lowered, lowered=True) is not None
+        self.url_count = len(URL_PATTERN.findall(value)) if 'http' in value else 0
+        
+        if value.isascii():
+            data = value.encode('ascii')
+            self.content_bytes = len(data)
+            self.uppercase = len(data) - len(data.translate(None, _ASCII_UPPERCASE))
+            self.letters = self.uppercase + len(data) - len(data.translate(None, _ASCII_LOWERCASE))
+        else:
+            self.content_bytes = len(value.encode('utf-8'))
+            letters = ''.join(filter(str.isalpha, value))
+            self.letters = len(letters)
+            self.uppercase = sum(map(str.isupper, letters))
+        
+        self.word_count = len(value.split())
+    
+    def matches(self, value):
+        """Check if this scan is of the given text."""
+        return self.value is value or self.value == value
+
+
+def validate_note_content(value, scan=None):
     """
     Validate note content.
     - Must not be empty
     - Must not be too short
     - Must not contain prohibited words
+    
+    Args:
+        value: The content
+        scan: ContentScan of value, if the caller already has one
     """
+    if not value:
+        return
+    if scan is None or not scan.matches(value):
+        scan = ContentScan(value)
+    
     # Check for prohibited words
-    prohibited_words = ['spam', 'scam', 'offensive', 'inappropriate']
-    BlacklistValidator(blacklist=prohibited_words)(value)
+    if scan.prohibited_word:
+        raise ValidationError(
+            _content_blacklist.message,
+            params={'word': scan.prohibited_word},
+            code='blacklisted_word'
+        )
     
     # Check length
-    LengthValidator(min_length=5)(value)
+    if scan.length < 5:
+        raise ValidationError(
+            _content_length.message_min,
+            params={'min': 5, 'current': scan.length},
+            code='text_too_short'
+        )
     
     # Check for suspicious patterns (e.g., excessive URLs)
-    url_count = len(re.findall(r'https?://(?:[-\w.]|(?:%[\da-fA-F]{2}))+', value))
-    if url_count > 10:
+    _check_url_count(scan)
+    
+    # Check for profanity
+    if scan.has_profanity:
+        raise ValidationError(_profanity.message, code='contains_profanity')
+    
+    # Check for excessive capitalization (shouting)
+    _check_capitalization(scan)
+
+
+def _check_url_count(scan):
+    """Reject content with more than 10 URLs."""
+    if scan.url_count > 10:
         raise ValidationError(
             _("Content contains too many URLs (%(count)d). Maximum allowed is 10."),
-            params={'count': url_count},
+            params={'count': scan.url_count},
             code='too_many_urls'
         )
+
+
+def _check_capitalization(scan):
+    """Reject longer content where more than 70% of the letters are uppercase."""
+    if scan.length > 20 and scan.letters and scan.uppercase / scan.letters > 0.7:  # Only check longer content
+        raise ValidationError(
+            _("Content contains excessive capitalization."),
+            code='excessive_caps'
+        )
+
+
+def _region_window(value, start, end):
+    """
+    Get the text around value[start:end] that word checks must look at.
     
-    # Check for profanity
-    ProfanityValidator()(value)
+    The window extends CONTENT_CHANGE_CONTEXT characters on each side and then
+    to the nearest word boundary, so substring and word-boundary matches inside it
+    behave as in the whole text. Returns None if no boundary is found nearby.
+    """
+    limit = CONTENT_CHANGE_CONTEXT * 4
+    left = max(0, start - CONTENT_CHANGE_CONTEXT)
+    while left > 0 and (value[left - 1].isalnum() or value[left - 1] == '_'):
+        left -= 1
+        if start - left > limit:
+            return None
+    right = min(len(value), end + CONTENT_CHANGE_CONTEXT)
+    while right < len(value) and (value[right].isalnum() or value[right] == '_'):
+        right += 1
+        if right - end > limit:
+            return None
+    return value[left:right]
+
+
+def validate_note_content_change(value, regions):
+    """
+    Validate note content after a partial edit.
     
-    # Check for excessive capitalization (shouting)
-    if len(value) > 20:  # Only check longer content
-        uppercase_ratio = sum(1 for c in value if c.isupper()) / len([c for c in value if c.isalpha()])
-        if uppercase_ratio > 0.7:  # If more than 70% of alphabetic chars are uppercase
-            raise ValidationError(
-                _("Content contains excessive capitalization."),
-                code='excessive_caps'
-            )
+    Word checks (prohibited words, profanity) only look at the edited regions
+    and the text around them, as the rest of the content passed
+    validate_note_content before. Checks of the whole text (length, URLs,
+    capitalization) still run on all of it.
+    
+    Args:
+        value: The new content
+        regions: List of (start, end) spans of value that were inserted or changed
+    
+    Returns:
+        The ContentScan of value, to save the note without measuring it again
+    """
+    scan = ContentScan(value)
+    
+    windows = []
+    for start, end in regions:
+        window = _region_window(value, start, end)
+        if window is None:
+            # Unusually long words around the edit, check everything
+            validate_note_content(value, scan=scan)
+            return scan
+        windows.append(window)
+    
+    # A newline cannot be part of a prohibited word, so the windows are checked together
+    edited = '\n'.join(windows)
+    _content_blacklist(edited)
+    _profanity(edited)
+    
+    _content_length(value)
+    _check_url_count(scan)
+    _check_capitalization(scan)
+    return scan
 
 
 # Category validators
@@ -217,18 +365,16 @@ def validate_category_name(value):
     - Must contain only allowed characters
     """
     # Check for prohibited words
-    prohibited_words = ['spam', 'junk', 'test', 'undefined', 'none']
-    BlacklistValidator(blacklist=prohibited_words)(value)
+    _name_blacklist(value)
     
     # Check length
-    LengthValidator(min_length=2, max_length=100)(value)
+    _category_name_length(value)
     
     # Check characters
-    allowed_chars = r'a-zA-Z0-9\s_-'
-    SpecialCharValidator(allowed_chars=allowed_chars)(value)
+    _category_name_chars(value)
     
     # Check for profanity
-    ProfanityValidator()(value)
+    _profanity(value)
 
 
 # Tag validators
@@ -241,15 +387,13 @@ def validate_tag_name(value):
     - Must contain only allowed characters
     """
     # Check for prohibited words
-    prohibited_words = ['spam', 'junk', 'test', 'undefined', 'none']
-    BlacklistValidator(blacklist=prohibited_words)(value)
+    _name_blacklist(value)
     
     # Check length
-    LengthValidator(min_length=2, max_length=50)(value)
+    _tag_name_length(value)
     
     # Check characters - tags should be more restrictive
-    allowed_chars = r'a-zA-Z0-9_-'
-    SpecialCharValidator(allowed_chars=allowed_chars)(value)
+    _tag_name_chars(value)
     
     # Tags should not start with numbers
     if re.match(r'^\d', value):
@@ -259,7 +403,7 @@ def validate_tag_name(value):
         )
     
     # Check for profanity
-    ProfanityValidator()(value)
+    _profanity(value)
 
 
 # File validators
@@ -292,7 +436,7 @@ validate_image_file_extension = FileExtensionValidator(
 
 
 # System validators
-def validate_user_quota(user, model_class, max_count, message=None):
+def validate_user_quota(user, model_class, max_count, message=None, current_count=None):
     """
     Validate user quota for models (notes, categories, tags).
     
@@ -301,8 +445,10 @@ def validate_user_quota(user, model_class, max_count, message=None):
         model_class: Model class to check count
         max_count: Maximum allowed count
         message: Custom error message
+        current_count: Known current count (e.g. from the usage ledger) to skip the COUNT query
     """
-    current_count = model_class.objects.filter(user=user).count()
+    if current_count is None:
+        current_count = model_class.objects.filter(user=user).count()
     
     if current_count >= max_count:
         model_name = model_class._meta.verbose_name_plural.lower()
@@ -316,7 +462,7 @@ def validate_user_quota(user, model_class, max_count, message=None):
         )
 
 
-def validate_content_quota(user, current_size=0, max_size=None):
+def validate_content_quota(user, current_size=0, max_size=None, usage=None):
     """
     Validate total content size quota for a user.
     
@@ -324,20 +470,18 @@ def validate_content_quota(user, current_size=0, max_size=None):
         user: User object
         current_size: Size of current content being added (in bytes)
         max_size: Maximum allowed total size (in bytes)
+        usage: UserUsage row of the user, fetched from the ledger if not given
     """
-    if max_size is None:
-        max_size = 10 * 1024 * 1024  # Default 10MB
+    from .models import UserUsage
     
-    # Calculate total size of all user's notes
-    from django.db.models import Sum
-    from django.db.models.functions import Length
-    from .models import Note
+    if max_size is None:
+        max_size = UserUsage.MAX_CONTENT_BYTES  # Default 10MB
     
-    total_size = Note.objects.filter(user=user).aggregate(
-        total=Sum(Length('content'))
-    )['total'] or 0
+    # Total size of all user's notes is kept in the usage ledger
+    if usage is None:
+        usage = UserUsage.for_user(user)
     
-    new_total = total_size + current_size
+    new_total = usage.content_bytes + current_size
     
     if new_total > max_size:
         raise ValidationError(
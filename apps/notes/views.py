@@ -3,8 +3,10 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.http import HttpResponse, Http404, JsonResponse
 from django.contrib import messages
+from django.core.exceptions import ImproperlyConfigured, ValidationError
 from django.db.models import Q, Count
 from django.urls import reverse
+from django.utils.http import url_has_allowed_host_and_scheme
 from django.views.decorators.http import require_POST
 import io
 from reportlab.pdfgen import canvas
@@ -15,11 +17,21 @@ from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch, cm
 from datetime import datetime
 
-from .models import Note, Category, Tag, NoteSharing, NoteAttachment
-from .forms import NoteForm, CategoryForm, TagForm, NoteSearchForm, NoteSharingForm, NoteAttachmentForm
+from .models import Note, NoteRevision, Category, Tag, NoteSharing, NoteAttachment
+from .forms import (
+    NoteForm, CategoryForm, TagForm, NoteSearchForm, NoteSharingForm, BulkNoteSharingForm, NoteAttachmentForm,
+    NoteContentPatchForm
+)
+from .services import parse_flag, set_note_pinned, set_note_archived, move_note, editable_notes, restore_revision
+from .drafts import save_draft, get_draft, discard_draft, autosave_available
 from apps.accounts.validators import require_role, validate_object_owner, validate_object_permission
 
 
+def health_check(request):
+    """Tell load balancers and monitoring that the application is up."""
+    return JsonResponse({'status': 'ok'})
+
+
 @login_required
 def dashboard(request):
     """Display user dashboard with statistics."""
@@ -35,6 +47,7 @@ def dashboard(request):
     
     # Get most recent notes
     recent_notes = Note.objects.filter(user=request.user) \
+                  .defer_content() \
                   .order_by('-updated_at')[:5]
     
     context = {
@@ -61,6 +74,9 @@ def note_list(request):
         # If form is not valid or not submitted, show default view
         notes = Note.objects.filter(user=request.user, is_archived=False).order_by('-is_pinned', '-updated_at')
     
+    # Listings render the precomputed excerpt, so skip loading note bodies
+    notes = notes.defer_content()
+    
     # Get categories and tags for sidebar
     categories = Category.objects.filter(user=request.user)
     tags = Tag.objects.filter(user=request.user)
@@ -124,59 +140,24 @@ def note_detail(request, pk):
 def note_create(request):
     """Create a new note."""
     if request.method == 'POST':
-        # Extract form data manually
-        title = request.POST.get('title', '')
-        content = request.POST.get('content', '')
-        category_id = request.POST.get('category', None)
-        new_tags = request.POST.get('new_tags', '')
-        
-        # Debug information
-        print(f"POST data: {request.POST}")
-        print(f"Title: {title}")
-        print(f"Content: {content}")
-        print(f"Category ID: {category_id}")
-        print(f"New tags: {new_tags}")
-        
-        try:
-            # Create note object directly
-            note = Note(
-                title=title,
-                content=content,
-                user=request.user
-            )
-            
-            # Set category if provided
-            if category_id and category_id != '':
-                try:
-                    category = Category.objects.get(id=category_id, user=request.user)
-                    note.category = category
-                except Category.DoesNotExist:
-                    messages.warning(request, "Selected category does not exist.")
-            
-            # Save the note
-            note.save()
-            
-            # Process new tags if provided
-            if new_tags:
-                tag_names = [t.strip() for t in new_tags.split(',') if t.strip()]
-                for tag_name in tag_names:
-                    try:
-                        tag, created = Tag.objects.get_or_create(
-                            name=tag_name,
-                            user=request.user
-                        )
-                        note.tags.add(tag)
-                    except Exception as e:
-                        messages.warning(request, f"Could not add tag '{tag_name}': {str(e)}")
-            
-            messages.success(request, "Note created successfully!")
-            return redirect('notes:detail', pk=note.pk)
-        except Exception as e:
-            messages.error(request, f"Error creating note: {str(e)}")
-            print(f"Exception: {str(e)}")
-            # Create form with POST data to display validation errors
-            form = NoteForm(request.POST, user=request.user)
-            form.is_valid()  # Run validation to generate error messages
+        form = NoteForm(request.POST, user=request.user)
+        if form.is_valid():
+            try:
+                note = form.save()
+                
+                # Display any warnings
+                warnings = form.get_warnings()
+                for field, messages_list in warnings.items():
+                    for message in messages_list:
+                        messages.warning(request, message)
+                
+                messages.success(request, "Note created successfully!")
+                return redirect('notes:detail', pk=note.pk)
+            except ValidationError as e:
+                # Quota and model validation errors are shown on the form
+                form.add_error(None, e.messages)
+            except Exception as e:
+                messages.error(request, f"Error creating note: {str(e)}")
     else:
         form = NoteForm(user=request.user)
     
@@ -203,6 +184,8 @@ def note_edit(request, pk):
             if form.is_valid():
                 try:
                     note = form.save()
+                    # The explicit save supersedes the autosaved draft
+                    discard_draft(request.user, note.pk)
                     
                     # Display any warnings
                     warnings = form.get_warnings()
@@ -215,13 +198,23 @@ def note_edit(request, pk):
                 except Exception as e:
                     messages.error(request, f'Error updating note: {str(e)}')
         else:
-            form = NoteForm(instance=note, user=request.user)
+            # Restore an autosaved draft that was not saved yet
+            draft = get_draft(request.user, note.pk)
+            initial = {}
+            if draft is not None:
+                initial['title'] = draft['title']
+                if draft['content'] is not None:
+                    initial['content'] = draft['content']
+                messages.info(request, 'Restored your unsaved draft of this note.')
+            form = NoteForm(instance=note, user=request.user, initial=initial)
         
         return render(request, 'notes/note_form.html', {
             'form': form,
             'title': 'Edit Note',
             'button_text': 'Update',
             'note': note,
+            # Without a shared cache the editor does not autosave at all
+            'autosave_url': reverse('notes:autosave', kwargs={'pk': note.pk}) if autosave_available() else None,
         })
     
     except Note.DoesNotExist:
@@ -229,6 +222,46 @@ def note_edit(request, pk):
         return redirect('notes:list')
 
 
+@login_required
+@require_POST
+def note_autosave(request, pk):
+    """Autosave a draft of a note to the cache without writing the note."""
+    try:
+        draft = save_draft(request.user, pk, request.POST.get('title'), request.POST.get('content'))
+    except Note.DoesNotExist:
+        return JsonResponse({'error': 'Note not found'}, status=404)
+    except ValidationError as e:
+        return JsonResponse({'error': ' '.join(e.messages)}, status=400)
+    except ImproperlyConfigured:
+        return JsonResponse({'error': 'Autosave is disabled on this server.'}, status=503)
+    return JsonResponse({'saved_at': draft['saved_at']})
+
+
+@login_required
+@require_POST
+def note_patch_content(request, pk):
+    """Apply a list of changes to the content of a note, for editors of large notes."""
+    form = NoteContentPatchForm(request.POST, note_id=pk, user=request.user)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+    
+    try:
+        note = form.save()
+    except Note.DoesNotExist:
+        return JsonResponse({'error': 'Note not found'}, status=404)
+    except ValidationError as e:
+        if getattr(e, 'code', None) == 'stale_base':
+            return JsonResponse({'error': e.message}, status=409)
+        return JsonResponse({'errors': e.message_dict if hasattr(e, 'error_dict') else e.messages}, status=400)
+    
+    discard_draft(request.user, note.pk)
+    return JsonResponse({
+        'id': note.pk,
+        'updated_at': note.updated_at.isoformat(),
+        'content_bytes': note.content_bytes,
+    })
+
+
 @login_required
 def note_delete(request, pk):
     """Delete a note."""
@@ -249,6 +282,100 @@ def note_delete(request, pk):
     return render(request, 'notes/note_confirm_delete.html', {'note': note})
 
 
+@login_required
+def note_history(request, pk):
+    """List the earlier versions of a note, showing one of them with ?revision=<number>."""
+    try:
+        note = editable_notes(request.user).get(pk=pk)
+    except Note.DoesNotExist:
+        messages.error(request, "Note not found or you don't have permission to edit it.")
+        return redirect('notes:list')
+    
+    # The list only needs the metadata, not the stored deltas
+    revisions = note.revisions.defer('data')
+    
+    selected = None
+    selected_content = None
+    number = request.GET.get('revision', '')
+    if number.isdigit():
+        selected = note.revisions.filter(number=int(number)).first()
+        if selected is not None:
+            selected_content = selected.get_content()
+    
+    return render(request, 'notes/note_history.html', {
+        'note': note,
+        'revisions': revisions,
+        'selected': selected,
+        'selected_content': selected_content,
+    })
+
+
+@login_required
+@require_POST
+def note_restore_revision(request, pk, number):
+    """Restore a note to one of its earlier versions."""
+    try:
+        restore_revision(request.user, pk, number)
+    except Note.DoesNotExist:
+        messages.error(request, "Note not found or you don't have permission to edit it.")
+        return redirect('notes:list')
+    except NoteRevision.DoesNotExist:
+        messages.error(request, 'This version of the note no longer exists.')
+        return redirect('notes:history', pk=pk)
+    except ValidationError as e:
+        messages.error(request, f"Error restoring note: {' '.join(e.messages)}")
+        return redirect('notes:history', pk=pk)
+    
+    # The restored version supersedes the autosaved draft
+    discard_draft(request.user, pk)
+    messages.success(request, f'Note restored to version {number}.')
+    return redirect('notes:detail', pk=pk)
+
+
+def _redirect_after_note_action(request, pk):
+    """Redirect back to the page given in 'next', or to the note."""
+    next_url = request.POST.get('next')
+    if next_url and url_has_allowed_host_and_scheme(next_url, allowed_hosts={request.get_host()}):
+        return redirect(next_url)
+    return redirect('notes:detail', pk=pk)
+
+
+@login_required
+@require_POST
+def note_pin(request, pk):
+    """Pin, unpin or toggle the pin of a note without going through the edit form."""
+    if set_note_pinned(request.user, pk, parse_flag(request.POST.get('value'))):
+        messages.success(request, 'Note pin updated.')
+    else:
+        messages.error(request, "Note not found or you don't have permission to edit it.")
+    return _redirect_after_note_action(request, pk)
+
+
+@login_required
+@require_POST
+def note_archive(request, pk):
+    """Archive, unarchive or toggle the archive state of a note without going through the edit form."""
+    if set_note_archived(request.user, pk, parse_flag(request.POST.get('value'))):
+        messages.success(request, 'Note archive state updated.')
+    else:
+        messages.error(request, "Note not found or you don't have permission to edit it.")
+    return _redirect_after_note_action(request, pk)
+
+
+@login_required
+@require_POST
+def note_move(request, pk):
+    """Move a note to another category without going through the edit form."""
+    category_id = request.POST.get('category') or None
+    if category_id is not None and not category_id.isdigit():
+        messages.error(request, 'Invalid category.')
+    elif move_note(request.user, pk, int(category_id) if category_id else None):
+        messages.success(request, 'Note moved successfully.')
+    else:
+        messages.error(request, "Note or category not found, or you don't have permission to edit the note.")
+    return _redirect_after_note_action(request, pk)
+
+
 @login_required
 def category_list(request):
     """Display a list of user's categories."""
@@ -371,7 +498,7 @@ def category_detail(request, pk):
         messages.error(request, str(e))
         return redirect('notes:category_list')
     
-    notes = Note.objects.filter(category=category, user=request.user)
+    notes = Note.objects.filter(category=category, user=request.user).defer_content()
     
     return render(request, 'notes/category_detail.html', {
         'category': category,
@@ -469,7 +596,7 @@ def tag_detail(request, pk):
         messages.error(request, str(e))
         return redirect('notes:tag_list')
     
-    notes = Note.objects.filter(tags=tag, user=request.user)
+    notes = Note.objects.filter(tags=tag, user=request.user).defer_content()
     
     return render(request, 'notes/tag_detail.html', {
         'tag': tag,
@@ -752,6 +879,27 @@ def note_share(request, pk):
         return redirect('notes:list')
 
 
+@login_required
+def note_bulk_share(request):
+    """Share several notes with several users at once."""
+    if request.method == 'POST':
+        form = BulkNoteSharingForm(request.POST, user=request.user)
+        if form.is_valid():
+            try:
+                created = form.save()
+                messages.success(request, f'Created {created} new shares.')
+                return redirect('notes:list')
+            except ValidationError as e:
+                form.add_error(None, e.messages)
+    else:
+        form = BulkNoteSharingForm(user=request.user, initial={'notes': request.GET.getlist('notes')})
+    
+    return render(request, 'notes/note_bulk_share.html', {
+        'form': form,
+        'max_shared_users': NoteSharing.MAX_SHARED_USERS,
+    })
+
+
 @login_required
 @require_POST
 def note_share_delete(request, pk, share_id):
@@ -835,7 +983,7 @@ def note_delete_attachment(request, pk, attachment_id):
 @login_required
 def shared_notes_list(request):
     """Display a list of notes shared with the user."""
-    notes = Note.objects.filter(shared_with=request.user)
+    notes = Note.objects.filter(shared_with=request.user).defer_content()
     
     return render(request, 'notes/shared_notes_list.html', {
         'notes': notes,
@@ -848,7 +996,7 @@ def notes_shared_by_me(request):
     """Display a list of notes the user has shared with others."""
     # Get distinct notes that the user has shared with others
     shared_note_ids = NoteSharing.objects.filter(note__user=request.user).values_list('note_id', flat=True).distinct()
-    notes = Note.objects.filter(id__in=shared_note_ids)
+    notes = Note.objects.filter(id__in=shared_note_ids).defer_content()
     
     # For each note, add a list of users it's shared with
     for note in notes:
@@ -869,7 +1017,7 @@ def advanced_search(request):
     # Only process search if the form was submitted
     notes = []
     if request.GET and form.is_valid():
-        notes = form.get_search_queryset(request.user)
+        notes = form.get_search_queryset(request.user).defer_content()
     
     # Get categories and tags for the form
     categories = Category.objects.filter(user=request.user)
@@ -0,0 +1,169 @@
+"""
+Word lists for Notes Manager validators.
+Each list is compiled once into a WordMatcher shared by all validators. The
+lists come from the NOTES_WORD_LISTS setting (or the defaults below) plus the
+BlockedWord rows of the database, and are rebuilt when either changes.
+"""
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.db import DatabaseError
+from django.dispatch import receiver
+
+
+DEFAULT_WORD_LISTS = {
+    'title': ['spam', 'junk', 'inappropriate', 'offensive'],
+    'content': ['spam', 'scam', 'offensive', 'inappropriate'],
+    'name': ['spam', 'junk', 'test', 'undefined', 'none'],
+    'profanity': ['profanity', 'obscene', 'vulgar', 'explicit'],
+}
+
+# Lists whose words only match as whole words
+WHOLE_WORD_LISTS = {'profanity'}
+
+# Lists with at most this many words are matched with substring searches,
+# which beat a single regex on short lists
+SMALL_LIST_SIZE = 8
+
+# Cache key of the version stamp of the lists, changed whenever a list changes
+WORD_LISTS_VERSION_KEY = 'word-lists:version'
+
+# Seconds between checks of the version stamp by each process
+WORD_LISTS_CHECK_INTERVAL = 5
+
+
+def _trie_pattern(words):
+    """
+    Build a regular expression matching any of the words, shaped like a trie.
+
+    Words sharing a prefix share one branch, so at each position of the text
+    the regex follows a single path of the trie, like an Aho-Corasick
+    automaton, instead of trying every word in turn.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = None  # End of a word
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        if len(branches) == 1 and '' not in node:
+            return branches[0]
+        group = '(?:' + '|'.join(branches) + ')'
+        # A word ending here makes the rest of the branch optional
+        return group + '?' if '' in node else group
+
+    return build(trie)
+
+
+class WordMatcher:
+    """
+    Find any of a list of words in a text, ignoring case.
+
+    Long lists are compiled into one trie-shaped regex, so a text is scanned
+    once whatever the number of words. Short lists are searched word by word
+    with substring checks, and for whole words only the words that occur are
+    checked for word boundaries.
+    """
+
+    def __init__(self, words, whole_words=False):
+        self.words = list(dict.fromkeys(word.strip().lower() for word in words if word and word.strip()))
+        self.whole_words = whole_words
+
+        self.pattern = None
+        self.word_patterns = {}
+        if len(self.words) > SMALL_LIST_SIZE:
+            pattern = _trie_pattern(self.words)
+            self.pattern = re.compile(rf'\b(?:{pattern})\b' if whole_words else pattern)
+        elif whole_words:
+            self.word_patterns = {word: re.compile(rf'\b{re.escape(word)}\b') for word in self.words}
+
+    def search(self, text, lowered=False):
+        """
+        Get the first word of the list found in text, or None.
+
+        Pass lowered=True if text is already lowercase.
+        """
+        if not text or not self.words:
+            return None
+        if not lowered:
+            text = text.lower()
+
+        if self.pattern is not None:
+            match = self.pattern.search(text)
+            return match.group() if match else None
+
+        for word in self.words:
+            if word in text and (not self.whole_words or self.word_patterns[word].search(text)):
+                return word
+        return None
+
+
+_lock = threading.Lock()
+_matchers = {}
+_version = None
+_checked_at = 0.0
+
+
+def get_word_list(name):
+    """Get the words of a list from the settings (or the defaults) and the database."""
+    words = list(getattr(settings, 'NOTES_WORD_LISTS', {}).get(name, DEFAULT_WORD_LISTS.get(name, [])))
+    from .models import BlockedWord
+    try:
+        words += BlockedWord.objects.filter(word_list=name).values_list('word', flat=True)
+    except DatabaseError:
+        # Table not created yet, e.g. while migrating
+        pass
+    return words
+
+
+def get_matcher(name):
+    """Get the shared WordMatcher of a word list, rebuilding it if the list changed."""
+    global _version, _checked_at
+
+    now = time.monotonic()
+    if now - _checked_at > WORD_LISTS_CHECK_INTERVAL:
+        # Another process may have changed the lists
+        version = cache.get(WORD_LISTS_VERSION_KEY)
+        with _lock:
+            if version != _version:
+                _matchers.clear()
+                _version = version
+            _checked_at = now
+
+    matcher = _matchers.get(name)
+    if matcher is None:
+        matcher = WordMatcher(get_word_list(name), whole_words=name in WHOLE_WORD_LISTS)
+        with _lock:
+            _matchers[name] = matcher
+    return matcher
+
+
+def reload_word_lists():
+    """Drop the compiled lists of this process, they are rebuilt on next use."""
+    with _lock:
+        _matchers.clear()
+
+
+def word_lists_changed():
+    """Rebuild the lists in this process and tell other processes to rebuild theirs."""
+    global _version
+    version = time.time_ns()
+    cache.set(WORD_LISTS_VERSION_KEY, version, timeout=None)
+    with _lock:
+        _matchers.clear()
+        _version = version
+
+
+@receiver(setting_changed)
+def _reload_on_setting_changed(setting, **kwargs):
+    if setting == 'NOTES_WORD_LISTS':
+        reload_word_lists()
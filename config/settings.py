@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 import os
+import sys
 from pathlib import Path
 
 # Try to import dotenv if available
@@ -57,16 +58,18 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'apps.accounts.middleware.MetricsMiddleware',  # Per-view metrics, served at /metrics
+    'apps.accounts.middleware.MemoryMiddleware',  # Per-view worker memory and recycling
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'apps.accounts.middleware.ProfilerMiddleware',  # Profiles requests with a '_profile' token
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'apps.accounts.middleware.RoleMiddleware',  # Role checking middleware
-    'apps.accounts.middleware.RequestValidationMiddleware',  # Request validation middleware
-    'apps.accounts.middleware.RateLimitMiddleware',  # Rate limiting middleware
-    'apps.accounts.middleware.ContentSecurityPolicyMiddleware',  # CSP middleware
+    # Role checking, request validation, rate limiting and CSP middleware,
+    # run only for the route classes that need them
+    'apps.accounts.middleware.RequestPipelineMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -121,6 +124,114 @@ else:
     }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+# Note drafts are autosaved to the cache. With several workers use a shared
+# backend: 'redis' (CACHE_LOCATION=redis://host:6379/1) or 'database'
+# (run `python manage.py createcachetable` first).
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'locmem')
+
+if CACHE_BACKEND == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('CACHE_LOCATION', 'redis://127.0.0.1:6379/1'),
+        }
+    }
+elif CACHE_BACKEND == 'database':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': os.environ.get('CACHE_LOCATION', 'notes_cache'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Rate limit counters must be shared by all workers: 'sqlite' keeps them in a
+# file for the workers of one host, 'cache' in the cache above for several
+# hosts (CACHE_BACKEND=redis only: the local memory cache is per process and
+# the database cache cannot count atomically, both fall back to 'sqlite').
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'sqlite')
+RATE_LIMIT_LOCATION = os.environ.get('RATE_LIMIT_LOCATION') or None
+
+# Test runs count in a private in-memory database, not in the counters of
+# earlier runs
+if sys.argv[1:2] == ['test'] and RATE_LIMIT_BACKEND == 'sqlite':
+    RATE_LIMIT_LOCATION = ':memory:'
+
+# Files uploaded to /api/imports/ wait here, outside the public media
+# directory, until `manage.py import_notes --pending` imports them
+IMPORT_UPLOAD_DIR = os.environ.get('IMPORT_UPLOAD_DIR', os.path.join(BASE_DIR, 'imports'))
+
+# Running imports without progress for this many seconds are marked failed,
+# the process importing them was killed
+IMPORT_STALE_AFTER = int(os.environ.get('IMPORT_STALE_AFTER', '600'))
+
+# Directory where each worker writes its metrics, so /metrics adds up all
+# workers. Without it /metrics only shows the worker answering the request.
+METRICS_DIR = os.environ.get('METRICS_DIR') or None
+
+# Token Prometheus sends as 'Authorization: Bearer <token>' to read /metrics,
+# which is otherwise only readable by admins
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Workers using more resident memory than this after a request exit once
+# the response is sent, and gunicorn starts a fresh one (0 disables it)
+MEMORY_MAX_RSS_MB = int(os.environ.get('MEMORY_MAX_RSS_MB', '0'))
+
+# Frames kept per allocation when tracing memory from worker start for
+# /metrics/memory (0: tracing starts on the first snapshot instead)
+MEMORY_TRACE_FRAMES = int(os.environ.get('MEMORY_TRACE_FRAMES', '0'))
+
+# Seconds tracing started by a /metrics/memory snapshot lasts, it slows down
+# every allocation of the worker
+MEMORY_TRACE_SECONDS = int(os.environ.get('MEMORY_TRACE_SECONDS', '300'))
+
+# Profiling tokens made by `manage.py make_profile_token` expire after this
+# many seconds
+PROFILE_TOKEN_MAX_AGE = int(os.environ.get('PROFILE_TOKEN_MAX_AGE', str(24 * 60 * 60)))
+
+# Slow query and N+1 detection, for development and staging: queries slower
+# than QUERY_LOG_SLOW_MS and query shapes run more than
+# QUERY_LOG_REPEAT_THRESHOLD times in a request are logged to QUERY_LOG_FILE
+# and listed in the admin (Query reports)
+QUERY_LOG = os.environ.get('QUERY_LOG', 'False').lower() == 'true'
+QUERY_LOG_SLOW_MS = int(os.environ.get('QUERY_LOG_SLOW_MS', '100'))
+QUERY_LOG_REPEAT_THRESHOLD = int(os.environ.get('QUERY_LOG_REPEAT_THRESHOLD', '5'))
+QUERY_LOG_FILE = os.environ.get('QUERY_LOG_FILE', BASE_DIR / 'queries.log')
+
+if QUERY_LOG:
+    MIDDLEWARE.insert(
+        MIDDLEWARE.index('apps.accounts.middleware.MemoryMiddleware') + 1,
+        'apps.accounts.middleware.QueryLogMiddleware'
+    )
+    LOGGING = {
+        'version': 1,
+        'disable_existing_loggers': False,
+        'handlers': {
+            'query_log': {
+                'class': 'logging.handlers.RotatingFileHandler',
+                'filename': QUERY_LOG_FILE,
+                'maxBytes': 5 * 1024 * 1024,
+                'backupCount': 5,
+            },
+        },
+        'loggers': {
+            'apps.accounts.queries': {
+                'handlers': ['query_log'],
+                'level': 'WARNING',
+                'propagate': False,
+            },
+        },
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -16,9 +16,12 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
+from apps.accounts.views import metrics_view, memory_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
+    path('metrics/memory', memory_view, name='metrics_memory'),
     path('', include('apps.notes.urls')),
     path('accounts/', include('apps.accounts.urls')),
     path('auth/', include('social_django.urls', namespace='social')),
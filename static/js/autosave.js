@@ -0,0 +1,56 @@
+/**
+ * Draft autosave for the note edit form
+ */
+document.addEventListener('DOMContentLoaded', function() {
+    const form = document.querySelector('form[data-autosave-url]');
+    if (!form) return;
+    
+    const url = form.dataset.autosaveUrl;
+    const title = document.getElementById('id_title');
+    const content = document.getElementById('id_content');
+    const status = document.getElementById('autosave-status');
+    const csrfToken = form.querySelector('input[name="csrfmiddlewaretoken"]').value;
+    
+    // Wait for a pause in typing before sending the draft
+    const DELAY = 3000;
+    let timer = null;
+    let lastSaved = title.value + '\u0000' + content.value;
+    
+    function saveDraft() {
+        const current = title.value + '\u0000' + content.value;
+        if (current === lastSaved) return;
+        
+        const data = new FormData();
+        data.append('title', title.value);
+        data.append('content', content.value);
+        
+        fetch(url, {
+            method: 'POST',
+            headers: {'X-CSRFToken': csrfToken},
+            body: data,
+            credentials: 'same-origin'
+        }).then(function(response) {
+            if (response.ok) {
+                lastSaved = current;
+                if (status) status.textContent = 'Draft saved';
+            } else if (status) {
+                status.textContent = 'Draft not saved';
+            }
+        }).catch(function() {
+            if (status) status.textContent = 'Draft not saved';
+        });
+    }
+    
+    function scheduleSave() {
+        clearTimeout(timer);
+        timer = setTimeout(saveDraft, DELAY);
+    }
+    
+    title.addEventListener('input', scheduleSave);
+    content.addEventListener('input', scheduleSave);
+    
+    // The form submit saves the note itself
+    form.addEventListener('submit', function() {
+        clearTimeout(timer);
+    });
+});